@@ -0,0 +1,286 @@
+'''
+Description:
+Load test of the gateway. Starts the app on a fresh SQLite database next to a local stub
+upstream (benchmarks/stub_upstream.py), then drives each scenario at each concurrency
+level for a fixed duration and reports requests per second and latency percentiles.
+
+Scenarios:
+- token: POST /token with the admin credentials (password hashing bound)
+- crud_read: authenticated GET /users
+- proxy: authenticated GET /stub/bench proxied to the stub upstream
+
+Usage, from the repository root:
+    python -m benchmarks.run --concurrency 1,10,50 --duration 10 --save baseline.json
+    python -m benchmarks.run --compare baseline.json --tolerance 0.15
+
+With --compare the exit code is 1 if a scenario lost more than `tolerance` of its
+throughput or its p95/p99 grew by more than that.
+'''
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import httpx
+import yaml
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("token", "crud_read", "proxy")
+ADMIN_CREDENTIALS = {"username": "fakemail@fmail.com", "password": "admin"}
+
+
+#region Statistics
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    '''
+    Description:
+    Nearest rank percentile of an already sorted list, 0 for an empty one.
+    '''
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+def summarize(scenario: str, concurrency: int, latencies: list[float], errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+    }
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    '''
+    Description:
+    Returns a description of every result that regressed by more than `tolerance` (a fraction)
+    against the baseline result of the same scenario and concurrency.
+    '''
+    previous = {(result["scenario"], result["concurrency"]): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        name = f"{result['scenario']} x{result['concurrency']}"
+        if before["rps"] > 0 and result["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rps']} rps, was {before['rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if before[key] > 0 and result[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {result[key]}, was {before[key]}")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors, was {before['errors']}")
+    return regressions
+
+COLUMNS = ("scenario", "concurrency", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms")
+
+def format_row(values) -> str:
+    # Fixed widths so rows printed one at a time line up
+    return "  ".join(str(value).rjust(max(len(column), 10)) for value, column in zip(values, COLUMNS))
+
+def format_table(results: list[dict]) -> str:
+    return "\n".join([format_row(COLUMNS)] + [format_row(result[column] for column in COLUMNS) for result in results])
+
+#endregion Statistics
+
+#region Processes
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            httpx.get(url, timeout = 1.0)
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not start within {timeout} seconds")
+            time.sleep(0.1)
+
+@contextmanager
+def serve(app: str, port: int, cwd: str, env: dict, workers: int = 1):
+    '''
+    Description:
+    Runs an ASGI app with uvicorn in a subprocess for the duration of the block.
+    '''
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd = cwd,
+        env = {**os.environ, "PYTHONPATH": ROOT, **env},
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/")
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout = 10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def write_config(directory: str, overrides: dict) -> str:
+    '''
+    Description:
+    Writes the config.yaml of the benchmarked gateway, the gateway reads it from its working directory.
+    '''
+    config = {
+        "SQLALCHEMY_DATABASE_URL": f"sqlite:///{os.path.join(directory, 'benchmark.db')}",
+        "SECRET_KEY": "benchmark-secret",
+        **overrides,
+    }
+    path = os.path.join(directory, "config.yaml")
+    with open(path, "w") as file:
+        yaml.safe_dump(config, file)
+    return path
+
+#endregion Processes
+
+#region Load generation
+
+async def drive(client: httpx.AsyncClient, send, concurrency: int, duration: float, warmup: float) -> tuple[list[float], int, float]:
+    '''
+    Description:
+    Runs `concurrency` workers sending requests back to back. Requests finished during the
+    first `warmup` seconds are not counted. Returns the latencies, the error count and the
+    measured duration.
+    '''
+    latencies: list[float] = []
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+
+    async def worker():
+        nonlocal errors
+        while True:
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                return
+            try:
+                response = await send(client)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            done = time.perf_counter()
+            if done < measure_from:
+                continue
+            if failed:
+                errors += 1
+            else:
+                latencies.append(done - sent)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - measure_from
+
+def scenario_requests(token: str) -> dict:
+    headers = {"Authorization": f"Bearer {token}"}
+    return {
+        "token": lambda client: client.post("/token", data = ADMIN_CREDENTIALS),
+        "crud_read": lambda client: client.get("/users", headers = headers),
+        "proxy": lambda client: client.get("/stub/bench", headers = headers),
+    }
+
+async def run_scenarios(gateway_url: str, stub_url: str, scenarios: list[str], levels: list[int], duration: float, warmup: float) -> list[dict]:
+    limits = httpx.Limits(max_connections = max(levels), max_keepalive_connections = max(levels))
+    async with httpx.AsyncClient(base_url = gateway_url, limits = limits, timeout = 30.0) as client:
+        response = await client.post("/token", data = ADMIN_CREDENTIALS)
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        response = await client.post(
+            "/register/stub",
+            json = {"name": "stub", "description": "benchmark stub", "url": stub_url, "endpoints": {}},
+            headers = {"Authorization": f"Bearer {token}"},
+        )
+        response.raise_for_status()
+
+        requests = scenario_requests(token)
+        results = []
+        for scenario in scenarios:
+            for concurrency in levels:
+                latencies, errors, elapsed = await drive(client, requests[scenario], concurrency, duration, warmup)
+                result = summarize(scenario, concurrency, latencies, errors, elapsed)
+                print(format_row(result[column] for column in COLUMNS), flush = True)
+                results.append(result)
+        return results
+
+#endregion Load generation
+
+
+def parse_arguments(arguments = None):
+    parser = argparse.ArgumentParser(description = "Benchmark the gateway against a local stub upstream")
+    parser.add_argument("--scenarios", default = ",".join(SCENARIOS), help = "Comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default = "1,10,50", help = "Comma separated concurrency levels")
+    parser.add_argument("--duration", type = float, default = 10.0, help = "Measured seconds per scenario and level")
+    parser.add_argument("--warmup", type = float, default = 1.0, help = "Unmeasured seconds before each measurement")
+    parser.add_argument("--stub-latency", type = float, default = 0.005, help = "Seconds the stub upstream waits before answering")
+    parser.add_argument("--stub-payload", type = int, default = 1024, help = "Body size of the stub upstream in bytes")
+    parser.add_argument("--workers", type = int, default = 1, help = "Uvicorn workers of the gateway")
+    parser.add_argument("--setting", action = "append", default = [], metavar = "KEY=VALUE", help = "Gateway setting, value parsed as YAML")
+    parser.add_argument("--save", help = "Writes the results as a baseline to this JSON file")
+    parser.add_argument("--compare", help = "Baseline JSON file to compare the results with")
+    parser.add_argument("--tolerance", type = float, default = 0.10, help = "Allowed regression against the baseline, as a fraction")
+    return parser.parse_args(arguments)
+
+def main(arguments = None) -> int:
+    options = parse_arguments(arguments)
+    scenarios = [scenario for scenario in options.scenarios.split(",") if scenario]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in options.concurrency.split(",")]
+    overrides = {}
+    for setting in options.setting:
+        key, _, value = setting.partition("=")
+        overrides[key] = yaml.safe_load(value)
+
+    with tempfile.TemporaryDirectory(prefix = "gateway-benchmark-") as directory:
+        write_config(directory, overrides)
+        stub_env = {"BENCH_STUB_LATENCY": str(options.stub_latency), "BENCH_STUB_PAYLOAD": str(options.stub_payload)}
+        with serve("benchmarks.stub_upstream:app", free_port(), ROOT, stub_env) as stub_url, \
+                serve("main:app", free_port(), directory, {}, options.workers) as gateway_url:
+            print(format_row(COLUMNS), flush = True)
+            results = asyncio.run(run_scenarios(gateway_url, stub_url, scenarios, levels, options.duration, options.warmup))
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": {key: value for key, value in vars(options).items() if key not in ("save", "compare")},
+        "results": results,
+    }
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump(report, file, indent = 2)
+        print(f"Saved the baseline to {options.save}")
+
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline["results"], options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regression beyond {options.tolerance:.0%} against {options.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+'''
+Description:
+Minimal upstream service for the benchmarks, a raw ASGI app so its own overhead stays
+negligible. Every request is answered after BENCH_STUB_LATENCY seconds with a body of
+BENCH_STUB_PAYLOAD bytes. Run with: uvicorn benchmarks.stub_upstream:app
+'''
+import asyncio
+import os
+
+
+LATENCY = float(os.environ.get("BENCH_STUB_LATENCY", "0"))
+PAYLOAD = b"x" * int(os.environ.get("BENCH_STUB_PAYLOAD", "1024"))
+HEADERS = [
+    (b"content-type", b"application/octet-stream"),
+    (b"content-length", str(len(PAYLOAD)).encode()),
+]
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    # Drains the request body, if any
+    while (await receive()).get("more_body"):
+        pass
+    if LATENCY > 0:
+        await asyncio.sleep(LATENCY)
+    await send({"type": "http.response.start", "status": 200, "headers": HEADERS})
+    await send({"type": "http.response.body", "body": PAYLOAD})
@@ -0,0 +1,55 @@
+import asyncio
+from typing import NamedTuple
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+import dependencies
+from database import models
+from database.database import routing_sessionmaker
+from internal import authorization, initialization, registry
+from router import crud_endpoints
+
+
+class FakeClock:
+    '''
+    Clock passed to the components taking a `clock` function, advanced by setting `now`.
+    '''
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TempDatabase(NamedTuple):
+    engine: object
+    async_engine: object
+    SessionLocal: sessionmaker
+
+
+@pytest.fixture
+def temp_database(tmp_path, monkeypatch):
+    '''
+    Empty SQLite database in tmp_path used by the application instead of the one of config.yaml,
+    so tests can write without leaving rows behind. Seeded with the admin on startup of the app.
+    '''
+    path = tmp_path / "app.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args = {"check_same_thread": False})
+    models.Base.metadata.create_all(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    SessionLocal = sessionmaker(autocommit = False, autoflush = False, bind = engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush = False, expire_on_commit = False)
+
+    for module in (dependencies, initialization, crud_endpoints):
+        monkeypatch.setattr(module, "SessionLocal", SessionLocal)
+    for module in (dependencies, registry, authorization):
+        monkeypatch.setattr(module, "AsyncSessionLocal", AsyncSessionLocal)
+    monkeypatch.setattr(dependencies, "ReadSessionLocal", routing_sessionmaker(async_engine, []))
+    monkeypatch.setattr(crud_endpoints, "engine", engine)
+
+    yield TempDatabase(engine, async_engine, SessionLocal)
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
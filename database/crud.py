@@ -1,4 +1,7 @@
-from sqlalchemy.orm import Session
+import json
+
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.orm import Session, selectinload
 from sqlalchemy.exc import IntegrityError
 
 from database import models
@@ -6,6 +9,10 @@ from internal.schemas import UserCreate, ServiceBase, RoleCreate, PermissionBase
 from internal.security import get_password_hash
 
 
+class PermissionNotFound(Exception):
+    pass
+
+
 #region CREATE
 
 
@@ -42,27 +49,64 @@ def create_super_admin(db: Session, user: UserCreate):
     return db_user
 
 def create_service(db: Session, service: ServiceBase):
-    db_service = models.Service(**service.dict())
+    db_service = models.Service(**service_columns(service))
+    db_service.instances = service_instances(service)
     db.add(db_service)
+    bump_registry_version(db)
+    db.commit()
+    db.refresh(db_service)
+    return db_service
+
+def register_service(db: Session, service: ServiceBase):
+    '''
+    Description:
+    Registers a service for routing. A previously unregistered service with the same name is
+    reactivated with the new information, otherwise a new service is created.
+
+    Parameters:
+    - db: Database Session
+    - service: Service information, the name is the routing key
+    '''
+    db_service = db.query(models.Service).filter(models.Service.name == service.name).order_by(models.Service.id).first()
+    if db_service is None:
+        return create_service(db, service)
+
+    for column, value in service_columns(service).items():
+        setattr(db_service, column, value)
+    db_service.instances = service_instances(service)
+    db_service.is_active = True
+    bump_registry_version(db)
     db.commit()
     db.refresh(db_service)
     return db_service
 
+def service_columns(service: ServiceBase):
+    columns = service.dict(exclude={"instances"})
+    columns["url"] = str(service.url)
+    columns["endpoints"] = json.dumps(service.endpoints)
+    return columns
+
+def service_instances(service: ServiceBase):
+    return [models.ServiceInstance(url=str(instance.url), weight=instance.weight) for instance in service.instances]
+
 def create_role(db: Session, role: RoleCreate):
-    if role.permissions:
-        permissions_ids = []
-        for permission in role.permissions:
-            if isinstance(permission, int):
-                db_permission = db.query(models.Permission).filter(models.Permission.id == permission).first()
-            elif isinstance(permission, str):
-                db_permission = db.query(models.Permission).filter(models.Permission.name == permission).first()
-            else:
-                raise Exception(f"Invalid permission type {type(permission)}")
-            
-            if not db_permission:
-                raise Exception(f"Permission {permission} not found")
-
-            permissions_ids.append(db_permission.id)
+    '''
+    Description:
+    Creates a role with its permissions, given by id or name. All of them are resolved in a single query,
+    PermissionNotFound is raised if one of them does not exist.
+
+    Parameters:
+    - db: Database Session
+    - role: Role creation schema object
+    '''
+    for permission in role.permissions:
+        if not isinstance(permission, (int, str)):
+            raise Exception(f"Invalid permission type {type(permission)}")
+    resolved = get_permission_ids(db, role.permissions)
+    for permission in role.permissions:
+        if permission not in resolved:
+            raise PermissionNotFound(f"Permission {permission} not found")
+    permissions_ids = sorted({resolved[permission] for permission in role.permissions})
 
     try:
         db_role = models.Role(name=role.name)
@@ -74,6 +118,7 @@ def create_role(db: Session, role: RoleCreate):
             for permission_id in permissions_ids
         ]
         db.bulk_save_objects(role_permissions)
+        bump_registry_version(db, models.AUTHORIZATION_VERSION)
 
         db.commit()
         db.refresh(db_role)
@@ -86,10 +131,72 @@ def create_role(db: Session, role: RoleCreate):
 def create_permission(db: Session, permission: PermissionBase):
     db_permission = models.Permission(**permission.dict())
     db.add(db_permission)
+    bump_registry_version(db, models.AUTHORIZATION_VERSION)
     db.commit()
     db.refresh(db_permission)
     return db_permission
 
+def create_role_permission(db: Session, role_id: int, permission_id: int):
+    '''
+    Description:
+    Grants a permission to a role. Granting it twice is a no-op.
+
+    Parameters:
+    - db: Database Session
+    - role_id: Id of an existing role
+    - permission_id: Id of an existing permission
+    '''
+    if db.get(models.RolePermission, (role_id, permission_id)) is None:
+        db.add(models.RolePermission(role_id=role_id, permission_id=permission_id))
+        bump_registry_version(db, models.AUTHORIZATION_VERSION)
+        db.commit()
+    return get_role_by_id(db, role_id)
+
+def bulk_create(db: Session, model, rows: list[dict], grants: list[list[int]] | None = None, version_id: int | None = None):
+    '''
+    Description:
+    Inserts rows of a table in one transaction, as multi row INSERT ... RETURNING statements. With
+    `grants` the rows are roles and grants[i] are the permission ids of rows[i], inserted the same way.
+    If a constraint fails (e.g. a row inserted concurrently) the rows are retried one transaction
+    each, so only the offending rows fail.
+    Returns the new id or the IntegrityError of every row, in order.
+
+    Parameters:
+    - db: Database Session
+    - model: models.User, models.Role or models.Permission
+    - rows: Column values of the new rows
+    - grants: Permission ids of each role, only for models.Role
+    - version_id: Change counter to bump, if the table is watched
+    '''
+    def insert_rows(rows, grants):
+        ids = db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+        role_permissions = [
+            {"role_id": row_id, "permission_id": permission_id}
+            for row_id, permission_ids in zip(ids, grants or []) for permission_id in permission_ids
+        ]
+        if role_permissions:
+            db.execute(insert(models.RolePermission), role_permissions)
+        if version_id is not None:
+            bump_registry_version(db, version_id)
+        db.commit()
+        return ids
+
+    if not rows:
+        return []
+    try:
+        return insert_rows(rows, grants)
+    except IntegrityError:
+        db.rollback()
+
+    results = []
+    for index, row in enumerate(rows):
+        try:
+            results.extend(insert_rows([row], [grants[index]] if grants else None))
+        except IntegrityError as error:
+            db.rollback()
+            results.append(error)
+    return results
+
 
 #endregion CREATE
 
@@ -102,8 +209,11 @@ def get_user_by_id(db: Session, user_id: int):
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None):
+    query = db.query(models.User)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    return query.order_by(models.User.id).offset(skip).limit(limit).all()
 
 def get_active_user_by_id(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id, models.User.is_active == True).first()
@@ -111,15 +221,21 @@ def get_active_user_by_id(db: Session, user_id: int):
 def get_active_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email, models.User.is_active == True).first()
 
-def get_active_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).filter(models.User.is_active == True).offset(skip).limit(limit).all()
+def get_active_users(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None):
+    query = db.query(models.User).filter(models.User.is_active == True)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    return query.order_by(models.User.id).offset(skip).limit(limit).all()
 
 
 def get_service_by_id(db: Session, service_id: int):
     return db.query(models.Service).filter(models.Service.id == service_id).first()
 
-def get_services(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Service).offset(skip).limit(limit).all()
+def get_services(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None):
+    query = db.query(models.Service)
+    if after_id is not None:
+        query = query.filter(models.Service.id > after_id)
+    return query.order_by(models.Service.id).offset(skip).limit(limit).all()
 
 def get_services_by_name(db: Session, name: str):
     return db.query(models.Service).filter(models.Service.name == name).all()
@@ -130,8 +246,11 @@ def get_services_by_url(db: Session, url: str):
 def get_active_service_by_id(db: Session, service_id: int):
     return db.query(models.Service).filter(models.Service.id == service_id, models.Service.is_active == True).first()
 
-def get_active_services(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Service).filter(models.Service.is_active == True).offset(skip).limit(limit).all()
+def get_active_services(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None):
+    query = db.query(models.Service).filter(models.Service.is_active == True)
+    if after_id is not None:
+        query = query.filter(models.Service.id > after_id)
+    return query.order_by(models.Service.id).offset(skip).limit(limit).all()
 
 def get_active_services_by_name(db: Session, name: str):
     return db.query(models.Service).filter(models.Service.name == name, models.Service.is_active == True).all()
@@ -139,19 +258,53 @@ def get_active_services_by_name(db: Session, name: str):
 def get_active_services_by_url(db: Session, url: str):
     return db.query(models.Service).filter(models.Service.url == url, models.Service.is_active == True).all()
 
+def get_registry_version(db: Session, version_id: int = models.SERVICES_VERSION):
+    '''
+    Description:
+    Returns the current value of a change counter, 0 if nothing was ever changed.
+
+    Parameters:
+    - db: Database Session
+    - version_id: models.SERVICES_VERSION or models.AUTHORIZATION_VERSION
+    '''
+    return db.query(models.RegistryVersion.version).filter(models.RegistryVersion.id == version_id).scalar() or 0
+
+
+def role_query(db: Session, with_permissions: bool = False):
+    query = db.query(models.Role)
+    if with_permissions:
+        # One more query for the permissions of all the roles returned, however many there are
+        query = query.options(selectinload(models.Role.permissions))
+    return query
 
-def get_role_by_id(db: Session, role_id: int):
-    return db.query(models.Role).filter(models.Role.id == role_id).first()
+def get_role_by_id(db: Session, role_id: int, with_permissions: bool = False):
+    return role_query(db, with_permissions).filter(models.Role.id == role_id).first()
 
-def get_role_by_name(db: Session, name: str):
-    return db.query(models.Role).filter(models.Role.name == name).first()
+def get_role_by_name(db: Session, name: str, with_permissions: bool = False):
+    return role_query(db, with_permissions).filter(models.Role.name == name).first()
 
-def get_roles(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Role).offset(skip).limit(limit).all()
+def get_roles(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None, with_permissions: bool = False):
+    query = role_query(db, with_permissions)
+    if after_id is not None:
+        query = query.filter(models.Role.id > after_id)
+    return query.order_by(models.Role.id).offset(skip).limit(limit).all()
 
 def get_role_permissions(db: Session, role_id: int):
     return db.query(models.Permission.name).join(models.RolePermission, models.Permission.id == models.RolePermission.permission_id).filter(models.RolePermission.role_id == role_id).all()
 
+def get_all_role_permissions(db: Session):
+    '''
+    Description:
+    Returns (role_id, permission name) for every permission granted to an active role, in a single query.
+    '''
+    return (
+        db.query(models.RolePermission.role_id, models.Permission.name)
+        .join(models.Permission, models.Permission.id == models.RolePermission.permission_id)
+        .join(models.Role, models.Role.id == models.RolePermission.role_id)
+        .filter(models.Permission.is_active == True, models.Role.is_active == True)
+        .all()
+    )
+
 
 def get_permission_by_id(db: Session, permission_id: int):
     return db.query(models.Permission).filter(models.Permission.id == permission_id).first()
@@ -160,8 +313,38 @@ def get_permission_by_name(db: Session, name: str):
     #TODO: this should be a partial match because of the way permissions are stored: "service:endpoint"
     return db.query(models.Permission).filter(models.Permission.name == name).first()
 
-def get_permissions(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Permission).offset(skip).limit(limit).all()
+def get_existing_values(db: Session, column, values: list):
+    '''
+    Description:
+    Returns which of the values are already stored in a column, in a single IN query.
+    '''
+    if not values:
+        return set()
+    return set(db.scalars(select(column).where(column.in_(values))))
+
+def get_permission_ids(db: Session, permissions: list[int | str]):
+    '''
+    Description:
+    Resolves permission ids and names in a single query. Returns a dict from every given id or
+    name that exists to the permission id.
+    '''
+    ids = {permission for permission in permissions if isinstance(permission, int)}
+    names = {permission for permission in permissions if isinstance(permission, str)}
+    if not ids and not names:
+        return {}
+    resolved = {}
+    for permission_id, name in db.execute(select(models.Permission.id, models.Permission.name).where(or_(models.Permission.id.in_(ids), models.Permission.name.in_(names)))):
+        if permission_id in ids:
+            resolved[permission_id] = permission_id
+        if name in names:
+            resolved[name] = permission_id
+    return resolved
+
+def get_permissions(db: Session, skip: int = 0, limit: int = 100, after_id: int | None = None):
+    query = db.query(models.Permission)
+    if after_id is not None:
+        query = query.filter(models.Permission.id > after_id)
+    return query.order_by(models.Permission.id).offset(skip).limit(limit).all()
 
 
 
@@ -208,7 +391,48 @@ def deactivate_user(db: Session, user_id: int):
     raise NotImplementedError
 
 def deactivate_service(db: Session, service_id: int):
-    raise NotImplementedError
+    db_service = get_active_service_by_id(db, service_id)
+    if db_service is None:
+        return None
+    db_service.is_active = False
+    bump_registry_version(db)
+    db.commit()
+    db.refresh(db_service)
+    return db_service
+
+def bump_registry_version(db: Session, version_id: int = models.SERVICES_VERSION):
+    '''
+    Description:
+    Increments a change counter inside the current transaction. Must be called by every function
+    changing the services table (SERVICES_VERSION) or the roles and permissions tables
+    (AUTHORIZATION_VERSION) so the gateway workers pick up the change.
+    '''
+    bump = update(models.RegistryVersion).where(models.RegistryVersion.id == version_id).values(version=models.RegistryVersion.version + 1)
+    if db.execute(bump).rowcount > 0:
+        return
+    # Row not seeded (see seed_registry_versions). Inserted in a savepoint so that losing the
+    # race against a concurrent first write does not roll back the change being tracked.
+    try:
+        with db.begin_nested():
+            db.add(models.RegistryVersion(id=version_id, version=1))
+    except IntegrityError:
+        db.execute(bump)
+
+def seed_registry_versions(db: Session):
+    '''
+    Description:
+    Creates the missing change counters, so that bump_registry_version only has to update them.
+    '''
+    ids = {models.SERVICES_VERSION, models.AUTHORIZATION_VERSION}
+    ids -= set(db.scalars(select(models.RegistryVersion.id).where(models.RegistryVersion.id.in_(ids))))
+    if not ids:
+        return
+    try:
+        db.execute(insert(models.RegistryVersion), [{"id": version_id, "version": 0} for version_id in sorted(ids)])
+        db.commit()
+    except IntegrityError:
+        # Seeded by another worker starting at the same time
+        db.rollback()
 
 
 #endregion UPDATE
@@ -1,15 +1,96 @@
+import itertools
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 
-import yaml
+from internal.config import get_settings
 
-with open('config.yaml') as f:
-    SQLALCHEMY_DATABASE_URL = yaml.safe_load(f)['SQLALCHEMY_DATABASE_URL']
+# The engines are built once, changing the database url or the pool options requires a restart
+settings = get_settings()
+SQLALCHEMY_DATABASE_URL = settings.SQLALCHEMY_DATABASE_URL
 
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}) # On sqlite
 # engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}) # On non sqlite
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+
+# Async drivers used for the sync drivers in SQLALCHEMY_DATABASE_URL
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+def to_async_url(url: str):
+    '''
+    Description:
+    Returns the url with its driver replaced by the matching async driver, e.g. sqlite:// -> sqlite+aiosqlite://
+    '''
+    url = make_url(url)
+    if url.get_backend_name() not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for database backend {url.get_backend_name()}")
+    return url.set(drivername = f"{url.get_backend_name()}+{ASYNC_DRIVERS[url.get_backend_name()]}")
+
+def async_pool_options(url):
+    '''
+    Description:
+    Pool options from the settings. SQLite file databases get a plain pre-pinged pool,
+    in memory ones use a single static connection, so sizing only applies to real servers.
+    '''
+    options = {"pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size = settings.DB_POOL_SIZE,
+            max_overflow = settings.DB_MAX_OVERFLOW,
+            pool_timeout = settings.DB_POOL_TIMEOUT,
+            pool_recycle = settings.DB_POOL_RECYCLE,
+        )
+    return options
+
+ASYNC_SQLALCHEMY_DATABASE_URL = to_async_url(SQLALCHEMY_DATABASE_URL)
+
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **async_pool_options(ASYNC_SQLALCHEMY_DATABASE_URL))
+
+# expire_on_commit is off so objects stay readable after commit without an implicit (blocking) refresh
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
+# Read replicas of the primary, same pool options
+replica_engines = [
+    create_async_engine(url, **async_pool_options(url))
+    for url in map(to_async_url, settings.SQLALCHEMY_REPLICA_URLS)
+]
+
+def routing_sessionmaker(primary, replicas: list):
+    '''
+    Description:
+    Async session factory of the read only dependencies. A session reads from one replica, picked
+    round robin on its first query, and uses the primary for good as soon as it writes (flush or
+    INSERT/UPDATE/DELETE statement), so it reads its own writes. It uses the primary from the start
+    if info["use_primary"] is set before the first query. Without replicas it is a plain primary session.
+
+    Parameters:
+    - primary: Async engine of the primary
+    - replicas: Async engines of the replicas
+    '''
+    replica_cycle = itertools.cycle([replica.sync_engine for replica in replicas])
+
+    class RoutingSession(Session):
+        def get_bind(self, mapper=None, clause=None, **kw):
+            if self._flushing or isinstance(clause, UpdateBase):
+                self.info["use_primary"] = True
+            if not replicas or self.info.get("use_primary"):
+                return primary.sync_engine
+            if "replica" not in self.info:
+                self.info["replica"] = next(replica_cycle)
+            return self.info["replica"]
+
+    return async_sessionmaker(primary, sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False)
+
+ReadSessionLocal = routing_sessionmaker(async_engine, replica_engines)
+
+Base = declarative_base()
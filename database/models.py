@@ -1,11 +1,20 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Text, Boolean
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Text, Boolean
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
 
 from database.database import Base
 
+# Indexes are matched to the filters of database/crud.py and internal/temp.py. They are created by
+# the migrations in migrations/versions, keep both in sync.
+
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Login and token checks: email = ? AND is_active
+        Index('ix_users_email_is_active', 'email', 'is_active'),
+        # Pages of active users: is_active AND id > ? ORDER BY id
+        Index('ix_users_is_active_id', 'is_active', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     full_name = Column(String(255))
@@ -26,6 +35,8 @@ class Role(Base):
     is_active = Column(Boolean, default=True, nullable=False)
 
     users = relationship('User', back_populates='role')
+    # Read only view of the role_permissions rows, load it with selectinload(Role.permissions) when needed
+    permissions = relationship('Permission', secondary='role_permissions', viewonly=True, order_by='Permission.id')
 
 class Permission(Base):
     __tablename__ = 'permissions'
@@ -36,17 +47,59 @@ class Permission(Base):
 
 class RolePermission(Base):
     __tablename__ = 'role_permissions'
+    __table_args__ = (
+        # The primary key serves lookups by role, this one lookups by permission
+        Index('ix_role_permissions_permission_id', 'permission_id', 'role_id'),
+    )
 
     role_id = Column(Integer, ForeignKey('roles.id'), primary_key=True)
     permission_id = Column(Integer, ForeignKey('permissions.id'), primary_key=True)
 
 class Service(Base):
     __tablename__ = 'services'
+    __table_args__ = (
+        # Lookups and registration by name, active or not (the unique url has its own index)
+        Index('ix_services_name_is_active', 'name', 'is_active'),
+        # Routing snapshot and pages of active services: is_active AND id > ? ORDER BY id
+        Index('ix_services_is_active_id', 'is_active', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(255))
     description = Column(Text)
     is_active = Column(Boolean, default=True, nullable=False)
     url = Column(String(255), unique=True)
+    load_balancing = Column(String(32), default='round_robin', nullable=False)
     # endpoints = Column(JSONB) #TODO: change to this if we are using the postgree database
-    endpoints = Column(Text) #test with this if we are using the sqlite database
\ No newline at end of file
+    endpoints = Column(Text) #test with this if we are using the sqlite database
+
+    # Always needed together with the service, loaded with it in a second query
+    instances = relationship('ServiceInstance', back_populates='service', cascade='all, delete-orphan', lazy='selectin')
+
+class ServiceInstance(Base):
+    '''
+    Replica of a service. A service without instances is served by its own url alone.
+    '''
+    __tablename__ = 'service_instances'
+
+    id = Column(Integer, primary_key=True)
+    service_id = Column(Integer, ForeignKey('services.id'), nullable=False, index=True)
+    url = Column(String(255), nullable=False)
+    weight = Column(Integer, default=1, nullable=False)
+
+    service = relationship('Service', back_populates='instances')
+
+# Rows of the registry_version table
+SERVICES_VERSION = 1
+AUTHORIZATION_VERSION = 2
+
+class RegistryVersion(Base):
+    '''
+    Change counters bumped in the same transaction as the changes they track: the services
+    table (SERVICES_VERSION) and the roles and permissions tables (AUTHORIZATION_VERSION).
+    Gateway workers poll them to know when to rebuild their in-memory snapshots.
+    '''
+    __tablename__ = 'registry_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
\ No newline at end of file
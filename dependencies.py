@@ -1,54 +1,101 @@
+import time
 from typing import Annotated
 from jose import JWTError, jwt
 
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 
 from internal.schemas import User, TokenData
 from internal.security import get_user
-from database.database import SessionLocal
+from database.database import SessionLocal, AsyncSessionLocal, ReadSessionLocal
+from internal.config import Settings, get_settings
+from internal.token_cache import token_cache
+from internal.read_your_writes import read_your_writes
+from internal.authorization import authorization_index
+from internal import metrics
+from internal.tracing import tracer
 from sqlalchemy.orm import Session
-
-import yaml
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl = "/token")# does this goes here?
 
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
+    read_your_writes.track(db, request)
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db(request: Request):
+    '''
+    Async alternative to get_db. Queries wait on the database without blocking the event loop.
+    The sync crud functions can be reused through `await db.run_sync(crud.function, ...)`.
+    '''
+    async with AsyncSessionLocal() as db:
+        read_your_writes.track(db, request)
+        yield db
+
+async def get_read_db(request: Request):
+    '''
+    Session of read only endpoints, reading from a replica if there are any. Requests whose token
+    committed a write in the last DB_READ_YOUR_WRITES_SECONDS read from the primary instead.
+    '''
+    async with ReadSessionLocal() as db:
+        if read_your_writes.recent(read_your_writes.track(db, request)):
+            db.info["use_primary"] = True
+        yield db
+
 async def get_current_user(
         token: Annotated[str, Depends(oauth2_scheme)],
-        db: Annotated[Session, Depends(get_db)]
+        db: Annotated[AsyncSession, Depends(get_read_db)],
+        settings: Annotated[Settings, Depends(get_settings)]
         ):
     credentials_exception = HTTPException(
         status_code = status.HTTP_401_UNAUTHORIZED,
         detail = "Could not validate credentials",
         headers = {"WWW-Authenticate": "Bearer"},
     )
-    try:
-        with open("config.yaml") as file:
-            config = yaml.safe_load(file)
-        secret_key = config["SECRET_KEY"]
-        algorithm = config["ALGORITHM"]
-
-        payload = jwt.decode(token, secret_key, algorithm)
-        username: str = payload.get("sub")
-        if username is None:
+    started = time.perf_counter()
+    with tracer.span("auth.get_current_user") as span:
+        cache_key = token_cache.key(token, settings.SECRET_KEY)
+        cached_user = token_cache.get(cache_key)
+        span.set_attribute("auth.token_cache_hit", cached_user is not None)
+        if cached_user is not None:
+            metrics.auth_from_cache.observe(time.perf_counter() - started)
+            return cached_user
+
+        try:
+            with tracer.span("auth.jwt_decode"):
+                payload = jwt.decode(token, settings.SECRET_KEY, settings.ALGORITHM)
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username = username)
+        except JWTError:
             raise credentials_exception
-        token_data = TokenData(username = username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(db, email = token_data.username)
-    if user is None:
-        raise credentials_exception
-    return user
+        db_user = await db.run_sync(get_user, email = token_data.username)
+        if db_user is None:
+            raise credentials_exception
+        user = User.from_orm(db_user)
+        token_cache.put(cache_key, user, payload.get("exp"))
+        metrics.auth_from_token.observe(time.perf_counter() - started)
+        return user
 
 async def get_current_active_user(current_user: Annotated[User, Depends(get_current_user)]):
     if not current_user.is_active:
         raise HTTPException(status_code = 400, detail = "Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+def require_permission(service_name: str):
+    '''
+    Description:
+    Dependency factory checking that the role of the current user has a "service_name:<request path>"
+    permission, e.g. require_permission("crud") on GET /users needs "crud:users" or a wildcard of it.
+    '''
+    async def check_permission(request: Request, current_user: Annotated[User, Depends(get_current_active_user)]):
+        if not authorization_index.allows(current_user.role_id, service_name, request.url.path):
+            raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = "Not enough permissions")
+        return current_user
+    return check_permission
\ No newline at end of file
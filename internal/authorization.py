@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from types import MappingProxyType
+
+from database import crud, models
+from database.database import AsyncSessionLocal
+
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "*"
+
+
+def permission_tokens(permission: str) -> list[str]:
+    '''
+    Description:
+    Splits a "service:endpoint" permission into [service, *endpoint path segments].
+    A permission without an endpoint covers the whole service ("documents" is "documents:*").
+    '''
+    service, separator, endpoint = permission.partition(":")
+    if not separator:
+        return [service] if service == WILDCARD else [service, WILDCARD]
+    return [service] + [segment for segment in endpoint.strip("/").split("/") if segment]
+
+def request_tokens(service_name: str, path: str) -> list[str]:
+    return [service_name] + [segment for segment in path.strip("/").split("/") if segment]
+
+
+class PermissionTrie:
+    '''
+    Description:
+    Compiled set of "service:endpoint" permissions of a role, one trie level per segment.
+    "*" matches any single segment, and as the last segment anything below it (also nothing),
+    so "*" alone allows everything and "documents:files/*" allows every path under files.
+    '''
+    __slots__ = ("children", "terminal", "matches_rest")
+
+    def __init__(self):
+        self.children: dict[str, PermissionTrie] = {}
+        self.terminal = False
+        self.matches_rest = False
+
+    @classmethod
+    def compile(cls, permissions) -> "PermissionTrie":
+        root = cls()
+        for permission in permissions:
+            root.add(permission_tokens(permission))
+        return root
+
+    def add(self, tokens: list[str]):
+        node = self
+        for index, token in enumerate(tokens):
+            if token == WILDCARD and index == len(tokens) - 1:
+                node.matches_rest = True
+                return
+            node = node.children.setdefault(token, PermissionTrie())
+        node.terminal = True
+
+    def allows(self, tokens: list[str]) -> bool:
+        stack = [(self, 0)]
+        while stack:
+            node, index = stack.pop()
+            if node.matches_rest:
+                return True
+            if index == len(tokens):
+                if node.terminal:
+                    return True
+                continue
+            child = node.children.get(tokens[index])
+            if child is not None:
+                stack.append((child, index + 1))
+            child = node.children.get(WILDCARD)
+            if child is not None:
+                stack.append((child, index + 1))
+        return False
+
+
+EMPTY_TRIE = PermissionTrie()
+
+
+class AuthorizationIndex:
+    '''
+    Description:
+    In-memory map of role id to the compiled PermissionTrie of the role, built from the
+    roles, permissions and role_permissions tables. Authorizing a request is a dict read
+    and a trie walk, without touching the database. The authorization version in the
+    database is polled like the service registry; on a change all grants are read in one
+    query and only the roles whose set of permissions changed are recompiled, then the
+    map is swapped with a single reference assignment.
+    '''
+
+    def __init__(self, refresh_interval: float = 2.0):
+        self.refresh_interval = refresh_interval
+        self.version = -1
+        self._patterns: MappingProxyType[int, frozenset[str]] = MappingProxyType({})
+        self._tries: MappingProxyType[int, PermissionTrie] = MappingProxyType({})
+        self._poller: asyncio.Task | None = None
+
+    def permissions(self, role_id: int) -> frozenset[str]:
+        return self._patterns.get(role_id, frozenset())
+
+    def allows(self, role_id: int, service_name: str, path: str = "") -> bool:
+        return self._tries.get(role_id, EMPTY_TRIE).allows(request_tokens(service_name, path))
+
+    def load(self, version: int, grants):
+        '''
+        Description:
+        Builds the index from (role_id, permission name) rows, reusing the tries of unchanged roles.
+        '''
+        grouped: dict[int, set[str]] = {}
+        for role_id, name in grants:
+            grouped.setdefault(role_id, set()).add(name)
+
+        patterns = {role_id: frozenset(names) for role_id, names in grouped.items()}
+        tries = {}
+        for role_id, names in patterns.items():
+            if self._patterns.get(role_id) == names:
+                tries[role_id] = self._tries[role_id]
+            else:
+                tries[role_id] = PermissionTrie.compile(names)
+
+        self._patterns, self._tries = MappingProxyType(patterns), MappingProxyType(tries)
+        self.version = version
+
+    async def refresh(self, force: bool = False) -> bool:
+        '''
+        Description:
+        Reloads the index if the authorization version changed. Returns True if it was replaced.
+        '''
+        async with AsyncSessionLocal() as db:
+            version = await db.run_sync(crud.get_registry_version, models.AUTHORIZATION_VERSION)
+            if version == self.version and not force:
+                return False
+            grants = await db.run_sync(crud.get_all_role_permissions)
+        self.load(version, grants)
+        return True
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Could not refresh the authorization index, keeping the previous one")
+
+    async def start(self, refresh_interval: float | None = None):
+        '''
+        Description:
+        Loads the index and starts polling for changes. Must be called on application startup.
+        '''
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+        await self.refresh(force = True)
+        if self._poller is None:
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+
+authorization_index = AuthorizationIndex()
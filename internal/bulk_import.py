@@ -0,0 +1,205 @@
+import asyncio
+import json
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request, status
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import crud, models
+from internal.hashing_pool import import_hashing_pool
+from internal.schemas import UserCreate, RoleCreate, PermissionBase
+from internal.security import get_password_hash
+
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-lines")
+
+
+class InvalidItem:
+    '''
+    Description:
+    Stand-in for an NDJSON line that is not valid JSON, reported as a failure of its item.
+    '''
+
+    def __init__(self, detail: str):
+        self.detail = detail
+
+
+async def read_items(request: Request) -> AsyncIterator[tuple[int, object]]:
+    '''
+    Description:
+    Yields (index, item) of an import body: a JSON array, or NDJSON (one item per line) when the
+    content type says so. NDJSON is parsed while it is received, so it is never held whole in memory.
+    '''
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in NDJSON_CONTENT_TYPES:
+        try:
+            items = await request.json()
+        except ValueError:
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "Body must be a JSON array or NDJSON")
+        for index, item in enumerate(items):
+            yield index, item
+        return
+
+    index = 0
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield index, parse_line(line)
+                index += 1
+    if pending.strip():
+        yield index, parse_line(pending)
+
+def parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return InvalidItem(f"Invalid JSON: {error}")
+
+async def read_batches(items: AsyncIterator[tuple[int, object]], batch_size: int) -> AsyncIterator[list[tuple[int, object]]]:
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ImportReport:
+    '''
+    Description:
+    Outcome of every item of an import, by its position in the body.
+    '''
+
+    def __init__(self):
+        self.results: list[dict] = []
+        self.created = 0
+        self.failed = 0
+
+    def succeeded(self, index: int, row_id: int):
+        self.created += 1
+        self.results.append({"index": index, "id": row_id})
+
+    def fail(self, index: int, detail):
+        self.failed += 1
+        self.results.append({"index": index, "error": detail})
+
+    def to_dict(self) -> dict:
+        self.results.sort(key = lambda result: result["index"])
+        return {"created": self.created, "failed": self.failed, "results": self.results}
+
+
+def validate(schema: type[BaseModel], batch: list[tuple[int, object]], report: ImportReport) -> list[tuple[int, BaseModel]]:
+    valid = []
+    for index, item in batch:
+        if isinstance(item, InvalidItem):
+            report.fail(index, item.detail)
+            continue
+        try:
+            valid.append((index, schema.parse_obj(item)))
+        except ValidationError as error:
+            report.fail(index, error.errors())
+    return valid
+
+def unique(items: list[tuple[int, BaseModel]], key: str, existing: set, report: ImportReport, detail: str) -> list[tuple[int, BaseModel]]:
+    '''
+    Description:
+    Drops the items whose `key` is already stored or repeats an earlier item of the import.
+    Adds the kept keys to `existing` so they count as stored for the next batches.
+    '''
+    kept = []
+    for index, item in items:
+        value = getattr(item, key)
+        if value in existing:
+            report.fail(index, detail)
+            continue
+        existing.add(value)
+        kept.append((index, item))
+    return kept
+
+def record(report: ImportReport, indexes: list[int], results: list):
+    for index, result in zip(indexes, results):
+        if isinstance(result, Exception):
+            report.fail(index, f"Integrity error: {result.orig}")
+        else:
+            report.succeeded(index, result)
+
+
+#region Importers
+# Each batch: validation, one IN query for the already stored keys, then one transaction of multi row inserts
+
+async def import_users(db: AsyncSession, items: AsyncIterator[tuple[int, object]], batch_size: int) -> dict:
+    '''
+    Description:
+    Creates users like /create/users. Passwords of a batch are hashed concurrently on the import
+    hashing pool; the items it has no room for fail instead of the whole import.
+    '''
+    report = ImportReport()
+    seen = set()
+    async for batch in read_batches(items, batch_size):
+        users = validate(UserCreate, batch, report)
+        seen |= await db.run_sync(crud.get_existing_values, models.User.email, [user.email for _, user in users])
+        users = unique(users, "email", seen, report, "Email already registered")
+        hashes = await asyncio.gather(*(import_hashing_pool.run(get_password_hash, user.password) for _, user in users), return_exceptions = True)
+        indexes, rows = [], []
+        for (index, user), hashed in zip(users, hashes):
+            if isinstance(hashed, HTTPException):
+                # The pool is full of the hashes of other imports, the item can be sent again
+                seen.discard(user.email)
+                report.fail(index, hashed.detail)
+                continue
+            if isinstance(hashed, BaseException):
+                raise hashed
+            indexes.append(index)
+            rows.append({"username": user.username, "full_name": user.full_name, "email": user.email, "hashed_password": hashed})
+        record(report, indexes, await db.run_sync(crud.bulk_create, models.User, rows))
+    return report.to_dict()
+
+async def import_permissions(db: AsyncSession, items: AsyncIterator[tuple[int, object]], batch_size: int) -> dict:
+    report = ImportReport()
+    seen = set()
+    async for batch in read_batches(items, batch_size):
+        permissions = validate(PermissionBase, batch, report)
+        seen |= await db.run_sync(crud.get_existing_values, models.Permission.name, [permission.name for _, permission in permissions])
+        permissions = unique(permissions, "name", seen, report, "Permission already exists")
+        rows = [{"name": permission.name} for _, permission in permissions]
+        results = await db.run_sync(crud.bulk_create, models.Permission, rows, version_id = models.AUTHORIZATION_VERSION)
+        record(report, [index for index, _ in permissions], results)
+    return report.to_dict()
+
+async def import_roles(db: AsyncSession, items: AsyncIterator[tuple[int, object]], batch_size: int) -> dict:
+    '''
+    Description:
+    Creates roles with their permissions, given by id or name like /create/roles. The permissions
+    of a whole batch are resolved in one query; a role with an unknown permission is not created.
+    '''
+    report = ImportReport()
+    seen = set()
+    async for batch in read_batches(items, batch_size):
+        roles = validate(RoleCreate, batch, report)
+        seen |= await db.run_sync(crud.get_existing_values, models.Role.name, [role.name for _, role in roles])
+        roles = unique(roles, "name", seen, report, "Role already exists")
+        permission_ids = await db.run_sync(crud.get_permission_ids, [permission for _, role in roles for permission in role.permissions])
+
+        indexes, rows, grants = [], [], []
+        for index, role in roles:
+            missing = [permission for permission in role.permissions if permission not in permission_ids]
+            if missing:
+                seen.discard(role.name)
+                report.fail(index, f"Permissions not found: {missing}")
+                continue
+            indexes.append(index)
+            rows.append({"name": role.name})
+            grants.append(sorted({permission_ids[permission] for permission in role.permissions}))
+        results = await db.run_sync(crud.bulk_create, models.Role, rows, grants = grants, version_id = models.AUTHORIZATION_VERSION)
+        record(report, indexes, results)
+    return report.to_dict()
+
+#endregion Importers
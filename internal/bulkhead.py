@@ -0,0 +1,128 @@
+import asyncio
+import time
+from collections import deque
+
+from fastapi import HTTPException, status
+
+
+DEFAULT_BULKHEAD_OPTIONS = {
+    "max_concurrent": 100,
+    "max_queue": 100,
+    "queue_timeout": 1.0,
+}
+
+
+class Bulkhead:
+    '''
+    Description:
+    Concurrency limit of one upstream service. At most `max_concurrent` requests are in flight
+    (until their response finished streaming); up to `max_queue` more wait in FIFO order for
+    a slot, each at most `queue_timeout` seconds. Requests beyond that are rejected at once,
+    so a slow service cannot pile up coroutines and connections shared with the others.
+    A released slot is handed directly to the next waiter. Only used from the event loop thread.
+    '''
+
+    def __init__(self, name: str, max_concurrent: int = 100, max_queue: int = 100, queue_timeout: float = 1.0):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _unavailable(self, reason: str) -> HTTPException:
+        return HTTPException(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail = f"{self.name} is overloaded ({reason})",
+            headers = {"Retry-After": "1"},
+        )
+
+    async def acquire(self):
+        '''
+        Description:
+        Takes a slot, waiting in the queue if needed. Raises 503 if the queue is full or the
+        wait timed out. Every successful acquire must be paired with release.
+        '''
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise self._unavailable("queue full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as exception:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(exception, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+                raise self._unavailable("queue timeout")
+            raise
+        finally:
+            waited = time.monotonic() - started
+            self.stats["wait_seconds_total"] += waited
+            self.stats["wait_seconds_max"] = max(self.stats["wait_seconds_max"], waited)
+        self.stats["admitted"] += 1
+
+    def release(self):
+        if self._waiters:
+            # The slot stays taken and passes to the oldest waiter
+            self._waiters.popleft().set_result(None)
+        else:
+            self.active -= 1
+
+    def status(self) -> dict:
+        return {
+            "service": self.name,
+            "active": self.active,
+            "queue_depth": self.queue_depth,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            **self.stats,
+        }
+
+
+class Bulkheads:
+    '''
+    Description:
+    One Bulkhead per service, created on first use with the configured options.
+    '''
+
+    def __init__(self):
+        self._bulkheads: dict[str, Bulkhead] = {}
+        self._defaults = dict(DEFAULT_BULKHEAD_OPTIONS)
+        self._service_options: dict[str, dict] = {}
+
+    def configure(self, settings):
+        self._defaults = {key: getattr(settings, f"BULKHEAD_{key.upper()}") for key in DEFAULT_BULKHEAD_OPTIONS}
+        self._service_options = settings.BULKHEAD_SERVICE_OPTIONS
+        self._bulkheads.clear()
+
+    def get(self, service_name: str) -> Bulkhead:
+        bulkhead = self._bulkheads.get(service_name)
+        if bulkhead is None:
+            options = dict(self._defaults)
+            options.update(self._service_options.get(service_name, {}))
+            bulkhead = self._bulkheads[service_name] = Bulkhead(service_name, **options)
+        return bulkhead
+
+    def status(self) -> list[dict]:
+        return [bulkhead.status() for bulkhead in self._bulkheads.values()]
+
+
+bulkheads = Bulkheads()
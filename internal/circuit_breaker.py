@@ -0,0 +1,184 @@
+import time
+from collections import deque
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_BREAKER_OPTIONS = {
+    "window": 20,
+    "min_calls": 10,
+    "error_rate": 0.5,
+    "slow_call_seconds": 5.0,
+    "slow_call_rate": 0.5,
+    "open_seconds": 30.0,
+    "half_open_calls": 3,
+}
+
+
+class CircuitBreaker:
+    '''
+    Description:
+    Circuit breaker of one upstream service.
+    - closed: calls go through. The outcome of the last `window` calls is kept; once at least
+      `min_calls` were seen, an error rate or a slow call rate (calls taking longer than
+      `slow_call_seconds`) at or above its threshold opens the breaker.
+    - open: calls are rejected until `open_seconds` have passed, then the breaker is half open.
+    - half_open: at most `half_open_calls` trial calls go through at a time. That many
+      successes in a row close the breaker, a single failure opens it again.
+    A slow call counts as a failure while half open.
+    '''
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10, error_rate: float = 0.5,
+                 slow_call_seconds: float = 5.0, slow_call_rate: float = 0.5, open_seconds: float = 30.0,
+                 half_open_calls: int = 3, clock = time.monotonic):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        # (failed, slow) of the last calls and their running totals
+        self._outcomes: deque[tuple[bool, bool]] = deque()
+        self._failures = 0
+        self._slow_calls = 0
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+
+    def retry_after(self) -> float:
+        '''
+        Description:
+        Seconds until the breaker lets trial calls through, 0 if it is not open.
+        '''
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - self.clock())
+
+    def allow(self) -> bool:
+        '''
+        Description:
+        Returns whether a call may go through. Every allowed call must be followed by record or cancel.
+        '''
+        if self.state == OPEN:
+            if self.clock() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self._trials_in_flight = 0
+            self._trial_successes = 0
+        if self.state == HALF_OPEN:
+            if self._trials_in_flight >= self.half_open_calls:
+                self.rejected += 1
+                return False
+            self._trials_in_flight += 1
+        return True
+
+    def cancel(self):
+        '''
+        Description:
+        The allowed call was never made (e.g. no healthy instance), gives its trial slot back.
+        '''
+        if self.state == HALF_OPEN and self._trials_in_flight > 0:
+            self._trials_in_flight -= 1
+
+    def record(self, success: bool, latency: float):
+        slow = latency >= self.slow_call_seconds
+        if self.state == HALF_OPEN:
+            self._trials_in_flight = max(0, self._trials_in_flight - 1)
+            if not success or slow:
+                self._open()
+                return
+            self._trial_successes += 1
+            if self._trial_successes >= self.half_open_calls:
+                self._close()
+            return
+        if self.state == OPEN:
+            # Call allowed before the breaker opened
+            return
+
+        failed = not success
+        self._outcomes.append((failed, slow))
+        self._failures += failed
+        self._slow_calls += slow
+        if len(self._outcomes) > self.window:
+            old_failed, old_slow = self._outcomes.popleft()
+            self._failures -= old_failed
+            self._slow_calls -= old_slow
+
+        calls = len(self._outcomes)
+        if calls >= self.min_calls and (
+            self._failures / calls >= self.error_rate or self._slow_calls / calls >= self.slow_call_rate
+        ):
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.times_opened += 1
+        self._reset_window()
+
+    def _close(self):
+        self.state = CLOSED
+        self._reset_window()
+
+    def _reset_window(self):
+        self._outcomes.clear()
+        self._failures = 0
+        self._slow_calls = 0
+        self._trials_in_flight = 0
+        self._trial_successes = 0
+
+    def status(self) -> dict:
+        calls = len(self._outcomes)
+        return {
+            "service": self.name,
+            "state": self.state,
+            "calls_in_window": calls,
+            "error_rate": self._failures / calls if calls else 0.0,
+            "slow_call_rate": self._slow_calls / calls if calls else 0.0,
+            "retry_after": self.retry_after(),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+class CircuitBreakers:
+    '''
+    Description:
+    One CircuitBreaker per service, created on first use with the configured options.
+    '''
+
+    def __init__(self):
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._defaults = dict(DEFAULT_BREAKER_OPTIONS)
+        self._service_options: dict[str, dict] = {}
+
+    def configure(self, settings):
+        self._defaults = dict(DEFAULT_BREAKER_OPTIONS)
+        for key in DEFAULT_BREAKER_OPTIONS:
+            self._defaults[key] = getattr(settings, f"CIRCUIT_BREAKER_{key.upper()}")
+        self._service_options = settings.CIRCUIT_BREAKER_SERVICE_OPTIONS
+        self._breakers.clear()
+
+    def get(self, service_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(service_name)
+        if breaker is None:
+            options = dict(self._defaults)
+            options.update(self._service_options.get(service_name, {}))
+            breaker = self._breakers[service_name] = CircuitBreaker(service_name, **options)
+        return breaker
+
+    def status(self) -> list[dict]:
+        return [breaker.status() for breaker in self._breakers.values()]
+
+
+circuit_breakers = CircuitBreakers()
@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import signal
+
+import yaml
+from pydantic import BaseModel, ValidationError
+
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = "config.yaml"
+
+
+class Settings(BaseModel):
+    '''
+    Description:
+    Typed view of config.yaml. The keys are the same as in the file.
+    '''
+    SQLALCHEMY_DATABASE_URL: str
+    SECRET_KEY: str
+    ALGORITHM: str = "HS256"
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = 15
+
+    # Async database pool, see database/database.py
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = True
+
+    # Read replicas, see database/database.py. Read only endpoints and the auth lookup use them,
+    # except for tokens that wrote within DB_READ_YOUR_WRITES_SECONDS (internal/read_your_writes.py).
+    # Like the pool options, changing the urls requires a restart.
+    SQLALCHEMY_REPLICA_URLS: list[str] = []
+    DB_READ_YOUR_WRITES_SECONDS: float = 5.0
+
+    # Seconds between checks of the config file modification time
+    SETTINGS_RELOAD_INTERVAL: float = 5.0
+
+    # Verified token cache, see internal/token_cache.py
+    TOKEN_CACHE_MAX_SIZE: int = 10000
+    TOKEN_CACHE_TTL: float = 60.0
+
+    # Password hashing pool, see internal/hashing_pool.py
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+
+    # Seconds between checks of the service registry version, see internal/registry.py
+    REGISTRY_REFRESH_INTERVAL: float = 2.0
+
+    # Seconds between checks of the roles and permissions version, see internal/authorization.py
+    AUTHORIZATION_REFRESH_INTERVAL: float = 2.0
+
+    # Upstream health checks, see internal/health.py. An interval of 0 disables them.
+    HEALTH_CHECK_INTERVAL: float = 10.0
+    HEALTH_CHECK_TIMEOUT: float = 2.0
+    HEALTH_CHECK_PATH: str = "/health"
+    HEALTH_CHECK_UNHEALTHY_THRESHOLD: int = 3
+    HEALTH_CHECK_HEALTHY_THRESHOLD: int = 2
+    HEALTH_PASSIVE_FAILURE_THRESHOLD: int = 5
+
+    # Per service circuit breakers, see internal/circuit_breaker.py
+    CIRCUIT_BREAKER_WINDOW: int = 20
+    CIRCUIT_BREAKER_MIN_CALLS: int = 10
+    CIRCUIT_BREAKER_ERROR_RATE: float = 0.5
+    CIRCUIT_BREAKER_SLOW_CALL_SECONDS: float = 5.0
+    CIRCUIT_BREAKER_SLOW_CALL_RATE: float = 0.5
+    CIRCUIT_BREAKER_OPEN_SECONDS: float = 30.0
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS: int = 3
+    CIRCUIT_BREAKER_SERVICE_OPTIONS: dict[str, dict] = {}
+
+    # Retries and hedged requests of idempotent calls, see internal/retry.py. Retries stay within
+    # a budget of RETRY_BUDGET_RATIO extra calls per call (plus RETRY_BUDGET_MIN_PER_SECOND).
+    # RETRY_SERVICE_OPTIONS maps a service name to overrides, e.g. {"documents": {"hedge": True}}.
+    RETRY_MAX_RETRIES: int = 1
+    RETRY_BACKOFF_BASE: float = 0.05
+    RETRY_BACKOFF_MAX: float = 1.0
+    RETRY_BUDGET_RATIO: float = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND: float = 1.0
+    RETRY_HEDGE: bool = False
+    RETRY_HEDGE_PERCENTILE: float = 0.95
+    RETRY_HEDGE_MIN_DELAY: float = 0.01
+    RETRY_SERVICE_OPTIONS: dict[str, dict] = {}
+
+    # Per service concurrency limits, see internal/bulkhead.py. BULKHEAD_SERVICE_OPTIONS maps a
+    # service name to overrides, e.g. {"documents": {"max_concurrent": 20}}.
+    BULKHEAD_MAX_CONCURRENT: int = 100
+    BULKHEAD_MAX_QUEUE: int = 100
+    BULKHEAD_QUEUE_TIMEOUT: float = 1.0
+    BULKHEAD_SERVICE_OPTIONS: dict[str, dict] = {}
+
+    # Opt-in response cache, see internal/response_cache.py. RESPONSE_CACHE_SERVICES maps a
+    # service name to its CachePolicy options, e.g. {"documents": {"routes": ["files/*"]}}.
+    RESPONSE_CACHE_SERVICES: dict[str, dict] = {}
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_MAX_ENTRY_BYTES: int = 8 * 1024 * 1024
+    RESPONSE_CACHE_DISK_PATH: str | None = None
+    RESPONSE_CACHE_DISK_THRESHOLD: int = 256 * 1024
+    RESPONSE_CACHE_DISK_MAX_BYTES: int = 1024 * 1024 * 1024
+
+    # Coalescing of identical concurrent GETs, see internal/single_flight.py. SINGLE_FLIGHT_SERVICES
+    # maps a service name to its CoalescingPolicy options, e.g. {"documents": {"routes": ["files/*"]}}.
+    SINGLE_FLIGHT_SERVICES: dict[str, dict] = {}
+    SINGLE_FLIGHT_TIMEOUT: float = 5.0
+    SINGLE_FLIGHT_MAX_BYTES: int = 1024 * 1024
+
+    # Token bucket rate limits of the gateway, see internal/rate_limit.py. A limit is
+    # {"rate": tokens per second, "burst": bucket size}, None or missing means unlimited.
+    # RATE_LIMIT_USER_BY_ROLE overrides the per user limit for the users of a role, while
+    # RATE_LIMIT_ROLES and RATE_LIMIT_SERVICES are shared by all users of the role / service.
+    RATE_LIMIT_USER: dict | None = None
+    RATE_LIMIT_USER_BY_ROLE: dict[int, dict] = {}
+    RATE_LIMIT_ROLES: dict[int, dict] = {}
+    RATE_LIMIT_SERVICES: dict[str, dict] = {}
+    # "local" (per worker) or "redis" (shared, needs the 'redis' package)
+    RATE_LIMIT_BACKEND: str = "local"
+    RATE_LIMIT_REDIS_URL: str = "redis://localhost:6379/0"
+
+    # Seconds between event loop lag probes, see internal/metrics.py
+    EVENT_LOOP_LAG_INTERVAL: float = 0.5
+
+    # Distributed tracing, see internal/tracing.py. TRACING_EXPORTER is "none", "stdout", "file"
+    # (JSON lines appended to TRACING_FILE_PATH) or the "package.module:Class" of a custom exporter.
+    # Requests with a traceparent header follow its sampled flag, others are sampled at TRACING_SAMPLE_RATE.
+    TRACING_EXPORTER: str = "none"
+    TRACING_FILE_PATH: str = "traces.jsonl"
+    TRACING_SAMPLE_RATE: float = 0.01
+    TRACING_EXPORT_INTERVAL: float = 1.0
+    TRACING_MAX_QUEUE: int = 10000
+
+    # Largest page of the /users, /services, /roles and /permissions lists, see internal/pagination.py
+    PAGINATION_MAX_PAGE_SIZE: int = 500
+
+    # Rows fetched per round trip by the /export endpoints, see internal/export.py
+    EXPORT_BATCH_SIZE: int = 1000
+
+    # Bulk imports, see internal/bulk_import.py. Items are validated, hashed and inserted
+    # IMPORT_BATCH_SIZE at a time, one transaction per batch, hashing on IMPORT_HASH_WORKERS threads.
+    IMPORT_BATCH_SIZE: int = 500
+    IMPORT_HASH_WORKERS: int = 4
+
+    # Pooled upstream clients, see internal/http_client.py
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0
+    UPSTREAM_TIMEOUT: float = 10.0
+    UPSTREAM_HTTP2: bool = False
+    UPSTREAM_SERVICE_LIMITS: dict[str, dict] = {}
+
+    class Config:
+        allow_mutation = False
+
+
+class SettingsStore:
+    '''
+    Description:
+    Holds the current Settings. The file is parsed once and then only again when its
+    modification time changes (checked by a background task) or on SIGHUP. A reload
+    builds a complete new Settings object and swaps the reference, so readers always
+    see either the old or the new settings, never a mix. An invalid file is logged and
+    the previous settings are kept. Components built from the settings at startup register
+    with on_reload to be configured again when their settings change.
+    '''
+
+    def __init__(self, path: str = CONFIG_PATH):
+        self.path = path
+        self._settings: Settings | None = None
+        self._mtime: float | None = None
+        self._watcher: asyncio.Task | None = None
+        self._callbacks: list[tuple[tuple[str, ...], object]] = []
+        # Running async callbacks, referenced until they are done
+        self._pending: set[asyncio.Task] = set()
+
+    def get(self) -> Settings:
+        if self._settings is None:
+            self.reload(raise_errors = True)
+        return self._settings
+
+    def reload(self, raise_errors: bool = False) -> bool:
+        '''
+        Description:
+        Parses the config file and swaps the current settings. Returns True if they were replaced.
+        '''
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path) as file:
+                settings = Settings(**(yaml.safe_load(file) or {}))
+        except (OSError, yaml.YAMLError, ValidationError) as e:
+            if raise_errors:
+                raise
+            logger.error("Could not reload %s, keeping the previous settings: %s", self.path, e)
+            return False
+        previous, self._settings = self._settings, settings
+        self._mtime = mtime
+        if previous is not None:
+            self._notify(previous, settings)
+        return True
+
+    def on_reload(self, prefixes: tuple[str, ...], callback):
+        '''
+        Description:
+        Calls `callback(settings)` after every reload that changed a setting whose name starts
+        with one of `prefixes`. A coroutine callback is run as a task of the running event loop.
+        '''
+        self._callbacks.append((prefixes, callback))
+
+    def _notify(self, previous: Settings, settings: Settings):
+        old = previous.dict()
+        changed = [key for key, value in settings.dict().items() if old.get(key) != value]
+        for prefixes, callback in self._callbacks:
+            if not any(key.startswith(prefixes) for key in changed):
+                continue
+            try:
+                result = callback(settings)
+                if asyncio.iscoroutine(result):
+                    self._run(result, callback)
+            except Exception:
+                logger.exception("Could not apply the reloaded settings with %r", callback)
+
+    def _run(self, coroutine, callback):
+        try:
+            task = asyncio.get_running_loop().create_task(coroutine)
+        except RuntimeError:
+            coroutine.close()
+            raise
+
+        def done(task: asyncio.Task):
+            self._pending.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("Could not apply the reloaded settings with %r", callback, exc_info = task.exception())
+
+        self._pending.add(task)
+        task.add_done_callback(done)
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        return self.reload()
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.get().SETTINGS_RELOAD_INTERVAL)
+            if self.reload_if_changed():
+                logger.info("Reloaded settings from %s", self.path)
+
+    def start(self):
+        '''
+        Description:
+        Starts watching the config file and reloads on SIGHUP. Must be called from the running event loop.
+        '''
+        self.get()
+        loop = asyncio.get_running_loop()
+        if self._watcher is None:
+            self._watcher = loop.create_task(self._watch())
+        if hasattr(signal, "SIGHUP"):
+            try:
+                loop.add_signal_handler(signal.SIGHUP, self.reload)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not on the main thread (e.g. the test client) or not supported by the loop
+                pass
+
+    async def stop(self):
+        if hasattr(signal, "SIGHUP"):
+            try:
+                asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+
+settings_store = SettingsStore()
+
+
+def get_settings() -> Settings:
+    '''
+    Description:
+    FastAPI dependency returning the current settings. Does no I/O.
+    '''
+    return settings_store.get()
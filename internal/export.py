@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from database import models
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Exported columns, never the password hashes
+USER_EXPORT_COLUMNS = (
+    models.User.id, models.User.username, models.User.full_name, models.User.email,
+    models.User.is_active, models.User.role_id,
+)
+SERVICE_EXPORT_COLUMNS = (
+    models.Service.id, models.Service.name, models.Service.description, models.Service.url,
+    models.Service.load_balancing, models.Service.is_active, models.Service.endpoints,
+)
+# Columns stored as json text, written as json objects in NDJSON (and left as text in CSV)
+JSON_COLUMNS = {"endpoints"}
+
+
+def users_export_query(active_only: bool = True):
+    query = select(*USER_EXPORT_COLUMNS).order_by(models.User.id)
+    if active_only:
+        query = query.where(models.User.is_active == True)
+    return query
+
+def services_export_query(active_only: bool = True):
+    query = select(*SERVICE_EXPORT_COLUMNS).order_by(models.Service.id)
+    if active_only:
+        query = query.where(models.Service.is_active == True)
+    return query
+
+
+def stream_rows(engine: Engine, query, batch_size: int) -> Iterator[list]:
+    '''
+    Description:
+    Runs a Core select with a server side cursor and yields its rows `batch_size` at a time.
+    Rows are plain tuples, no ORM objects or identity map, so memory is bound by the batch size
+    whatever the size of the table. The connection is held until the generator is exhausted or closed.
+    '''
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results = True, yield_per = batch_size).execute(query)
+        for rows in result.partitions():
+            yield rows
+
+def ndjson_chunks(batches: Iterable[list], columns: list[str]) -> Iterator[bytes]:
+    '''
+    Description:
+    One JSON object per row and line, one chunk per batch.
+    '''
+    json_columns = [index for index, column in enumerate(columns) if column in JSON_COLUMNS]
+    for rows in batches:
+        lines = []
+        for row in rows:
+            values = list(row)
+            for index in json_columns:
+                values[index] = json.loads(values[index]) if values[index] else {}
+            lines.append(json.dumps(dict(zip(columns, values))))
+        yield ("\n".join(lines) + "\n").encode()
+
+def csv_chunks(batches: Iterable[list], columns: list[str]) -> Iterator[bytes]:
+    '''
+    Description:
+    A header line then one CSV line per row, one chunk per batch.
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header of an empty table
+        yield buffer.getvalue().encode()
+
+def export_chunks(engine: Engine, query, export_format: str, batch_size: int) -> Iterator[bytes]:
+    '''
+    Description:
+    Body of an export response in the given format ("ndjson" or "csv"). A sync generator, so
+    StreamingResponse iterates it (and the database cursor) in the threadpool, off the event loop.
+    '''
+    columns = [column.name for column in query.selected_columns]
+    batches = stream_rows(engine, query, batch_size)
+    if export_format == "csv":
+        return csv_chunks(batches, columns)
+    return ndjson_chunks(batches, columns)
@@ -0,0 +1,61 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+
+
+class HashingPool:
+    '''
+    Description:
+    Runs password hashing and verification on a small dedicated thread pool so bcrypt
+    never blocks the event loop (bcrypt releases the GIL while hashing). At most
+    `workers` calls run at once and at most `max_queue` more wait for a worker; any
+    call beyond that is rejected right away with a 503 instead of queueing without bound.
+    '''
+
+    def __init__(self, workers: int = 2, max_queue: int = 64, busy_detail: str = "Too many concurrent authentication requests"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.busy_detail = busy_detail
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending = 0
+
+    def configure(self, workers: int, max_queue: int):
+        self.shutdown()
+        self.workers = workers
+        self.max_queue = max_queue
+
+    @property
+    def pending(self) -> int:
+        '''
+        Description:
+        Number of calls running or waiting for a worker.
+        '''
+        return self._pending
+
+    async def run(self, function, *args):
+        if self._pending >= self.workers + self.max_queue:
+            raise HTTPException(
+                status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail = self.busy_detail,
+                headers = {"Retry-After": "1"},
+            )
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = "password-hashing")
+
+        # Only touched from the event loop thread, no lock needed
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait = False)
+            self._executor = None
+
+
+hashing_pool = HashingPool()
+# Bulk imports hash on their own pool so they can never fill the queue of the logins
+import_hashing_pool = HashingPool(busy_detail = "Too many concurrent imports")
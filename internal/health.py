@@ -0,0 +1,146 @@
+import asyncio
+import logging
+
+import httpx
+
+from internal.http_client import upstream_clients
+from internal.load_balancer import LoadBalancer, UpstreamInstance
+from internal.registry import ServiceRegistry, service_registry
+
+
+logger = logging.getLogger(__name__)
+
+# Upstream answers that count as a failed proxy attempt for passive ejection
+FAILURE_STATUS_CODES = {502, 503, 504}
+
+
+class HealthChecker:
+    '''
+    Description:
+    Keeps the health flag of every service instance up to date.
+    - Active: every `interval` seconds each instance gets a GET on `path`. An answer below 500
+      within `timeout` is a success. `unhealthy_threshold` consecutive failures eject the
+      instance and `healthy_threshold` consecutive successes bring it back.
+    - Passive: `passive_failure_threshold` consecutive failed proxy attempts eject the
+      instance right away, without waiting for the next probe.
+    Ejected instances are skipped by the load balancer. Only active probes re-admit them,
+    so passive ejection is disabled when active checking is (interval <= 0).
+    '''
+
+    def __init__(
+            self,
+            registry: ServiceRegistry = service_registry,
+            interval: float = 10.0,
+            timeout: float = 2.0,
+            path: str = "/health",
+            unhealthy_threshold: int = 3,
+            healthy_threshold: int = 2,
+            passive_failure_threshold: int = 5,
+            ):
+        self.registry = registry
+        self.interval = interval
+        self.timeout = timeout
+        self.path = path
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.passive_failure_threshold = passive_failure_threshold
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def configure(self, settings):
+        self.interval = settings.HEALTH_CHECK_INTERVAL
+        self.timeout = settings.HEALTH_CHECK_TIMEOUT
+        self.path = settings.HEALTH_CHECK_PATH
+        self.unhealthy_threshold = settings.HEALTH_CHECK_UNHEALTHY_THRESHOLD
+        self.healthy_threshold = settings.HEALTH_CHECK_HEALTHY_THRESHOLD
+        self.passive_failure_threshold = settings.HEALTH_PASSIVE_FAILURE_THRESHOLD
+
+    #region Active checks
+
+    def record_probe(self, service_name: str, balancer: LoadBalancer, instance: UpstreamInstance, ok: bool):
+        if ok:
+            instance.probe_failures = 0
+            instance.probe_successes += 1
+            if not instance.healthy and instance.probe_successes >= self.healthy_threshold:
+                instance.proxy_failures = 0
+                balancer.set_healthy(instance, True)
+                logger.info("Instance %s of %s is healthy again", instance.url, service_name)
+        else:
+            instance.probe_successes = 0
+            instance.probe_failures += 1
+            if instance.healthy and instance.probe_failures >= self.unhealthy_threshold:
+                balancer.set_healthy(instance, False)
+                logger.warning("Instance %s of %s failed %d health checks, ejecting it", instance.url, service_name, instance.probe_failures)
+
+    async def probe(self, service_name: str, balancer: LoadBalancer, instance: UpstreamInstance):
+        client = upstream_clients.get(service_name, instance.url)
+        try:
+            response = await client.get(self.path, timeout = self.timeout)
+            ok = response.status_code < 500
+        except httpx.HTTPError:
+            ok = False
+        self.record_probe(service_name, balancer, instance, ok)
+
+    async def check_once(self):
+        '''
+        Description:
+        Probes every instance of every registered service concurrently.
+        '''
+        probes = [
+            self.probe(route.name, route.balancer, instance)
+            for route in self.registry.snapshot.services.values()
+            for instance in route.balancer.instances
+        ]
+        await asyncio.gather(*probes)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check_once()
+            except Exception:
+                logger.exception("Health check round failed")
+
+    def start(self):
+        '''
+        Description:
+        Starts the background checks. Must be called on application startup.
+        '''
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    #endregion Active checks
+
+    #region Passive checks
+
+    def record_proxy_result(self, service_name: str, balancer: LoadBalancer, instance: UpstreamInstance, ok: bool):
+        '''
+        Description:
+        Called by the gateway after every proxy attempt on an instance.
+        '''
+        if ok:
+            instance.proxy_failures = 0
+            return
+        instance.proxy_failures += 1
+        if self.enabled and instance.healthy and instance.proxy_failures >= self.passive_failure_threshold:
+            # Needs fresh successful probes to come back
+            instance.probe_successes = 0
+            balancer.set_healthy(instance, False)
+            logger.warning("Instance %s of %s failed %d proxied requests in a row, ejecting it", instance.url, service_name, instance.proxy_failures)
+
+    #endregion Passive checks
+
+
+health_checker = HealthChecker()
@@ -0,0 +1,144 @@
+import importlib.util
+import logging
+
+import httpx
+
+from internal.config import Settings, get_settings
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_LIMITS = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 10.0,
+    "http2": False,
+}
+
+
+class UpstreamClients:
+    '''
+    Description:
+    Keeps one long lived httpx.AsyncClient per upstream instance so the proxy reuses
+    pooled keep-alive connections instead of paying a TCP/TLS handshake per request.
+    Clients are created lazily the first time a service is proxied to and are all
+    closed together on application shutdown.
+    '''
+
+    def __init__(self):
+        self._clients: dict[tuple[str, str], httpx.AsyncClient] = {}
+        self._defaults = dict(DEFAULT_POOL_LIMITS)
+        self._service_limits: dict[str, dict] = {}
+        self._started = False
+
+    def start(self, settings: Settings | None = None):
+        '''
+        Description:
+        Loads the pool options. Must be called on application startup, and is called again
+        when a settings reload changes them: clients created afterwards use the new options,
+        the ones already open keep theirs until a restart.
+
+        Parameters:
+        - settings: Settings to use. If not given the current settings are used.
+        '''
+        config = (settings or get_settings()).dict()
+
+        self._defaults = dict(DEFAULT_POOL_LIMITS)
+        for key in DEFAULT_POOL_LIMITS:
+            config_key = f"UPSTREAM_{key.upper()}"
+            if config.get(config_key) is not None:
+                self._defaults[key] = config[config_key]
+        self._service_limits = config.get("UPSTREAM_SERVICE_LIMITS") or {}
+        self._started = True
+
+    def limits_for(self, service_name: str) -> dict:
+        '''
+        Description:
+        Returns the pool options of a service: the defaults with the service overrides applied.
+        '''
+        options = dict(self._defaults)
+        options.update(self._service_limits.get(service_name, {}))
+        return options
+
+    def get(self, service_name: str, base_url: str) -> httpx.AsyncClient:
+        '''
+        Description:
+        Returns the pooled client of a service instance, creating it on first use.
+
+        Parameters:
+        - service_name: Name of the registered service, selects the pool limits
+        - base_url: Url of the service instance
+        '''
+        if not self._started:
+            raise RuntimeError("Upstream clients used before application startup")
+
+        base_url = str(base_url).rstrip("/")
+        client = self._clients.get((service_name, base_url))
+        if client is not None:
+            return client
+
+        options = self.limits_for(service_name)
+        http2 = bool(options["http2"])
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested for %s but the 'h2' package is not installed, using HTTP/1.1", service_name)
+            http2 = False
+
+        new_client = httpx.AsyncClient(
+            base_url = base_url,
+            http2 = http2,
+            timeout = options["timeout"],
+            limits = httpx.Limits(
+                max_connections = options["max_connections"],
+                max_keepalive_connections = options["max_keepalive_connections"],
+                keepalive_expiry = options["keepalive_expiry"],
+            ),
+        )
+        self._clients[(service_name, base_url)] = new_client
+        return new_client
+
+    async def discard(self, service_name: str, base_url: str | None = None):
+        '''
+        Description:
+        Closes and forgets the client of a service instance, or of every instance of the
+        service if no url is given, e.g. when the service is unregistered.
+        '''
+        if base_url is None:
+            keys = [key for key in self._clients if key[0] == service_name]
+        else:
+            keys = [(service_name, str(base_url).rstrip("/"))]
+        for key in keys:
+            client = self._clients.pop(key, None)
+            if client is not None:
+                await client.aclose()
+
+    def connection_counts(self) -> dict[str, tuple[int, int]]:
+        '''
+        Description:
+        Returns (in use, idle) pooled connections per service, summed over its instances.
+        Reads the httpcore pool of the default transport, clients with a custom transport are skipped.
+        '''
+        counts = {}
+        for (service_name, _), client in self._clients.items():
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            if not hasattr(pool, "connections"):
+                continue
+            connections = pool.connections
+            idle = sum(1 for connection in connections if connection.is_idle())
+            in_use, previous_idle = counts.get(service_name, (0, 0))
+            counts[service_name] = (in_use + len(connections) - idle, previous_idle + idle)
+        return counts
+
+    async def close(self):
+        '''
+        Description:
+        Closes every pooled client. Must be called on application shutdown.
+        '''
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+        self._started = False
+
+
+upstream_clients = UpstreamClients()
@@ -1,12 +1,15 @@
 from sqlalchemy.orm import Session
 
-from database.crud import create_super_admin, create_role, create_permission
+from database.crud import create_super_admin, create_role, create_permission, seed_registry_versions
 from database.database import SessionLocal
 from internal.schemas import RoleCreate, UserCreate, PermissionBase
 
 def initialize_database():
     db = SessionLocal()
     try:
+        # Change counters of the registry, before anything can bump them
+        seed_registry_versions(db)
+
         # Create roles
         admin_role = RoleCreate(
             name="admin",
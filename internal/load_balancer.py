@@ -0,0 +1,134 @@
+import random
+from typing import Callable
+
+
+class UpstreamInstance:
+    '''
+    Description:
+    One replica of a service as seen by the balancer. `in_flight` counts the proxied
+    requests currently using it, including responses that are still streaming.
+    '''
+    __slots__ = ("url", "weight", "in_flight", "current_weight", "healthy", "probe_failures", "probe_successes", "proxy_failures")
+
+    def __init__(self, url: str, weight: int = 1):
+        self.url = url
+        self.weight = weight
+        self.in_flight = 0
+        # Smooth weighted round robin state
+        self.current_weight = 0
+        # Health state, see internal/health.py
+        self.healthy = True
+        self.probe_failures = 0
+        self.probe_successes = 0
+        self.proxy_failures = 0
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.weight
+
+    def __repr__(self):
+        return f"UpstreamInstance({self.url!r}, weight={self.weight}, in_flight={self.in_flight})"
+
+
+def round_robin(balancer: "LoadBalancer", instances: list[UpstreamInstance]) -> UpstreamInstance:
+    '''
+    Description:
+    Smooth weighted round robin (as in nginx): spreads the picks of heavier instances
+    evenly instead of sending them in bursts.
+    '''
+    total = 0
+    best = None
+    for instance in instances:
+        instance.current_weight += instance.weight
+        total += instance.weight
+        if best is None or instance.current_weight > best.current_weight:
+            best = instance
+    best.current_weight -= total
+    return best
+
+def least_outstanding(balancer: "LoadBalancer", instances: list[UpstreamInstance]) -> UpstreamInstance:
+    '''
+    Description:
+    Instance with the fewest in-flight requests relative to its weight, ties broken at random.
+    '''
+    lowest = min(instance.load for instance in instances)
+    return balancer.random.choice([instance for instance in instances if instance.load == lowest])
+
+def power_of_two(balancer: "LoadBalancer", instances: list[UpstreamInstance]) -> UpstreamInstance:
+    '''
+    Description:
+    Samples two instances proportionally to their weight and keeps the less loaded one.
+    Close to least outstanding without scanning every instance or herding on the same one.
+    '''
+    first, second = balancer.random.choices(instances, weights = [instance.weight for instance in instances], k = 2)
+    return first if first.load <= second.load else second
+
+
+class NoHealthyInstance(Exception):
+    pass
+
+
+STRATEGIES: dict[str, Callable[["LoadBalancer", list[UpstreamInstance]], UpstreamInstance]] = {
+    "round_robin": round_robin,
+    "least_outstanding": least_outstanding,
+    "power_of_two": power_of_two,
+}
+
+
+class LoadBalancer:
+    '''
+    Description:
+    Picks an instance of a service with the configured strategy and tracks the in-flight
+    requests of every instance. The gateway runs on a single event loop thread and none
+    of these methods await, so the counters need no lock.
+    '''
+
+    def __init__(self, instances: list[UpstreamInstance], strategy: str = "round_robin", rng: random.Random | None = None):
+        if not instances:
+            raise ValueError("A load balancer needs at least one instance")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy {strategy}")
+        self.instances = instances
+        self.strategy = strategy
+        self.random = rng or random.Random()
+        self._pick = STRATEGIES[strategy]
+        # Healthy instances, the only ones the strategy picks from
+        self.available = [instance for instance in instances if instance.healthy]
+
+    def pick(self, exclude: UpstreamInstance | None = None) -> UpstreamInstance:
+        available = self.available
+        if exclude is not None and exclude in available:
+            available = [instance for instance in available if instance is not exclude]
+        if len(available) == 1:
+            return available[0]
+        if not available:
+            raise NoHealthyInstance()
+        return self._pick(self, available)
+
+    def set_healthy(self, instance: UpstreamInstance, healthy: bool):
+        '''
+        Description:
+        Adds the instance back to or removes it from the instances the strategy picks from.
+        '''
+        if instance.healthy == healthy:
+            return
+        instance.healthy = healthy
+        instance.current_weight = 0
+        self.available = [candidate for candidate in self.instances if candidate.healthy]
+
+    def acquire(self, exclude: UpstreamInstance | None = None) -> UpstreamInstance:
+        '''
+        Description:
+        Picks an instance (other than `exclude`) and counts the request as in flight on it.
+        Must be paired with release.
+        '''
+        instance = self.pick(exclude)
+        instance.in_flight += 1
+        return instance
+
+    @staticmethod
+    def release(instance: UpstreamInstance):
+        instance.in_flight -= 1
+
+    def same_instances(self, instances: list[tuple[str, int]], strategy: str) -> bool:
+        return strategy == self.strategy and instances == [(instance.url, instance.weight) for instance in self.instances]
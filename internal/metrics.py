@@ -0,0 +1,400 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+
+from database.database import engine, async_engine, replica_engines
+from internal.bulkhead import bulkheads
+from internal.http_client import upstream_clients
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cache hit to a slow upstream
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+#region Metric types
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+
+class HistogramChild:
+    '''
+    Description:
+    Observations of one label combination. Counts are kept per bucket and only made
+    cumulative when rendered, so observing is a bisect and two additions.
+    '''
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # One more slot for the observations above the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric:
+    '''
+    Description:
+    A metric family. `labels` returns the child of a label combination, created on first use;
+    the hot path binds its children once and keeps the references, so recording a value
+    allocates nothing. Metrics whose values live elsewhere (pool sizes, bulkhead counters)
+    pass `collect`, called on every scrape and returning (label values, value) pairs.
+    '''
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 collect: Callable[[], Iterable[tuple[tuple, float]]] | None = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self._children: dict[tuple, object] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects the labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        self._children.pop(values, None)
+
+    def samples(self) -> Iterable[tuple[str, tuple, tuple, float]]:
+        '''
+        Description:
+        Yields (name suffix, label names, label values, value) of every sample.
+        '''
+        if self.collect is not None:
+            for values, value in self.collect():
+                yield "", self.labelnames, values, value
+            return
+        for values, child in list(self._children.items()):
+            yield "", self.labelnames, values, child.value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for suffix, names, values, value in self.samples():
+            yield f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def samples(self):
+        bucket_names = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", bucket_names, values + (format_value(bound),), cumulative
+            yield "_sum", self.labelnames, values, child.sum
+            yield "_count", self.labelnames, values, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        '''
+        Description:
+        Returns every metric in the Prometheus text exposition format (version 0.0.4).
+        '''
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logger.exception("Could not collect the metric %s", metric.name)
+        return "\n".join(lines) + "\n"
+
+#endregion Metric types
+
+
+registry = MetricsRegistry()
+
+#region Gateway metrics
+
+http_requests = registry.register(Counter("gateway_http_requests_total", "Requests handled, per route", ("method", "route")))
+http_errors = registry.register(Counter("gateway_http_errors_total", "Requests answered with a 5xx status, per route", ("method", "route")))
+http_latency = registry.register(Histogram("gateway_http_request_duration_seconds", "Time until the response was sent, per route", ("method", "route")))
+
+upstream_requests = registry.register(Counter("gateway_upstream_requests_total", "Attempts sent to an upstream service", ("service",)))
+upstream_errors = registry.register(Counter("gateway_upstream_errors_total", "Attempts that could not connect or got 502/503/504", ("service",)))
+upstream_latency = registry.register(Histogram("gateway_upstream_duration_seconds", "Time until the upstream response headers arrived", ("service",)))
+
+auth_latency = registry.register(Histogram("gateway_auth_duration_seconds", "Time spent in get_current_user, by where the user came from", ("source",)))
+auth_from_cache = auth_latency.labels("cache")
+auth_from_token = auth_latency.labels("token")
+
+db_query_latency = registry.register(Histogram("gateway_db_query_duration_seconds", "Time spent executing database statements", ("engine",)))
+
+event_loop_lag = registry.register(Histogram(
+    "gateway_event_loop_lag_seconds",
+    "Delay of the periodic event loop probe past its deadline",
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+))
+
+
+class UpstreamMetrics:
+    __slots__ = ("requests", "errors", "latency")
+
+    def __init__(self, service_name: str):
+        self.requests = upstream_requests.labels(service_name)
+        self.errors = upstream_errors.labels(service_name)
+        self.latency = upstream_latency.labels(service_name)
+
+
+_upstream_metrics: dict[str, UpstreamMetrics] = {}
+
+def upstream(service_name: str) -> UpstreamMetrics:
+    '''
+    Description:
+    Pre-bound children of a service, bound on its first call.
+    '''
+    metrics = _upstream_metrics.get(service_name)
+    if metrics is None:
+        metrics = _upstream_metrics[service_name] = UpstreamMetrics(service_name)
+    return metrics
+
+#endregion Gateway metrics
+
+#region Collected at scrape time
+
+def database_pools():
+    engines = [("sync", engine), ("async", async_engine.sync_engine)]
+    engines += [(f"replica{index}", replica.sync_engine) for index, replica in enumerate(replica_engines)]
+    for name, engine in engines:
+        # NullPool and StaticPool (SQLite) do not count their connections
+        if hasattr(engine.pool, "checkedout"):
+            yield name, engine.pool
+
+def bulkhead_samples(key: str):
+    return [((status["service"],), status[key]) for status in bulkheads.status()]
+
+
+registry.register(Gauge(
+    "gateway_db_pool_checked_out", "Database connections in use", ("engine",),
+    collect = lambda: [((name,), pool.checkedout()) for name, pool in database_pools()],
+))
+registry.register(Gauge(
+    "gateway_db_pool_size", "Database connections kept open by the pool", ("engine",),
+    collect = lambda: [((name,), pool.size()) for name, pool in database_pools()],
+))
+registry.register(Gauge(
+    "gateway_upstream_connections", "Pooled upstream connections", ("service", "state"),
+    collect = lambda: [
+        ((service_name, state), count)
+        for service_name, counts in upstream_clients.connection_counts().items()
+        for state, count in zip(("in_use", "idle"), counts)
+    ],
+))
+registry.register(Gauge(
+    "gateway_bulkhead_active", "Requests holding a bulkhead slot", ("service",),
+    collect = lambda: bulkhead_samples("active"),
+))
+registry.register(Gauge(
+    "gateway_bulkhead_queue_depth", "Requests waiting for a bulkhead slot", ("service",),
+    collect = lambda: bulkhead_samples("queue_depth"),
+))
+registry.register(Counter(
+    "gateway_bulkhead_queue_wait_seconds_total", "Time spent waiting for a bulkhead slot", ("service",),
+    collect = lambda: bulkhead_samples("wait_seconds_total"),
+))
+registry.register(Counter(
+    "gateway_bulkhead_rejected_total", "Requests rejected because the bulkhead queue was full", ("service",),
+    collect = lambda: bulkhead_samples("rejected"),
+))
+registry.register(Counter(
+    "gateway_bulkhead_timeouts_total", "Requests that waited longer than the bulkhead queue timeout", ("service",),
+    collect = lambda: bulkhead_samples("timeouts"),
+))
+
+def instrument_engine(engine, name: str):
+    '''
+    Description:
+    Times every statement executed on a (sync) engine. For an async engine pass its sync_engine.
+    '''
+    latency = db_query_latency.labels(name)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        latency.observe(time.perf_counter() - conn.info["query_started"].pop())
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            latency.observe(time.perf_counter() - started.pop())
+
+
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+for index, replica in enumerate(replica_engines):
+    instrument_engine(replica.sync_engine, f"replica{index}")
+
+#endregion Collected at scrape time
+
+
+class MetricsMiddleware:
+    '''
+    Description:
+    Plain ASGI middleware counting and timing every HTTP request per method and route
+    template (e.g. "/users/{user_id}"), so paths with ids do not create new series.
+    The children of a route are bound on its first request and reused afterwards.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        # Keyed by id, routes compare by value and are not hashable. They live as long as the app.
+        self._children: dict[int, dict[str, tuple[CounterChild, CounterChild, HistogramChild]]] = {}
+
+    def children(self, route, method: str) -> tuple[CounterChild, CounterChild, HistogramChild]:
+        by_method = self._children.get(id(route))
+        if by_method is None:
+            by_method = self._children[id(route)] = {}
+        bound = by_method.get(method)
+        if bound is None:
+            template = getattr(route, "path", "unmatched")
+            bound = by_method[method] = (
+                http_requests.labels(method, template),
+                http_errors.labels(method, template),
+                http_latency.labels(method, template),
+            )
+        return bound
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope
+            requests, errors, latency = self.children(scope.get("route"), scope["method"])
+            requests.inc()
+            if status_code >= 500:
+                errors.inc()
+            latency.observe(time.perf_counter() - started)
+
+
+class EventLoopMonitor:
+    '''
+    Description:
+    Sleeps `interval` seconds in a loop and records how late it wakes up. Lag means
+    something blocks the event loop (CPU bound work, sync I/O) and delays every request.
+    '''
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self._lag = event_loop_lag.labels()
+        self._task: asyncio.Task | None = None
+
+    async def _probe(self):
+        while True:
+            deadline = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self._lag.observe(max(0.0, time.perf_counter() - deadline))
+
+    def start(self, interval: float | None = None):
+        if interval is not None:
+            self.interval = interval
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._probe())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+event_loop_monitor = EventLoopMonitor()
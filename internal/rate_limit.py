@@ -0,0 +1,214 @@
+import importlib.util
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import HTTPException, status
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Limit:
+    '''
+    Description:
+    Token bucket refilled with `rate` tokens per second up to `burst` tokens. A request takes one token.
+    '''
+    rate: float
+    burst: int
+
+    def __post_init__(self):
+        if self.rate <= 0 or self.burst < 1:
+            raise ValueError("A rate limit needs a positive rate and a burst of at least 1")
+
+
+def parse_limit(options: dict | None) -> Limit | None:
+    return Limit(**options) if options else None
+
+
+class LocalBackend:
+    '''
+    Description:
+    In-process token buckets, enough for a single worker and for tests. A bucket is stored as
+    (tokens, updated_at, full_at), constant memory per key, and refilled lazily on access.
+    Keys are kept in order of last use; a bucket that refilled completely is the same as a
+    missing one, so the least recently used full buckets are dropped on every call.
+    Only used from the event loop thread, so no lock is needed.
+    '''
+
+    def __init__(self, clock = time.monotonic):
+        self.clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float, float]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key: str, limit: Limit, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(limit.burst)
+        tokens, updated_at, _ = bucket
+        return min(float(limit.burst), tokens + (now - updated_at) * limit.rate)
+
+    async def acquire(self, buckets: list[tuple[str, Limit]], cost: int = 1) -> float:
+        '''
+        Description:
+        Takes `cost` tokens from every bucket, or from none of them if one is short.
+        Returns 0 on success, else the seconds until all buckets hold enough tokens.
+        '''
+        now = self.clock()
+        self._expire(now)
+        levels = [self._tokens(key, limit, now) for key, limit in buckets]
+        wait = max(
+            ((cost - tokens) / limit.rate for (_, limit), tokens in zip(buckets, levels) if tokens < cost),
+            default = 0.0,
+        )
+        if wait > 0:
+            return wait
+        for (key, limit), tokens in zip(buckets, levels):
+            remaining = tokens - cost
+            self._buckets[key] = (remaining, now, now + (limit.burst - remaining) / limit.rate)
+            self._buckets.move_to_end(key)
+        return 0.0
+
+    def _expire(self, now: float):
+        while self._buckets:
+            key, (_, _, full_at) = next(iter(self._buckets.items()))
+            if full_at > now:
+                break
+            del self._buckets[key]
+
+    async def close(self):
+        self._buckets.clear()
+
+
+# Same algorithm as LocalBackend, run atomically inside Redis with the clock of the server.
+# Buckets are hashes that expire once they refilled.
+REDIS_ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local cost = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local tokens = burst
+    if bucket[1] then
+        tokens = math.min(burst, tonumber(bucket[1]) + (now - tonumber(bucket[2])) * rate)
+    end
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst = tonumber(ARGV[2 * i]), tonumber(ARGV[2 * i + 1])
+    local remaining = levels[i] - cost
+    redis.call('HSET', key, 'tokens', tostring(remaining), 'updated_at', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil((burst - remaining) / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+
+class RedisBackend:
+    '''
+    Description:
+    Token buckets shared by every worker (and gateway instance) through Redis. Needs the
+    optional 'redis' package.
+    '''
+
+    def __init__(self, url: str, prefix: str = "rate_limit:"):
+        import redis.asyncio
+
+        self.prefix = prefix
+        self._redis = redis.asyncio.from_url(url)
+        self._acquire = self._redis.register_script(REDIS_ACQUIRE_SCRIPT)
+
+    async def acquire(self, buckets: list[tuple[str, Limit]], cost: int = 1) -> float:
+        keys = [self.prefix + key for key, _ in buckets]
+        args = [cost] + [value for _, limit in buckets for value in (limit.rate, limit.burst)]
+        return float(await self._acquire(keys = keys, args = args))
+
+    async def close(self):
+        await self._redis.close()
+
+
+class RateLimiter:
+    '''
+    Description:
+    Admission control of the gateway. A request takes a token from up to three buckets:
+    - its user, with the limit of the role of the user or the default user limit,
+    - its role, shared by every user of the role,
+    - its target service, shared by every user.
+    Buckets without a configured limit are skipped, and the request is rejected with 429 and
+    Retry-After if any bucket is empty (taking no token from the others).
+    '''
+
+    def __init__(self):
+        self.backend = LocalBackend()
+        self.user_limit: Limit | None = None
+        self.user_limits_by_role: dict[int, Limit] = {}
+        self.role_limits: dict[int, Limit] = {}
+        self.service_limits: dict[str, Limit] = {}
+        self.rejected = 0
+
+    def configure(self, settings):
+        self.user_limit = parse_limit(settings.RATE_LIMIT_USER)
+        self.user_limits_by_role = {role_id: parse_limit(options) for role_id, options in settings.RATE_LIMIT_USER_BY_ROLE.items()}
+        self.role_limits = {role_id: parse_limit(options) for role_id, options in settings.RATE_LIMIT_ROLES.items()}
+        self.service_limits = {name: parse_limit(options) for name, options in settings.RATE_LIMIT_SERVICES.items()}
+
+        if settings.RATE_LIMIT_BACKEND == "redis":
+            if importlib.util.find_spec("redis") is None:
+                logger.warning("Redis rate limiting requested but the 'redis' package is not installed, limits are per worker")
+            else:
+                self.backend = RedisBackend(settings.RATE_LIMIT_REDIS_URL)
+                return
+        self.backend = LocalBackend()
+
+    def buckets(self, user, service_name: str) -> list[tuple[str, Limit]]:
+        buckets = []
+        user_limit = self.user_limits_by_role.get(user.role_id, self.user_limit)
+        if user_limit is not None:
+            buckets.append((f"user:{user.id}", user_limit))
+        if user.role_id in self.role_limits:
+            buckets.append((f"role:{user.role_id}", self.role_limits[user.role_id]))
+        if service_name in self.service_limits:
+            buckets.append((f"service:{service_name}", self.service_limits[service_name]))
+        return buckets
+
+    async def check(self, user, service_name: str):
+        '''
+        Description:
+        Takes the tokens of a request of the user to the service or raises 429.
+        The request is let through if the backend cannot be reached.
+        '''
+        buckets = self.buckets(user, service_name)
+        if not buckets:
+            return
+        try:
+            wait = await self.backend.acquire(buckets)
+        except Exception:
+            logger.exception("Could not check the rate limits, letting the request through")
+            return
+        if wait > 0:
+            self.rejected += 1
+            raise HTTPException(
+                status_code = status.HTTP_429_TOO_MANY_REQUESTS,
+                detail = "Rate limit exceeded",
+                headers = {"Retry-After": str(math.ceil(wait))},
+            )
+
+    async def close(self):
+        await self.backend.close()
+
+
+rate_limiter = RateLimiter()
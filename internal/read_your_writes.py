@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+# Session.info entry holding the key of the request the session serves
+SESSION_KEY = "read_your_writes_key"
+
+
+class ReadYourWrites:
+    '''
+    Description:
+    Remembers for `window` seconds the auth tokens whose requests committed a write, so that their
+    following reads go to the primary instead of a replica that may not have the write yet.
+    Requests are identified by a digest of their bearer token. Writes are noted when a session
+    tagged with `track` commits, whichever thread commits it. Kept per worker, like the token
+    cache: with several workers a client only reads its writes if its requests reach the same
+    worker, or after the replicas caught up.
+    '''
+
+    def __init__(self, window: float = 5.0, max_size: int = 100000, clock = time.monotonic):
+        self.window = window
+        self.max_size = max_size
+        self.clock = clock
+        # key -> end of the window, in the order of the writes so expired entries are at the front
+        self._writes: OrderedDict[str, float] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, settings):
+        self.window = settings.DB_READ_YOUR_WRITES_SECONDS
+
+    @staticmethod
+    def key(request: Request) -> str | None:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def track(self, session, request: Request) -> str | None:
+        '''
+        Description:
+        Tags a (sync or async) session with the key of the request, its commits count as writes of the request.
+        '''
+        key = session.info[SESSION_KEY] = self.key(request)
+        return key
+
+    def wrote(self, key: str | None):
+        if key is None or self.window <= 0:
+            return
+        now = self.clock()
+        with self._lock:
+            self._writes.pop(key, None)
+            self._writes[key] = now + self.window
+            while self._writes and (len(self._writes) > self.max_size or next(iter(self._writes.values())) <= now):
+                self._writes.popitem(last = False)
+
+    def recent(self, key: str | None) -> bool:
+        if key is None:
+            return False
+        until = self._writes.get(key)
+        return until is not None and until > self.clock()
+
+
+read_your_writes = ReadYourWrites()
+
+
+@event.listens_for(Session, "after_commit")
+def remember_write(session: Session):
+    # Also fires for the sync session behind an AsyncSession, which shares its info
+    read_your_writes.wrote(session.info.get(SESSION_KEY))
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Mapping
+
+from database import crud
+from database.database import AsyncSessionLocal
+from internal.http_client import upstream_clients
+from internal.load_balancer import LoadBalancer, UpstreamInstance
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ServiceRoute:
+    id: int
+    name: str
+    url: str
+    # (url, weight) of every instance, the service url alone if it has no instances
+    instances: tuple[tuple[str, int], ...] = ()
+    load_balancing: str = "round_robin"
+    balancer: LoadBalancer = field(default=None, compare=False, repr=False)
+
+    @property
+    def instance_urls(self) -> set[str]:
+        return {url for url, _ in self.instances}
+
+
+def make_route(id: int, name: str, url: str, instances: list[tuple[str, int]] | None = None, load_balancing: str = "round_robin") -> ServiceRoute:
+    instances = tuple(instances or [(url, 1)])
+    balancer = LoadBalancer([UpstreamInstance(instance_url, weight) for instance_url, weight in instances], load_balancing)
+    return ServiceRoute(id = id, name = name, url = url, instances = instances, load_balancing = load_balancing, balancer = balancer)
+
+
+@dataclass(frozen=True)
+class RegistrySnapshot:
+    version: int
+    services: Mapping[str, ServiceRoute]
+
+
+EMPTY_SNAPSHOT = RegistrySnapshot(version = -1, services = MappingProxyType({}))
+
+
+def load_routes(db) -> dict[str, ServiceRoute]:
+    '''
+    Description:
+    Builds the routing table from the active services. If a name is used by several
+    active services the oldest one wins.
+    '''
+    routes = {}
+    for db_service in crud.get_active_services(db, skip = 0, limit = None):
+        if db_service.name not in routes:
+            routes[db_service.name] = make_route(
+                db_service.id,
+                db_service.name,
+                db_service.url,
+                [(instance.url, instance.weight) for instance in db_service.instances],
+                db_service.load_balancing or "round_robin",
+            )
+    return routes
+
+
+class ServiceRegistry:
+    '''
+    Description:
+    In-process, read only snapshot of the services stored in the database. Lookups are a
+    plain dict read. The snapshot is rebuilt when the registry version in the database
+    changes, polled every `refresh_interval` seconds, and replaced with a single reference
+    swap, so every worker converges on the same routing table.
+    '''
+
+    def __init__(self, refresh_interval: float = 2.0):
+        self.refresh_interval = refresh_interval
+        self._snapshot = EMPTY_SNAPSHOT
+        self._poller: asyncio.Task | None = None
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def snapshot(self) -> RegistrySnapshot:
+        return self._snapshot
+
+    def lookup(self, service_name: str) -> ServiceRoute | None:
+        return self._snapshot.services.get(service_name)
+
+    async def publish(self, version: int, routes: dict[str, ServiceRoute]):
+        '''
+        Description:
+        Swaps in a new snapshot and closes the pooled clients of instances that disappeared.
+        Services whose instances did not change keep their balancer and its in-flight counts.
+        '''
+        previous = self._snapshot
+        routes = dict(routes)
+        for name, route in routes.items():
+            previous_route = previous.services.get(name)
+            if previous_route is not None and previous_route.balancer.same_instances(list(route.instances), route.load_balancing):
+                routes[name] = replace(route, balancer = previous_route.balancer)
+        self._snapshot = RegistrySnapshot(version = version, services = MappingProxyType(routes))
+
+        for name, route in previous.services.items():
+            current = routes.get(name)
+            for url in route.instance_urls - (current.instance_urls if current else set()):
+                await upstream_clients.discard(name, url)
+
+    async def refresh(self, force: bool = False) -> bool:
+        '''
+        Description:
+        Reloads the snapshot if the registry version changed. Returns True if it was replaced.
+        '''
+        async with self._refresh_lock:
+            async with AsyncSessionLocal() as db:
+                version = await db.run_sync(crud.get_registry_version)
+                if version == self._snapshot.version and not force:
+                    return False
+                routes = await db.run_sync(load_routes)
+            await self.publish(version, routes)
+            return True
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Could not refresh the service registry, keeping the previous snapshot")
+
+    async def start(self, refresh_interval: float | None = None):
+        '''
+        Description:
+        Loads the first snapshot and starts polling for changes. Must be called on application startup.
+        '''
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+        await self.refresh(force = True)
+        if self._poller is None:
+            self._poller = asyncio.get_running_loop().create_task(self._poll())
+
+    async def stop(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+
+service_registry = ServiceRegistry()
@@ -0,0 +1,375 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+from internal.authorization import PermissionTrie, request_tokens
+
+
+logger = logging.getLogger(__name__)
+
+# Statuses a shared cache may store without explicit freshness (RFC 9110 section 15.1)
+CACHEABLE_STATUS_CODES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+
+# Headers taken from a 304 answer when an entry is revalidated
+REVALIDATION_HEADERS = {"cache-control", "date", "etag", "expires", "last-modified", "vary"}
+
+# Request headers carrying credentials, forwarded upstream by the gateway
+CREDENTIAL_HEADERS = ("authorization", "cookie")
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    directives = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+def freshness_lifetime(headers, directives: dict, default_ttl: float) -> float:
+    '''
+    Description:
+    Seconds a response stays fresh: s-maxage, then max-age, then Expires - Date, then the configured default.
+    '''
+    for directive in ("s-maxage", "max-age"):
+        if directives.get(directive) is not None:
+            try:
+                return max(0.0, float(directives[directive]))
+            except ValueError:
+                return 0.0
+    if headers.get("expires"):
+        try:
+            expires = parsedate_to_datetime(headers["expires"]).timestamp()
+            date = parsedate_to_datetime(headers["date"]).timestamp() if headers.get("date") else time.time()
+            return max(0.0, expires - date)
+        except (TypeError, ValueError):
+            return 0.0
+    return default_ttl
+
+
+@dataclass
+class CachePolicy:
+    '''
+    Description:
+    Caching options of a service. `routes` are "endpoint" patterns in the permission syntax
+    (e.g. "files/*"), all routes of the service when empty. Responses to requests with
+    credentials are stored per user unless they are marked public or s-maxage (RFC 9111
+    section 3.5); with `vary_by_user` every response is stored per user.
+    '''
+    service_name: str
+    routes: list[str] = field(default_factory=list)
+    vary_by_user: bool = False
+    default_ttl: float = 0.0
+
+    def __post_init__(self):
+        patterns = [f"{self.service_name}:{route}" for route in self.routes] or [self.service_name]
+        self._trie = PermissionTrie.compile(patterns)
+
+    def covers(self, path: str) -> bool:
+        return self._trie.allows(request_tokens(self.service_name, path))
+
+
+@dataclass
+class CachedResponse:
+    key: str
+    status_code: int
+    headers: list[tuple[str, str]]
+    body: bytes | None
+    body_path: str | None
+    size: int
+    stored_at: float
+    expires_at: float
+    etag: str | None
+    last_modified: str | None
+    vary: tuple[tuple[str, str], ...]
+    no_cache: bool
+
+    @property
+    def fresh(self) -> bool:
+        return not self.no_cache and time.time() < self.expires_at
+
+    @property
+    def revalidatable(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def matches(self, request_headers) -> bool:
+        return all(request_headers.get(name, "") == value for name, value in self.vary)
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["if-none-match"] = self.etag
+        if self.last_modified is not None:
+            headers["if-modified-since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    '''
+    Description:
+    Cache of upstream GET responses with a memory budget and an optional disk tier.
+    Bodies up to `disk_threshold` bytes are kept in memory, larger ones (up to
+    `max_entry_bytes`) are written under `disk_path` when it is set and skipped otherwise.
+    Each tier evicts its least recently used entries once over budget. Entries are
+    only touched from the event loop thread; disk writes run in a worker thread.
+    '''
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 8 * 1024 * 1024,
+                 disk_path: str | None = None, disk_threshold: int = 256 * 1024, disk_max_bytes: int = 1024 * 1024 * 1024):
+        self.policies: dict[str, CachePolicy] = {}
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "revalidated": 0, "stores": 0, "evictions": 0}
+        self.configure_limits(max_bytes, max_entry_bytes, disk_path, disk_threshold, disk_max_bytes)
+
+    def configure_limits(self, max_bytes: int, max_entry_bytes: int, disk_path: str | None, disk_threshold: int, disk_max_bytes: int):
+        self.clear()
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_path = disk_path
+        self.disk_threshold = disk_threshold
+        self.disk_max_bytes = disk_max_bytes
+        if disk_path:
+            os.makedirs(disk_path, exist_ok = True)
+
+    def configure(self, settings):
+        self.policies = {
+            service_name: CachePolicy(service_name, **options)
+            for service_name, options in settings.RESPONSE_CACHE_SERVICES.items()
+        }
+        self.configure_limits(
+            settings.RESPONSE_CACHE_MAX_BYTES,
+            settings.RESPONSE_CACHE_MAX_ENTRY_BYTES,
+            settings.RESPONSE_CACHE_DISK_PATH,
+            settings.RESPONSE_CACHE_DISK_THRESHOLD,
+            settings.RESPONSE_CACHE_DISK_MAX_BYTES,
+        )
+
+    def policy(self, service_name: str, path: str) -> CachePolicy | None:
+        '''
+        Description:
+        Returns the caching options if the service opted in and the route is covered.
+        '''
+        policy = self.policies.get(service_name)
+        if policy is None or not policy.covers(path):
+            return None
+        return policy
+
+    #region Keys
+
+    @staticmethod
+    def key(service_name: str, path: str, query: str, principal: str | None) -> str:
+        return hashlib.sha256(f"{service_name}\n{path}\n{query}\n{principal or ''}".encode()).hexdigest()
+
+    def lookup(self, service_name: str, path: str, query: str, user_key: str, policy: CachePolicy, request_headers) -> CachedResponse | None:
+        '''
+        Description:
+        Finds the entry for a request, first the one of the user then the one shared by every
+        user (unless the policy varies by user).
+        '''
+        keys = [self.key(service_name, path, query, user_key)]
+        if not policy.vary_by_user:
+            keys.append(self.key(service_name, path, query, None))
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry.matches(request_headers):
+                self._entries.move_to_end(key)
+                return entry
+        return None
+
+    #endregion Keys
+
+    #region Storing
+
+    def storable(self, status_code: int, headers, request_headers) -> dict | None:
+        '''
+        Description:
+        Returns the parsed Cache-Control of a response if a shared cache may store it, else None.
+        '''
+        if status_code not in CACHEABLE_STATUS_CODES:
+            return None
+        directives = parse_cache_control(headers.get("cache-control"))
+        if "no-store" in directives or "no-store" in parse_cache_control(request_headers.get("cache-control")):
+            return None
+        if "set-cookie" in headers or headers.get("vary", "").strip() == "*":
+            return None
+        return directives
+
+    @staticmethod
+    def shared(policy: CachePolicy, directives: dict, request_headers) -> bool:
+        '''
+        Description:
+        Whether a response may be served to every user. The upstream saw the credentials of the
+        request, so its answer is only shared if the request had none or the upstream explicitly
+        allowed it with public or s-maxage.
+        '''
+        if policy.vary_by_user or "private" in directives:
+            return False
+        if "public" in directives or "s-maxage" in directives:
+            return True
+        return not any(name in request_headers for name in CREDENTIAL_HEADERS)
+
+    async def store(self, service_name: str, path: str, query: str, user_key: str, policy: CachePolicy,
+                    status_code: int, headers, request_headers, directives: dict, body: bytes):
+        if len(body) > self.max_entry_bytes:
+            return
+        lifetime = freshness_lifetime(headers, directives, policy.default_ttl)
+        etag, last_modified = headers.get("etag"), headers.get("last-modified")
+        no_cache = "no-cache" in directives
+        if lifetime <= 0 and etag is None and last_modified is None:
+            # Would never be served
+            return
+
+        shared = self.shared(policy, directives, request_headers)
+        key = self.key(service_name, path, query, None if shared else user_key)
+        vary = tuple(
+            (name, request_headers.get(name, ""))
+            for name in (part.strip().lower() for part in headers.get("vary", "").split(","))
+            if name
+        )
+
+        body_path = None
+        if len(body) > self.disk_threshold:
+            if not self.disk_path:
+                return
+            # A file per entry: the one of an entry replaced under the same key is deleted by _remove
+            body_path = os.path.join(self.disk_path, f"{key}-{uuid.uuid4().hex}")
+            await asyncio.to_thread(write_file, body_path, body)
+
+        now = time.time()
+        entry = CachedResponse(
+            key = key,
+            status_code = status_code,
+            headers = [(name, value) for name, value in headers.multi_items()],
+            body = None if body_path else body,
+            body_path = body_path,
+            size = len(body),
+            stored_at = now,
+            expires_at = now + lifetime,
+            etag = etag,
+            last_modified = last_modified,
+            vary = vary,
+            no_cache = no_cache,
+        )
+        self._remove(key)
+        self._entries[key] = entry
+        if body_path:
+            self.disk_bytes += entry.size
+        else:
+            self.memory_bytes += entry.size
+        self.stats["stores"] += 1
+        self._evict()
+
+    def revalidated(self, entry: CachedResponse, headers, policy: CachePolicy):
+        '''
+        Description:
+        Refreshes an entry after the upstream answered 304 to a conditional request.
+        '''
+        updates = {name.lower(): value for name, value in headers.multi_items() if name.lower() in REVALIDATION_HEADERS}
+        entry.headers = [(name, value) for name, value in entry.headers if name.lower() not in updates] + list(updates.items())
+        merged = {name.lower(): value for name, value in entry.headers}
+        directives = parse_cache_control(merged.get("cache-control"))
+        entry.stored_at = time.time()
+        entry.expires_at = entry.stored_at + freshness_lifetime(merged, directives, policy.default_ttl)
+        entry.etag = merged.get("etag")
+        entry.last_modified = merged.get("last-modified")
+        entry.no_cache = "no-cache" in directives
+        self.stats["revalidated"] += 1
+
+    #endregion Storing
+
+    #region Eviction
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        if entry.body_path:
+            self.disk_bytes -= entry.size
+            try:
+                os.remove(entry.body_path)
+            except OSError:
+                pass
+        else:
+            self.memory_bytes -= entry.size
+
+    def _evict(self):
+        if self.memory_bytes <= self.max_bytes and self.disk_bytes <= self.disk_max_bytes:
+            return
+        for key in list(self._entries):
+            if self.memory_bytes <= self.max_bytes and self.disk_bytes <= self.disk_max_bytes:
+                break
+            entry = self._entries[key]
+            if (entry.body_path and self.disk_bytes > self.disk_max_bytes) or (not entry.body_path and self.memory_bytes > self.max_bytes):
+                self._remove(key)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        for key in list(self._entries):
+            self._remove(key)
+
+    #endregion Eviction
+
+    def status(self) -> dict:
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+        }
+
+
+async def iter_file(path: str, chunk_size: int = 64 * 1024):
+    '''
+    Description:
+    Streams a cached body from disk. The file is opened lazily, when the first chunk is
+    requested; from then on the stream survives the entry being evicted (and its file deleted).
+    '''
+    file = await asyncio.to_thread(open, path, "rb")
+    try:
+        while chunk := await asyncio.to_thread(file.read, chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+def write_file(path: str, body: bytes):
+    # Written next to the target and renamed so a reader never sees a partial file
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(body)
+    os.replace(temporary, path)
+
+
+response_cache = ResponseCache()
+
+
+async def tee_body(chunks, on_complete, max_bytes: int):
+    '''
+    Description:
+    Passes the chunks through unchanged while keeping a copy of up to max_bytes. Once the
+    stream ended normally the copy is handed to on_complete; bigger or interrupted bodies
+    are dropped.
+    '''
+    buffer = []
+    size = 0
+    async for chunk in chunks:
+        if buffer is not None:
+            size += len(chunk)
+            if size > max_bytes:
+                buffer = None
+            else:
+                buffer.append(chunk)
+        yield chunk
+    if buffer is not None:
+        try:
+            await on_complete(b"".join(buffer))
+        except Exception:
+            logger.exception("Could not store a response in the cache")
@@ -0,0 +1,161 @@
+import math
+import random
+import time
+from collections import deque
+
+
+# Methods that may be sent twice without changing the outcome (RFC 9110 section 9.2.2)
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+DEFAULT_RETRY_OPTIONS = {
+    "max_retries": 1,
+    "backoff_base": 0.05,
+    "backoff_max": 1.0,
+    "budget_ratio": 0.2,
+    "budget_min_per_second": 1.0,
+    "hedge": False,
+    "hedge_percentile": 0.95,
+    "hedge_min_delay": 0.01,
+}
+
+
+class RetryBudget:
+    '''
+    Description:
+    Caps retries (and hedged requests) to a fraction of the traffic: every request deposits
+    `ratio` tokens, every retry withdraws one, plus `min_per_second` tokens accrue over time so
+    a quiet service can still retry. When an outage makes every call fail, retries stop at
+    about `ratio` extra load instead of multiplying it.
+    '''
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, clock = time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.clock = clock
+        # Enough for a burst of retries after a quiet period, never more than ten seconds worth
+        self.max_balance = max(10.0, 10 * min_per_second)
+        self.balance = self.max_balance
+        self.updated_at = clock()
+
+    def _refill(self, tokens: float):
+        now = self.clock()
+        self.balance = min(self.max_balance, self.balance + tokens + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+
+    def record_request(self):
+        self._refill(self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill(0.0)
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class LatencyTracker:
+    '''
+    Description:
+    Latencies of the last `window` calls of a service and a percentile of them, recomputed
+    every `refresh_every` calls rather than on every read.
+    '''
+
+    def __init__(self, percentile: float = 0.95, window: int = 200, min_samples: int = 20, refresh_every: int = 16):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.refresh_every = refresh_every
+        self._samples: deque[float] = deque(maxlen = window)
+        self._since_refresh = 0
+        self.value: float | None = None
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+        self._since_refresh += 1
+        if self._since_refresh >= self.refresh_every and len(self._samples) >= self.min_samples:
+            ordered = sorted(self._samples)
+            self.value = ordered[min(len(ordered) - 1, math.ceil(self.percentile * len(ordered)) - 1)]
+            self._since_refresh = 0
+
+
+class RetryPolicy:
+    '''
+    Description:
+    Retry and hedging options of one service, with its retry budget and latency percentile.
+    '''
+
+    def __init__(self, name: str, max_retries: int = 1, backoff_base: float = 0.05, backoff_max: float = 1.0,
+                 budget_ratio: float = 0.2, budget_min_per_second: float = 1.0, hedge: bool = False,
+                 hedge_percentile: float = 0.95, hedge_min_delay: float = 0.01, rng: random.Random | None = None):
+        self.name = name
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.budget = RetryBudget(budget_ratio, budget_min_per_second)
+        self.latency = LatencyTracker(hedge_percentile)
+        self.random = rng or random.Random()
+        self.stats = {"retries": 0, "hedged": 0, "hedges_won": 0, "budget_exhausted": 0}
+
+    def backoff(self, retry: int) -> float:
+        '''
+        Description:
+        Seconds to wait before the given retry (1 for the first), with full jitter so the
+        retries of concurrent requests do not arrive together.
+        '''
+        return self.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (retry - 1)))
+
+    def hedge_delay(self) -> float | None:
+        '''
+        Description:
+        Seconds after which a second attempt is sent, None if hedging is off or the latency
+        of the service is not known yet.
+        '''
+        if not self.hedge or self.latency.value is None:
+            return None
+        return max(self.hedge_min_delay, self.latency.value)
+
+    def allow_extra_attempt(self) -> bool:
+        if self.budget.try_withdraw():
+            return True
+        self.stats["budget_exhausted"] += 1
+        return False
+
+    def status(self) -> dict:
+        return {
+            "service": self.name,
+            "budget": round(self.budget.balance, 3),
+            "hedge_delay": self.hedge_delay(),
+            **self.stats,
+        }
+
+
+class RetryPolicies:
+    '''
+    Description:
+    One RetryPolicy per service, created on first use with the configured options.
+    '''
+
+    def __init__(self):
+        self._policies: dict[str, RetryPolicy] = {}
+        self._defaults = dict(DEFAULT_RETRY_OPTIONS)
+        self._service_options: dict[str, dict] = {}
+
+    def configure(self, settings):
+        self._defaults = {key: getattr(settings, f"RETRY_{key.upper()}") for key in DEFAULT_RETRY_OPTIONS}
+        self._service_options = settings.RETRY_SERVICE_OPTIONS
+        self._policies.clear()
+
+    def get(self, service_name: str) -> RetryPolicy:
+        policy = self._policies.get(service_name)
+        if policy is None:
+            options = dict(self._defaults)
+            options.update(self._service_options.get(service_name, {}))
+            policy = self._policies[service_name] = RetryPolicy(service_name, **options)
+        return policy
+
+    def status(self) -> list[dict]:
+        return [policy.status() for policy in self._policies.values()]
+
+
+retry_policies = RetryPolicies()
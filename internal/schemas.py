@@ -1,4 +1,7 @@
-from pydantic import BaseModel, HttpUrl
+import json
+from typing import Any
+
+from pydantic import BaseModel, HttpUrl, validator
 
 class UserBase(BaseModel):
     username: str
@@ -17,11 +20,41 @@ class User(UserBase):
         orm_mode = True
 
 
+LOAD_BALANCING_STRATEGIES = ("round_robin", "least_outstanding", "power_of_two")
+
+class ServiceInstanceBase(BaseModel):
+    url: HttpUrl
+    weight: int = 1
+
+    @validator("weight")
+    def positive_weight(cls, value):
+        if value < 1:
+            raise ValueError("weight must be at least 1")
+        return value
+
+    class Config:
+        orm_mode = True
+
 class ServiceBase(BaseModel):
     name: str
     description: str
     url: HttpUrl
     endpoints: dict#TODO: Why is this a dict ???
+    instances: list[ServiceInstanceBase] = []
+    load_balancing: str = "round_robin"
+
+    @validator("load_balancing")
+    def known_strategy(cls, value):
+        if value not in LOAD_BALANCING_STRATEGIES:
+            raise ValueError(f"load_balancing must be one of {', '.join(LOAD_BALANCING_STRATEGIES)}")
+        return value
+
+    @validator("endpoints", pre=True)
+    def parse_endpoints(cls, value):
+        # Stored as json text in the database
+        if isinstance(value, str):
+            return json.loads(value) if value else {}
+        return value
 
 class Service(ServiceBase):
     id: int
@@ -45,7 +78,7 @@ class RoleBase(BaseModel):
     name: str
 
 class RoleCreate(RoleBase):
-    permissions: list[ int|str ]
+    permissions: list[ int|str ] = []
 
 class Role(RoleBase):
     id: int
@@ -54,7 +87,12 @@ class Role(RoleBase):
         orm_mode = True
 
 class RolePermission(Role):
-    permissions: list[ str ] #TODO: Think about this
+    permissions: list[ str ]
+
+    @validator("permissions", pre=True, each_item=True)
+    def permission_name(cls, value):
+        # Role.permissions holds Permission rows, only their names are returned
+        return getattr(value, "name", value)
 
     class Config:
         orm_mode = True
@@ -68,3 +106,13 @@ class TokenData(BaseModel):
     username: str = None
     role: str = None
 
+
+class ImportItemResult(BaseModel):
+    index: int
+    id: int | None = None
+    error: Any = None
+
+class ImportResult(BaseModel):
+    created: int
+    failed: int
+    results: list[ImportItemResult]
@@ -1,27 +1,31 @@
 from internal.schemas import User, UserBase
 from internal.temp import get_active_user_by_email
+from internal.config import Settings, get_settings
+from internal.hashing_pool import hashing_pool
+from internal.tracing import tracer
 
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 from jose import jwt
-
-import yaml
+from sqlalchemy.ext.asyncio import AsyncSession
 
 pwd_context = CryptContext(schemes = ["bcrypt"], deprecated = "auto")
 
 def get_user(db, email: str):
     return get_active_user_by_email(db, email)
     
-def authenticate_user(db, email: str, password: str):
-    user = get_active_user_by_email(db, email)
-    if not user:
-        return False
-    if not verify_password(password, user.hashed_password):
-        return False
-    return user
-
-
-def create_access_token(data: dict, expires_delta: timedelta | None = None):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    with tracer.span("auth.authenticate_user"):
+        user = await db.run_sync(get_active_user_by_email, email)
+        if not user:
+            return False
+        with tracer.span("auth.verify_password"):
+            if not await verify_password_async(password, user.hashed_password):
+                return False
+        return user
+
+
+def create_access_token(data: dict, expires_delta: timedelta | None = None, settings: Settings | None = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -29,12 +33,10 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
         expire = datetime.utcnow() + timedelta(minutes = 15)
     to_encode.update({"exp": expire})
 
-    with open("config.yaml") as file:
-        config = yaml.safe_load(file)
-    secret_key = config['SECRET_KEY']
-    algorithm = config['ALGORITHM']
+    if settings is None:
+        settings = get_settings()
 
-    encoded_jwt = jwt.encode(to_encode, secret_key, algorithm)
+    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, settings.ALGORITHM)
     return encoded_jwt
 
 
@@ -42,4 +44,16 @@ def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password): 
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
+
+async def verify_password_async(plain_password, hashed_password):
+    '''
+    Same as verify_password but runs on the bounded hashing pool instead of the event loop.
+    '''
+    return await hashing_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    '''
+    Same as get_password_hash but runs on the bounded hashing pool instead of the event loop.
+    '''
+    return await hashing_pool.run(get_password_hash, password)
\ No newline at end of file
@@ -0,0 +1,195 @@
+import asyncio
+from dataclasses import dataclass, field
+
+from internal.authorization import PermissionTrie, request_tokens
+from internal.response_cache import CREDENTIAL_HEADERS, parse_cache_control
+
+
+DEFAULT_VARY_HEADERS = ("accept", "accept-encoding", "accept-language")
+
+
+@dataclass
+class CoalescingPolicy:
+    '''
+    Description:
+    Coalescing options of a service. `routes` are "endpoint" patterns in the permission syntax,
+    all routes of the service when empty. Requests only share a response if they agree on the
+    `vary_headers`, and with `vary_by_user` also on the user. Without it requests of different
+    users join the same flight, but only get responses that are not specific to a user (see owner).
+    '''
+    service_name: str
+    routes: list[str] = field(default_factory=list)
+    vary_headers: list[str] = field(default_factory=lambda: list(DEFAULT_VARY_HEADERS))
+    vary_by_user: bool = False
+
+    def __post_init__(self):
+        patterns = [f"{self.service_name}:{route}" for route in self.routes] or [self.service_name]
+        self._trie = PermissionTrie.compile(patterns)
+        self.vary_headers = [name.lower() for name in self.vary_headers]
+
+    def covers(self, path: str) -> bool:
+        return self._trie.allows(request_tokens(self.service_name, path))
+
+    def vary_key(self, request_headers, user_key: str) -> tuple:
+        values = tuple(request_headers.get(name, "") for name in self.vary_headers)
+        return values + (user_key,) if self.vary_by_user else values
+
+
+@dataclass
+class SharedResponse:
+    '''
+    Description:
+    Complete upstream response of a leader, handed to the requests that waited on it.
+    `vary` holds the request header values the response depends on (its Vary header) and
+    `principal` the user it may be handed to, None for every user.
+    '''
+    status_code: int
+    headers: list[tuple[str, str]]
+    body: bytes
+    vary: tuple[tuple[str, str], ...] = ()
+    principal: str | None = None
+
+    def matches(self, request_headers, user_key: str | None = None) -> bool:
+        if self.principal is not None and self.principal != user_key:
+            return False
+        return all(request_headers.get(name, "") == value for name, value in self.vary)
+
+
+def shareable(headers) -> bool:
+    '''
+    Description:
+    Whether a response may be handed to other users: not if it is private, sets cookies or varies on anything.
+    '''
+    if "private" in parse_cache_control(headers.get("cache-control")) or "set-cookie" in headers:
+        return False
+    return headers.get("vary", "").strip() != "*"
+
+
+def owner(headers, request_headers, user_key: str) -> str | None:
+    '''
+    Description:
+    User a response may be handed to, None if any user may get it. The upstream saw the
+    credentials of the leader, so its answer is only for other users if the leader had none or
+    the upstream marked it public or s-maxage, as for the response cache.
+    '''
+    directives = parse_cache_control(headers.get("cache-control"))
+    if "public" in directives or "s-maxage" in directives:
+        return None
+    return user_key if any(name in request_headers for name in CREDENTIAL_HEADERS) else None
+
+
+class Flight:
+    '''
+    Description:
+    One in-flight upstream call. The leader must call finish (or fail) exactly once on every
+    path, followers await the outcome.
+    '''
+
+    def __init__(self, key: tuple, on_done):
+        self.key = key
+        self.followers = 0
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._on_done = on_done
+
+    @property
+    def done(self) -> bool:
+        return self._future.done()
+
+    def finish(self, response: SharedResponse | None):
+        '''
+        Description:
+        Publishes the response of the leader, None if it cannot be shared (the followers then
+        call upstream themselves). Calls after the first are ignored.
+        '''
+        if not self._future.done():
+            self._future.set_result(response)
+            self._on_done(self)
+
+    def fail(self, exception: Exception):
+        if not self._future.done():
+            self._future.set_exception(exception)
+            # Retrieved by the followers; marks it as such when there are none
+            self._future.exception()
+            self._on_done(self)
+
+    async def wait(self, timeout: float) -> SharedResponse | None:
+        '''
+        Description:
+        Waits for the leader. Returns None if it took longer than `timeout` seconds or produced
+        nothing to share, and raises the exception the leader failed with.
+        '''
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class SingleFlight:
+    '''
+    Description:
+    Coalesces identical concurrent upstream GETs: the first request for a key (method, service,
+    path, query and vary key) becomes the leader and calls upstream, the ones arriving while
+    it is in flight wait for its response instead of calling upstream too. Followers give up
+    after `timeout` seconds and call upstream themselves, so a slow leader does not hold them
+    hostage. Only used from the event loop thread, so no lock is needed.
+    '''
+
+    def __init__(self, timeout: float = 5.0, max_bytes: int = 1024 * 1024):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.policies: dict[str, CoalescingPolicy] = {}
+        self._flights: dict[tuple, Flight] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "shared": 0, "timeouts": 0}
+
+    def configure(self, settings):
+        self.timeout = settings.SINGLE_FLIGHT_TIMEOUT
+        self.max_bytes = settings.SINGLE_FLIGHT_MAX_BYTES
+        self.policies = {
+            service_name: CoalescingPolicy(service_name, **options)
+            for service_name, options in settings.SINGLE_FLIGHT_SERVICES.items()
+        }
+
+    def policy(self, service_name: str, path: str) -> CoalescingPolicy | None:
+        policy = self.policies.get(service_name)
+        if policy is None or not policy.covers(path):
+            return None
+        return policy
+
+    @staticmethod
+    def key(method: str, service_name: str, path: str, query: str, vary_key: tuple) -> tuple:
+        return (method, service_name, path, query, vary_key)
+
+    def join(self, key: tuple) -> tuple[Flight, bool]:
+        '''
+        Description:
+        Returns the flight of the key and whether the caller leads it (True when no call was in flight).
+        '''
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.followers += 1
+            self.stats["coalesced"] += 1
+            return flight, False
+        flight = self._flights[key] = Flight(key, self._land)
+        self.stats["leaders"] += 1
+        return flight, True
+
+    async def wait(self, flight: Flight, request_headers, user_key: str) -> SharedResponse | None:
+        response = await flight.wait(self.timeout)
+        if response is None:
+            if not flight.done:
+                self.stats["timeouts"] += 1
+            return None
+        if not response.matches(request_headers, user_key):
+            return None
+        self.stats["shared"] += 1
+        return response
+
+    def _land(self, flight: Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def status(self) -> dict:
+        return {**self.stats, "in_flight": len(self._flights), "timeout": self.timeout}
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from database import models
+from internal.schemas import User
+
+
+class TokenCache:
+    '''
+    Description:
+    Bounded LRU cache of verified access tokens. Maps a digest of the token to the
+    resolved user principal so repeated requests with the same token skip the jwt
+    decode and the user query. An entry lives at most `ttl` seconds and never past
+    the token "exp" claim. Entries of a user are dropped when the user is deactivated,
+    deleted or its role changes in this process; other workers see the change once
+    their entries expire, so `ttl` bounds the staleness across workers.
+    '''
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, User]] = OrderedDict()
+        self._keys_by_user: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str, secret_key: str) -> str:
+        '''
+        Description:
+        Digest of the token. The signing key is part of it so rotating the key invalidates every entry.
+        '''
+        return hashlib.sha256(f"{secret_key}:{token}".encode()).hexdigest()
+
+    def configure(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clear()
+
+    def get(self, key: str) -> User | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def put(self, key: str, user: User, token_exp: float | None = None):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at, user)
+            self._keys_by_user.setdefault(user.id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in self._keys_by_user.pop(user_id, set()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1].id]
+
+
+token_cache = TokenCache()
+
+
+@event.listens_for(Session, "after_flush")
+def invalidate_changed_users(session, flush_context):
+    '''
+    Description:
+    Drops the cached tokens of every user whose activation or role was changed, or that was deleted, in this flush.
+    '''
+    for instance in session.deleted:
+        if isinstance(instance, models.User):
+            token_cache.invalidate_user(instance.id)
+    for instance in session.dirty:
+        if not isinstance(instance, models.User):
+            continue
+        state = inspect(instance)
+        if any(state.attrs[name].history.has_changes() for name in ("is_active", "role_id", "role")):
+            token_cache.invalidate_user(instance.id)
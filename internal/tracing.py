@@ -0,0 +1,352 @@
+import asyncio
+import contextvars
+import importlib
+import json
+import logging
+import random
+import re
+import sys
+import time
+from collections import deque
+
+from sqlalchemy import event
+
+from database.database import engine, async_engine, replica_engines
+
+
+logger = logging.getLogger(__name__)
+
+# version-trace id-parent id-flags (https://www.w3.org/TR/trace-context/#traceparent-header)
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+SAMPLED_FLAG = 0x01
+INVALID_TRACE_ID = "0" * 32
+INVALID_SPAN_ID = "0" * 16
+
+
+def parse_traceparent(value: str | None) -> tuple[str, str, bool] | None:
+    '''
+    Description:
+    Returns (trace id, parent span id, sampled) of a traceparent header, None if it is missing or invalid.
+    '''
+    if not value:
+        return None
+    match = TRACEPARENT.match(value.strip().lower())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or trace_id == INVALID_TRACE_ID or parent_id == INVALID_SPAN_ID:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & SAMPLED_FLAG)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attributes", "error", "_started", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict | None = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+        self._started = time.perf_counter()
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, name: str, value):
+        self.attributes[name] = value
+
+    def finish(self):
+        self.end = self.start + (time.perf_counter() - self._started)
+        tracer.export(self)
+
+    def __enter__(self):
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception is not None:
+            self.error = f"{exception_type.__name__}: {exception}"
+        current_span.reset(self._token)
+        self.finish()
+        return False
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NoopSpan:
+    '''
+    Description:
+    Stand-in for spans of unsampled requests: one shared instance that records nothing.
+    '''
+    __slots__ = ()
+    traceparent = None
+
+    def set_attribute(self, name: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+# Span of the code running now, None outside of sampled requests
+current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar("current_span", default = None)
+
+# traceparent header received by the unsampled request running now ("" if it had none), None elsewhere
+unsampled_parent: contextvars.ContextVar[str | None] = contextvars.ContextVar("unsampled_parent", default = None)
+
+
+#region Exporters
+
+class JsonLinesExporter:
+    '''
+    Description:
+    Writes one JSON object per span to a file, or to stdout when no path is given.
+    '''
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+
+    def export(self, spans: list[dict]):
+        lines = "".join(json.dumps(span) + "\n" for span in spans)
+        if self.path is None:
+            sys.stdout.write(lines)
+            sys.stdout.flush()
+            return
+        with open(self.path, "a", encoding = "utf-8") as file:
+            file.write(lines)
+
+    def shutdown(self):
+        pass
+
+
+def load_exporter(name: str, file_path: str):
+    '''
+    Description:
+    Builds the exporter named in the settings: "none", "stdout", "file" or the
+    "package.module:Class" of a custom one, with export(spans) and shutdown() methods.
+    '''
+    if name == "none":
+        return None
+    if name == "stdout":
+        return JsonLinesExporter()
+    if name == "file":
+        return JsonLinesExporter(file_path)
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+#endregion Exporters
+
+
+class Tracer:
+    '''
+    Description:
+    Head based sampling: the sampling decision is taken once per request, when its root span
+    starts. If the client sent a traceparent its sampled flag is followed, otherwise `sample_rate`
+    of the requests are sampled. Spans of unsampled requests are the shared NoopSpan, so tracing at a
+    low sample rate costs a random number and a context variable read per span. Finished
+    spans are queued (up to `max_queue`, newer spans are dropped beyond) and handed to the
+    exporter in batches from a background task.
+    '''
+
+    def __init__(self, sample_rate: float = 0.0, exporter = None, export_interval: float = 1.0, max_queue: int = 10000):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.export_interval = export_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._queue: deque[dict] = deque()
+        self._task: asyncio.Task | None = None
+
+    def configure(self, settings):
+        self.sample_rate = settings.TRACING_SAMPLE_RATE
+        self.export_interval = settings.TRACING_EXPORT_INTERVAL
+        self.max_queue = settings.TRACING_MAX_QUEUE
+        self.exporter = load_exporter(settings.TRACING_EXPORTER, settings.TRACING_FILE_PATH)
+
+    def start_trace(self, name: str, traceparent: str | None = None, attributes: dict | None = None) -> Span | NoopSpan:
+        '''
+        Description:
+        Root span of a request, continuing the trace of the client if it sent a traceparent.
+        '''
+        if self.exporter is None:
+            return NOOP_SPAN
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = None, None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            return NOOP_SPAN
+        return Span(name, trace_id or f"{random.getrandbits(128):032x}", parent_id, attributes)
+
+    def span(self, name: str, attributes: dict | None = None) -> Span | NoopSpan:
+        '''
+        Description:
+        Child of the current span, to be used as a context manager. Noop outside of sampled requests.
+        '''
+        parent = current_span.get()
+        if parent is None:
+            return NOOP_SPAN
+        return Span(name, parent.trace_id, parent.span_id, attributes)
+
+    def traceparent(self) -> str | None:
+        '''
+        Description:
+        traceparent header of the calls made now: under the current span in sampled requests,
+        otherwise the trace of the caller (a new one if it sent none) with the sampled flag
+        cleared, so the upstream keeps the trace context and follows the decision not to sample.
+        '''
+        span = current_span.get()
+        if span is not None:
+            return span.traceparent
+        received = unsampled_parent.get()
+        if received is None:
+            return None
+        parent = parse_traceparent(received)
+        if parent is None:
+            parent = (f"{random.getrandbits(128):032x}", f"{random.getrandbits(64):016x}", False)
+        trace_id, parent_id, _ = parent
+        return f"00-{trace_id}-{parent_id}-00"
+
+    def export(self, span: Span):
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1
+            return
+        self._queue.append(span.to_dict())
+
+    async def flush(self):
+        if not self._queue or self.exporter is None:
+            return
+        spans = list(self._queue)
+        self._queue.clear()
+        try:
+            await asyncio.to_thread(self.exporter.export, spans)
+        except Exception:
+            logger.exception("Could not export %s spans", len(spans))
+
+    async def _export_periodically(self):
+        while True:
+            await asyncio.sleep(self.export_interval)
+            await self.flush()
+
+    def start(self):
+        if self.exporter is not None and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._export_periodically())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    '''
+    Description:
+    Plain ASGI middleware starting the root span of every HTTP request from its traceparent
+    header. The span is named after the matched route template once the request is done.
+    Unsampled requests keep the header they received for the calls they make (see Tracer.traceparent).
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or tracer.exporter is None:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for name, value in scope["headers"]:
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        span = tracer.start_trace(scope["method"], traceparent)
+        if span is NOOP_SPAN:
+            token = unsampled_parent.set(traceparent or "")
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                unsampled_parent.reset(token)
+            return
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+            await send(message)
+
+        with span:
+            span.set_attribute("http.method", scope["method"])
+            span.set_attribute("http.target", scope["path"])
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                span.name = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
+
+
+def instrument_engine(engine, name: str):
+    '''
+    Description:
+    Adds a span per statement executed on a (sync) engine within a sampled request.
+    For an async engine pass its sync_engine.
+    '''
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = tracer.span("db.query")
+        if span is not NOOP_SPAN:
+            span.set_attribute("db.engine", name)
+            span.set_attribute("db.statement", statement[:500])
+        conn.info.setdefault("query_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = conn.info["query_spans"].pop()
+        if span is not NOOP_SPAN:
+            span.finish()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        spans = context.connection.info.get("query_spans") if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            if span is not NOOP_SPAN:
+                span.error = repr(context.original_exception)
+                span.finish()
+
+
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+for index, replica in enumerate(replica_engines):
+    instrument_engine(replica.sync_engine, f"replica{index}")
@@ -1,9 +1,25 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from router import service_registry, gateway, auth, crud_endpoints
+from router import service_registry, gateway, auth, crud_endpoints, admin, metrics
 from sqlalchemy.orm import Session
 
 from internal.initialization import initialize_database
+from internal.http_client import upstream_clients
+from internal.config import settings_store
+from internal.token_cache import token_cache
+from internal.read_your_writes import read_your_writes
+from internal.hashing_pool import hashing_pool, import_hashing_pool
+from internal.registry import service_registry as registry
+from internal.health import health_checker
+from internal.circuit_breaker import circuit_breakers
+from internal.authorization import authorization_index
+from internal.response_cache import response_cache
+from internal.single_flight import single_flight
+from internal.rate_limit import rate_limiter
+from internal.bulkhead import bulkheads
+from internal.retry import retry_policies
+from internal.metrics import MetricsMiddleware, event_loop_monitor
+from internal.tracing import TracingMiddleware, tracer
 from dependencies import get_db
 
 import uvicorn
@@ -23,11 +39,65 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(service_registry.router, tags = ["service_registry"])
-app.include_router(gateway.router, tags = ["gateway"])
 app.include_router(auth.router, tags = ["auth"])
 app.include_router(crud_endpoints.router, tags = ["crud_endpoints"])
+app.include_router(admin.router, tags = ["admin"])
+app.include_router(metrics.router, tags = ["metrics"])
+# The gateway catches every "/{service_name}/{path}" for all methods, so it must be included last
+app.include_router(gateway.router, tags = ["gateway"])
+
+#region Settings reload
+# Components configured from the settings on startup are configured again when a reload changes
+# their settings. Still requiring a restart: the database urls and pools (the engines are built
+# on import), the refresh intervals of the registry, the authorization index and the event loop
+# monitor, and the limits of the upstream clients already open.
+
+def configure_token_cache(settings):
+    token_cache.configure(settings.TOKEN_CACHE_MAX_SIZE, settings.TOKEN_CACHE_TTL)
+
+def configure_hashing_pool(settings):
+    hashing_pool.configure(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
+def configure_import_hashing_pool(settings):
+    # Room for the hashes of a few imports running at once
+    import_hashing_pool.configure(settings.IMPORT_HASH_WORKERS, 4 * settings.IMPORT_BATCH_SIZE)
+
+async def configure_health_checker(settings):
+    health_checker.configure(settings)
+    if health_checker.enabled:
+        health_checker.start()
+    else:
+        await health_checker.stop()
+
+async def configure_rate_limiter(settings):
+    backend = rate_limiter.backend
+    rate_limiter.configure(settings)
+    await backend.close()
+
+async def configure_tracer(settings):
+    await tracer.stop()
+    tracer.configure(settings)
+    tracer.start()
+
+settings_store.on_reload(("TOKEN_CACHE_",), configure_token_cache)
+settings_store.on_reload(("DB_READ_YOUR_WRITES_",), read_your_writes.configure)
+settings_store.on_reload(("PASSWORD_HASH_",), configure_hashing_pool)
+settings_store.on_reload(("IMPORT_HASH_WORKERS", "IMPORT_BATCH_SIZE"), configure_import_hashing_pool)
+settings_store.on_reload(("UPSTREAM_",), upstream_clients.start)
+settings_store.on_reload(("HEALTH_",), configure_health_checker)
+settings_store.on_reload(("CIRCUIT_BREAKER_",), circuit_breakers.configure)
+settings_store.on_reload(("BULKHEAD_",), bulkheads.configure)
+settings_store.on_reload(("RETRY_",), retry_policies.configure)
+settings_store.on_reload(("RESPONSE_CACHE_",), response_cache.configure)
+settings_store.on_reload(("SINGLE_FLIGHT_",), single_flight.configure)
+settings_store.on_reload(("RATE_LIMIT_",), configure_rate_limiter)
+settings_store.on_reload(("TRACING_",), configure_tracer)
+
+#endregion Settings reload
 
 # Aplication initialization:
 @app.on_event("startup")
@@ -35,8 +105,50 @@ async def startup_event():
     '''
     This function is called when the application starts up.
     '''
+    ## Watch the config file for changes:
+    settings_store.start()
+    settings = settings_store.get()
+    configure_token_cache(settings)
+    read_your_writes.configure(settings)
+    configure_hashing_pool(settings)
+    configure_import_hashing_pool(settings)
     ## Initialize the database:
     initialize_database()
+    ## Open the pooled upstream clients:
+    upstream_clients.start()
+    ## Load the routing snapshot of the registered services:
+    await registry.start(settings.REGISTRY_REFRESH_INTERVAL)
+    ## Load the compiled permissions of every role:
+    await authorization_index.start(settings.AUTHORIZATION_REFRESH_INTERVAL)
+    ## Probe the upstream instances in the background:
+    health_checker.configure(settings)
+    health_checker.start()
+    circuit_breakers.configure(settings)
+    bulkheads.configure(settings)
+    retry_policies.configure(settings)
+    response_cache.configure(settings)
+    single_flight.configure(settings)
+    rate_limiter.configure(settings)
+    event_loop_monitor.start(settings.EVENT_LOOP_LAG_INTERVAL)
+    tracer.configure(settings)
+    tracer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    '''
+    This function is called when the application shuts down.
+    '''
+    await event_loop_monitor.stop()
+    await health_checker.stop()
+    await registry.stop()
+    await authorization_index.stop()
+    await upstream_clients.close()
+    await rate_limiter.close()
+    hashing_pool.shutdown()
+    import_hashing_pool.shutdown()
+    await tracer.stop()
+    await settings_store.stop()
 
 
 # test_endpoint
@@ -0,0 +1,92 @@
+"""initial schema
+
+Revision ID: a1c3e5f70b21
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1c3e5f70b21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('permissions',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_permissions_name', 'permissions', ['name'], unique=True)
+    registry_version = op.create_table('registry_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    # SERVICES_VERSION and AUTHORIZATION_VERSION, bumped by updates only
+    op.bulk_insert(registry_version, [{'id': 1, 'version': 0}, {'id': 2, 'version': 0}])
+    op.create_table('roles',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table('services',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=255), nullable=True),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('url', sa.String(length=255), nullable=True),
+        sa.Column('load_balancing', sa.String(length=32), nullable=False),
+        sa.Column('endpoints', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('url')
+    )
+    op.create_table('role_permissions',
+        sa.Column('role_id', sa.Integer(), nullable=False),
+        sa.Column('permission_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['permission_id'], ['permissions.id']),
+        sa.ForeignKeyConstraint(['role_id'], ['roles.id']),
+        sa.PrimaryKeyConstraint('role_id', 'permission_id')
+    )
+    op.create_table('service_instances',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('service_id', sa.Integer(), nullable=False),
+        sa.Column('url', sa.String(length=255), nullable=False),
+        sa.Column('weight', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['service_id'], ['services.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_service_instances_service_id', 'service_instances', ['service_id'], unique=False)
+    op.create_table('users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('full_name', sa.String(length=255), nullable=True),
+        sa.Column('username', sa.String(length=255), nullable=True),
+        sa.Column('email', sa.String(length=255), nullable=True),
+        sa.Column('hashed_password', sa.String(length=255), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('role_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['role_id'], ['roles.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_table('users')
+    op.drop_index('ix_service_instances_service_id', table_name='service_instances')
+    op.drop_table('service_instances')
+    op.drop_table('role_permissions')
+    op.drop_table('services')
+    op.drop_table('roles')
+    op.drop_table('registry_version')
+    op.drop_index('ix_permissions_name', table_name='permissions')
+    op.drop_table('permissions')
@@ -0,0 +1,38 @@
+"""lookup indexes
+
+Composite indexes matched to the filters of database/crud.py and internal/temp.py:
+- users (email, is_active): login and token checks
+- users (is_active, id), services (is_active, id): active listings and keyset pages
+- services (name, is_active): lookups and registration by name
+- role_permissions (permission_id, role_id): lookups by permission, the primary key only serves role_id
+
+Revision ID: b7d2f4096c38
+Revises: a1c3e5f70b21
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2f4096c38'
+down_revision = 'a1c3e5f70b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_email_is_active', 'users', ['email', 'is_active'], unique=False)
+    op.create_index('ix_users_is_active_id', 'users', ['is_active', 'id'], unique=False)
+    op.create_index('ix_services_name_is_active', 'services', ['name', 'is_active'], unique=False)
+    op.create_index('ix_services_is_active_id', 'services', ['is_active', 'id'], unique=False)
+    op.create_index('ix_role_permissions_permission_id', 'role_permissions', ['permission_id', 'role_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_role_permissions_permission_id', table_name='role_permissions')
+    op.drop_index('ix_services_is_active_id', table_name='services')
+    op.drop_index('ix_services_name_is_active', table_name='services')
+    op.drop_index('ix_users_is_active_id', table_name='users')
+    op.drop_index('ix_users_email_is_active', table_name='users')
@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends
+
+from dependencies import require_permission
+from internal.circuit_breaker import circuit_breakers
+from internal.bulkhead import bulkheads
+from internal.retry import retry_policies
+from internal.response_cache import response_cache
+from internal.single_flight import single_flight
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_permission("admin"))])
+
+
+@router.get("/circuit_breakers")
+async def read_circuit_breakers():
+    '''
+    Description:
+    Returns the state of the circuit breaker of every service proxied to since startup.
+    '''
+    return circuit_breakers.status()
+
+
+@router.get("/bulkheads")
+async def read_bulkheads():
+    '''
+    Description:
+    Returns the in-flight requests, queue depth, rejections and queue wait times of every service bulkhead.
+    '''
+    return bulkheads.status()
+
+
+@router.get("/retries")
+async def read_retries():
+    '''
+    Description:
+    Returns the retry budget, hedging delay and retry/hedge counters of every service.
+    '''
+    return retry_policies.status()
+
+
+@router.get("/response_cache")
+async def read_response_cache():
+    '''
+    Description:
+    Returns the hit, miss, revalidation and eviction counters and the size of the response cache.
+    '''
+    return response_cache.status()
+
+
+@router.get("/single_flight")
+async def read_single_flight():
+    '''
+    Description:
+    Returns how many upstream GETs were led, coalesced and shared, and the followers that timed out.
+    '''
+    return single_flight.status()
@@ -1,16 +1,15 @@
 from typing import Annotated
 
 from internal.schemas import User
-from dependencies import get_current_active_user, get_db
+from dependencies import get_current_active_user, get_async_db
 from internal.security import authenticate_user, create_access_token
+from internal.config import Settings, get_settings
 
 from datetime import timedelta
 from fastapi import APIRouter, HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordRequestForm
 
-from sqlalchemy.orm import Session
-
-import yaml
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 router = APIRouter()
@@ -18,21 +17,19 @@ router = APIRouter()
 @router.post("/token")
 async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    settings: Settings = Depends(get_settings)
     ):
     #TODO: How to get the email in the form_data?
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code = status.HTTP_401_UNAUTHORIZED,
             detail = "Incorrect username or password",
             headers = {"WWW-Authenticate": "Bearer"},
         )
-    with open("config.yaml") as file:
-        config = yaml.safe_load(file)
-    access_token_expires_minutes = config["ACCESS_TOKEN_EXPIRE_MINUTES"]
-    access_token_expires = timedelta(minutes = access_token_expires_minutes)
-    access_token = create_access_token(data = {"sub": user.email}, expires_delta = access_token_expires) # Add the role to the token data
+    access_token_expires = timedelta(minutes = settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(data = {"sub": user.email}, expires_delta = access_token_expires, settings = settings) # Add the role to the token data
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/users/me", response_model=User)
@@ -1,9 +1,15 @@
-from fastapi import Depends, Query, Path, APIRouter, HTTPException
+from fastapi import Depends, Query, Path, APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import Annotated
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Literal
 
-from internal.schemas import UserCreate, User, RoleBase, Role, RolePermission,Service, ServiceBase, Permission, PermissionBase
-from dependencies import get_db, get_current_active_user
+from internal.schemas import UserCreate, User, RoleCreate, Role, RolePermission,Service, ServiceBase, Permission, PermissionBase, ImportResult
+from dependencies import get_db, get_async_db, get_read_db, require_permission
+from internal.config import Settings, get_settings
+from internal.pagination import Page
+from internal import bulk_import
+from internal.export import EXPORT_FORMATS, export_chunks, users_export_query, services_export_query
 
 from database import crud, models
 from database.database import SessionLocal, engine
@@ -11,7 +17,8 @@ from database.database import SessionLocal, engine
 
 models.Base.metadata.create_all(bind=engine)
 
-router = APIRouter(dependencies=[Depends(get_current_active_user)])
+# Needs a "crud:<path>" permission, e.g. "crud:users" or "crud:*"
+router = APIRouter(dependencies=[Depends(require_permission("crud"))])
 
 
 #region CREATE
@@ -41,15 +48,18 @@ def create_service(service: ServiceBase, db: Session = Depends(get_db)):
 
 
 @router.post("/create/roles", response_model=Role)
-def create_role(role: RoleBase, db: Session = Depends(get_db)):
+def create_role(role: RoleCreate, db: Session = Depends(get_db)):
     '''
     Description:
-    Create a new role in the database.
+    Create a new role in the database, with the given permission ids or names.
     '''
     db_role = crud.get_role_by_name(db, name=role.name)
     if db_role:
         raise HTTPException(status_code=400, detail="Role already exists")
-    return crud.create_role(db=db, role=role)
+    try:
+        return crud.create_role(db=db, role=role)
+    except crud.PermissionNotFound as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/create/permissions", response_model=Permission)
@@ -91,26 +101,73 @@ def create_role_permission(
 #endregion CREATE
 
 
+#region IMPORT
+# Bodies are a JSON array of the items of the matching /create endpoint, or NDJSON with
+# Content-Type: application/x-ndjson. Every item gets its own result, one failing item does not stop the others.
+
+
+@router.post("/import/users", response_model=ImportResult)
+async def import_users(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    settings: Settings = Depends(get_settings)
+    ):
+    '''
+    Description:
+    Creates many users at once, IMPORT_BATCH_SIZE per transaction, see internal/bulk_import.py.
+    '''
+    return await bulk_import.import_users(db, bulk_import.read_items(request), settings.IMPORT_BATCH_SIZE)
+
+
+@router.post("/import/roles", response_model=ImportResult)
+async def import_roles(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    settings: Settings = Depends(get_settings)
+    ):
+    '''
+    Description:
+    Creates many roles with their permissions at once.
+    '''
+    return await bulk_import.import_roles(db, bulk_import.read_items(request), settings.IMPORT_BATCH_SIZE)
+
+
+@router.post("/import/permissions", response_model=ImportResult)
+async def import_permissions(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    settings: Settings = Depends(get_settings)
+    ):
+    '''
+    Description:
+    Creates many permissions at once.
+    '''
+    return await bulk_import.import_permissions(db, bulk_import.read_items(request), settings.IMPORT_BATCH_SIZE)
+
+
+#endregion IMPORT
+
+
 #region READ
 
 
 @router.get("/user", response_model=User)
-def read_user(
+async def read_user(
     user_id: Annotated[int | None, Query()] = None, 
     user_email: Annotated[str | None, Query()] = None,
     active_only: Annotated[bool, Query()] = True,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
     ):
     if user_id:
         if active_only:
-            db_user = crud.get_active_user_by_id(db, user_id=user_id)
+            db_user = await db.run_sync(crud.get_active_user_by_id, user_id=user_id)
         else:
-            db_user = crud.get_user_by_id(db, user_id=user_id)
+            db_user = await db.run_sync(crud.get_user_by_id, user_id=user_id)
     elif user_email:
         if active_only:
-            db_user = crud.get_active_user_by_email(db, email=user_email)
+            db_user = await db.run_sync(crud.get_active_user_by_email, email=user_email)
         else:
-            db_user = crud.get_user_by_email(db, email=user_email)
+            db_user = await db.run_sync(crud.get_user_by_email, email=user_email)
     else:
         raise HTTPException(status_code=400, detail="User ID or Email must be provided")
     
@@ -121,41 +178,51 @@ def read_user(
 
 
 @router.get("/users", response_model=list[User])
-def read_users(
+async def read_users(
+    request: Request,
+    response: Response,
     skip: Annotated[int, Query()] = 0,
     limit: Annotated[int, Query()] = 100,
+    cursor: Annotated[str | None, Query()] = None,
     active_only: Annotated[bool, Query()] = True,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    settings: Settings = Depends(get_settings)
     ):
+    '''
+    Description:
+    Returns a page of users ordered by id. If there are more, the X-Next-Cursor header holds the
+    cursor of the next page (also in a Link header), pass it back as `cursor`.
+    '''
+    page = Page(request, response, cursor, skip, limit, settings.PAGINATION_MAX_PAGE_SIZE)
     if active_only:
-        return crud.get_active_users(db, skip=skip, limit=limit)
+        return page.finish(await db.run_sync(crud.get_active_users, **page.query_args))
     else:
-        return crud.get_users(db, skip=skip, limit=limit)
+        return page.finish(await db.run_sync(crud.get_users, **page.query_args))
 
 
 @router.get("/service", response_model=Service)
-def read_service(
+async def read_service(
     service_id: Annotated[int | None, Query()] = None,
     service_url: Annotated[str | None, Query()] = None,
     service_name: Annotated[str | None, Query()] = None,
     active_only: Annotated[bool, Query()] = True,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
     ):
     if service_id is not None:
         if active_only:
-            db_service = crud.get_active_service_by_id(db, service_id=service_id)
+            db_service = await db.run_sync(crud.get_active_service_by_id, service_id=service_id)
         else:
-            db_service = crud.get_service_by_id(db, service_id=service_id)
+            db_service = await db.run_sync(crud.get_service_by_id, service_id=service_id)
     elif service_url is not None:
         if active_only:
-            db_service = crud.get_active_service_by_url(db, url=service_url)
+            db_service = await db.run_sync(crud.get_active_service_by_url, url=service_url)
         else:
-            db_service = crud.get_service_by_url(db, url=service_url)
+            db_service = await db.run_sync(crud.get_service_by_url, url=service_url)
     elif service_name is not None:
         if active_only:
-            db_service = crud.get_active_service_by_name(db, name=service_name)
+            db_service = await db.run_sync(crud.get_active_service_by_name, name=service_name)
         else:
-            db_service = crud.get_service_by_name(db, name=service_name)
+            db_service = await db.run_sync(crud.get_service_by_name, name=service_name)
     else:
         raise HTTPException(status_code=400, detail="Service ID, URL, or Name must be provided")
     
@@ -166,59 +233,80 @@ def read_service(
 
 
 @router.get("/services", response_model=list[Service])
-def read_services(
+async def read_services(
+    request: Request,
+    response: Response,
     skip: Annotated[int, Query()] = 0,
     limit: Annotated[int, Query()] = 100,
+    cursor: Annotated[str | None, Query()] = None,
     active_only: Annotated[bool, Query()] = True,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    settings: Settings = Depends(get_settings)
     ):
+    '''
+    Description:
+    Returns a page of services ordered by id, paginated like /users.
+    '''
+    page = Page(request, response, cursor, skip, limit, settings.PAGINATION_MAX_PAGE_SIZE)
     if active_only:
-        return crud.get_active_services(db, skip=skip, limit=limit)
+        return page.finish(await db.run_sync(crud.get_active_services, **page.query_args))
     else:
-        return crud.get_services(db, skip=skip, limit=limit)
+        return page.finish(await db.run_sync(crud.get_services, **page.query_args))
 
 
 @router.get("/role", response_model=RolePermission)
-def read_role(
+async def read_role(
     role_id: Annotated[int | None, Query()] = None,
     role_name: Annotated[str | None, Query()] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
     ):
     if role_id is not None:
-        db_role = crud.get_role_by_id(db, role_id=role_id)
+        db_role = await db.run_sync(crud.get_role_by_id, role_id=role_id, with_permissions=True)
     elif role_name is not None:
-        db_role = crud.get_role_by_name(db, name=role_name)
+        db_role = await db.run_sync(crud.get_role_by_name, name=role_name, with_permissions=True)
     else:
         raise HTTPException(status_code=400, detail="Role ID or Name must be provided")
     
     if db_role is None:
         raise HTTPException(status_code=404, detail="Role not found")
     
-    permissions = crud.get_role_permissions(db, role_id=db_role.id)
-    #TODO: Figure out if i can make it so the return from the sqlalchemy all() returns me the list of strings directly
-    return Role(**db_role.__dict__, permissions = [permission[0] for permission in permissions])
+    return db_role
 
 
-@router.get("/roles", response_model=list[Role])
-def read_roles(
+@router.get("/roles", response_model=list[RolePermission | Role])
+async def read_roles(
+    request: Request,
+    response: Response,
     skip: Annotated[int, Query()] = 0,
     limit: Annotated[int, Query()] = 100,
-    db: Session = Depends(get_db)
+    cursor: Annotated[str | None, Query()] = None,
+    with_permissions: Annotated[bool, Query()] = False,
+    db: AsyncSession = Depends(get_async_db),
+    settings: Settings = Depends(get_settings)
     ):
-    return crud.get_roles(db, skip=skip, limit=limit)
+    '''
+    Description:
+    Returns a page of roles ordered by id, paginated like /users. With with_permissions the names of the
+    permissions of each role are included, loaded for the whole page in one extra query.
+    '''
+    page = Page(request, response, cursor, skip, limit, settings.PAGINATION_MAX_PAGE_SIZE)
+    roles = page.finish(await db.run_sync(crud.get_roles, with_permissions=with_permissions, **page.query_args))
+    if with_permissions:
+        return [RolePermission.from_orm(role) for role in roles]
+    return [Role.from_orm(role) for role in roles]
 
 
 #TODO: If name matching is partially done the return is a list and gives errors
 @router.get("/permission", response_model=Permission)
-def read_permission(
+async def read_permission(
     permission_id: Annotated[int | None, Query()] = None,
     permission_name: Annotated[str | None, Query()] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
     ):
     if permission_id is not None:
-        db_permission = crud.get_permission_by_id(db, permission_id=permission_id)
+        db_permission = await db.run_sync(crud.get_permission_by_id, permission_id=permission_id)
     elif permission_name is not None:
-        db_permission = crud.get_permission_by_name(db, name=permission_name)
+        db_permission = await db.run_sync(crud.get_permission_by_name, name=permission_name)
     else:
         raise HTTPException(status_code=400, detail="Permission ID or Name must be provided")
     
@@ -229,12 +317,21 @@ def read_permission(
 
 
 @router.get("/permissions", response_model=list[Permission])
-def read_permissions(
+async def read_permissions(
+    request: Request,
+    response: Response,
     skip: Annotated[int, Query()] = 0,
     limit: Annotated[int, Query()] = 100,
-    db: Session = Depends(get_db)
+    cursor: Annotated[str | None, Query()] = None,
+    db: AsyncSession = Depends(get_async_db),
+    settings: Settings = Depends(get_settings)
     ):
-    return crud.get_permissions(db, skip=skip, limit=limit)
+    '''
+    Description:
+    Returns a page of permissions ordered by id, paginated like /users.
+    '''
+    page = Page(request, response, cursor, skip, limit, settings.PAGINATION_MAX_PAGE_SIZE)
+    return page.finish(await db.run_sync(crud.get_permissions, **page.query_args))
 
 
 #TODO: Implement These
@@ -269,6 +366,42 @@ def read_service_permissions(
 #endregion READ
 
 
+#region EXPORT
+
+
+@router.get("/export/users")
+def export_users(
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+    active_only: Annotated[bool, Query()] = True,
+    settings: Settings = Depends(get_settings)
+    ):
+    '''
+    Description:
+    Streams every user as NDJSON or CSV, without the password hashes. Rows are read with a server side
+    cursor EXPORT_BATCH_SIZE at a time, so the memory used does not grow with the table, see internal/export.py.
+    Meant for bulk syncs instead of walking /users page by page.
+    '''
+    chunks = export_chunks(engine, users_export_query(active_only), export_format, settings.EXPORT_BATCH_SIZE)
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[export_format])
+
+
+@router.get("/export/services")
+def export_services(
+    export_format: Annotated[Literal["ndjson", "csv"], Query(alias="format")] = "ndjson",
+    active_only: Annotated[bool, Query()] = True,
+    settings: Settings = Depends(get_settings)
+    ):
+    '''
+    Description:
+    Streams every service as NDJSON or CSV like /export/users. Instances are not included.
+    '''
+    chunks = export_chunks(engine, services_export_query(active_only), export_format, settings.EXPORT_BATCH_SIZE)
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[export_format])
+
+
+#endregion EXPORT
+
+
 #region UPDATE
 
 
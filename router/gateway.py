@@ -1,24 +1,449 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, Path
-from pydantic import HttpUrl
+from typing import Annotated, Callable
+import asyncio
+from functools import partial
+import math
+import time
+from urllib.parse import unquote
+from fastapi import APIRouter, Depends, Path, Request, HTTPException, status
+from fastapi.responses import Response, StreamingResponse
 
 import httpx
 
-from router.service_registry import discover_service #TODO: maybe make this in internal functions ?
+from internal.registry import service_registry
 from dependencies import get_current_active_user
+from internal.schemas import User
+from internal.authorization import authorization_index
+from internal.http_client import upstream_clients
+from internal.load_balancer import LoadBalancer, UpstreamInstance, NoHealthyInstance
+from internal.health import health_checker, FAILURE_STATUS_CODES
+from internal.circuit_breaker import circuit_breakers
+from internal.response_cache import response_cache, CachedResponse, tee_body, iter_file
+from internal.single_flight import single_flight, Flight, SharedResponse, owner, shareable
+from internal.rate_limit import rate_limiter
+from internal.bulkhead import bulkheads
+from internal.retry import retry_policies, RetryPolicy, IDEMPOTENT_METHODS
+from internal import metrics
+from internal.tracing import tracer
 
 router = APIRouter(dependencies=[Depends(get_current_active_user)])
 
+PROXY_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"]
+
+# Connection level headers that must not be forwarded by a proxy (RFC 9110 section 7.6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+def filter_headers(headers: list[tuple[str, str]], exclude: set[str] = frozenset()) -> list[tuple[str, str]]:
+    '''
+    Description:
+    Removes the hop-by-hop headers (and the given extra ones) from a list of header pairs.
+    Repeated headers such as set-cookie are kept as separate pairs.
+    '''
+    return [
+        (name, value) for name, value in headers
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in exclude
+    ]
+
+def checked_path(service_request: str) -> str:
+    '''
+    Description:
+    Returns the path of a proxied request, refusing it with a 400 if a segment is "." or ".."
+    (also percent-encoded, once or more). The permission check sees the segments as sent, while
+    the upstream url would be normalized, so "public/../secret" must never reach either.
+    '''
+    decoded = service_request
+    while True:
+        segments = decoded.replace("\\", "/").split("/")
+        if any(segment in (".", "..") for segment in segments):
+            raise HTTPException(status_code = status.HTTP_400_BAD_REQUEST, detail = "Invalid path")
+        if unquote(decoded) == decoded:
+            return service_request
+        decoded = unquote(decoded)
+
+
+class UpstreamResponse(StreamingResponse):
+    '''
+    Description:
+    Relays an upstream response: status code and end-to-end headers unchanged, raw body chunk
+    by chunk. The pooled connection is always released (and on_close called) once the response
+    is done, also when the client disconnects before or in the middle of the stream.
+    '''
+
+    def __init__(self, upstream_response: httpx.Response, on_close: Callable[[], None], body = None):
+        super().__init__(body or upstream_response.aiter_raw(), status_code = upstream_response.status_code)
+        self.raw_headers = [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in filter_headers(upstream_response.headers.multi_items())
+        ]
+        self.upstream_response = upstream_response
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.upstream_response.aclose()
+            self.on_close()
+
+
+def cached_response(entry: CachedResponse, request: Request, cache_status: str) -> Response:
+    '''
+    Description:
+    Builds the response of a cache entry, or a 304 if the client already holds that version.
+    '''
+    headers = filter_headers(entry.headers, exclude = {"content-length", "age"})
+    headers.append(("age", str(int(time.time() - entry.stored_at))))
+    headers.append(("x-cache", cache_status))
+    if entry.etag is not None and request.headers.get("if-none-match") == entry.etag:
+        response = Response(status_code = status.HTTP_304_NOT_MODIFIED)
+    elif entry.body_path is not None:
+        response = StreamingResponse(iter_file(entry.body_path), status_code = entry.status_code)
+        headers.append(("content-length", str(entry.size)))
+    else:
+        response = Response(content = entry.body, status_code = entry.status_code)
+        headers.append(("content-length", str(entry.size)))
+    response.raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    return response
+
+def shared_response(shared: SharedResponse) -> Response:
+    response = Response(content = shared.body, status_code = shared.status_code)
+    response.raw_headers = [
+        (name.encode("latin-1"), value.encode("latin-1"))
+        for name, value in filter_headers(shared.headers, exclude = {"content-length"})
+    ] + [(b"content-length", str(len(shared.body)).encode("latin-1"))]
+    return response
+
+def vary_values(response_headers, request_headers) -> tuple[tuple[str, str], ...]:
+    return tuple(
+        (name, request_headers.get(name, ""))
+        for name in (part.strip().lower() for part in response_headers.get("vary", "").split(","))
+        if name
+    )
+
+
+async def send_attempt(service_name: str, balancer: LoadBalancer, instance: UpstreamInstance, build_request, retry_policy: RetryPolicy) -> httpx.Response:
+    '''
+    Description:
+    Sends the request to one instance and records the outcome for the health checks and the hedging
+    delay. The span of the attempt ends once the response headers arrived.
+    '''
+    client = upstream_clients.get(service_name, instance.url)
+    upstream_metrics = metrics.upstream(service_name)
+    upstream_metrics.requests.inc()
+    with tracer.span("upstream", {"service": service_name, "instance": instance.url}) as span:
+        upstream_request = build_request(client)
+        traceparent = tracer.traceparent()
+        if traceparent is not None:
+            # The upstream continues the trace under this span, or unsampled under the caller
+            upstream_request.headers["traceparent"] = traceparent
+        started = time.monotonic()
+        try:
+            response = await client.send(upstream_request, stream = True)
+        except httpx.TransportError:
+            upstream_metrics.errors.inc()
+            upstream_metrics.latency.observe(time.monotonic() - started)
+            health_checker.record_proxy_result(service_name, balancer, instance, ok = False)
+            raise
+        span.set_attribute("http.status_code", response.status_code)
+    latency = time.monotonic() - started
+    ok = response.status_code not in FAILURE_STATUS_CODES
+    upstream_metrics.latency.observe(latency)
+    if not ok:
+        upstream_metrics.errors.inc()
+    retry_policy.latency.record(latency)
+    health_checker.record_proxy_result(service_name, balancer, instance, ok = ok)
+    return response
+
+def discard_attempt(task: asyncio.Task, balancer: LoadBalancer, instance: UpstreamInstance):
+    '''
+    Description:
+    Cancels a losing attempt, closing its response if it already arrived, and releases its instance.
+    '''
+    def cleanup(task: asyncio.Task):
+        balancer.release(instance)
+        if not task.cancelled() and task.exception() is None:
+            asyncio.ensure_future(task.result().aclose())
+    task.cancel()
+    task.add_done_callback(cleanup)
+
+async def send_hedged(service_name: str, balancer: LoadBalancer, instance: UpstreamInstance, build_request,
+                      retry_policy: RetryPolicy, hedge: bool) -> tuple[httpx.Response, UpstreamInstance]:
+    '''
+    Description:
+    Sends the request to the (acquired) instance. With `hedge`, if no response arrived after the
+    hedging delay of the service, a second attempt goes to another instance and the first
+    response wins. Returns the response and its instance, which stays acquired; every other
+    instance is released, also when the attempts failed.
+    '''
+    delay = retry_policy.hedge_delay() if hedge else None
+    if delay is None:
+        try:
+            return await send_attempt(service_name, balancer, instance, build_request, retry_policy), instance
+        except BaseException:
+            balancer.release(instance)
+            raise
+
+    first = asyncio.ensure_future(send_attempt(service_name, balancer, instance, build_request, retry_policy))
+    attempts = {first: instance}
+    try:
+        done, _ = await asyncio.wait(attempts, timeout = delay)
+        if not done:
+            try:
+                other = balancer.acquire(exclude = instance)
+            except NoHealthyInstance:
+                other = None
+            if other is not None and retry_policy.allow_extra_attempt():
+                retry_policy.stats["hedged"] += 1
+                attempts[asyncio.ensure_future(send_attempt(service_name, balancer, other, build_request, retry_policy))] = other
+            elif other is not None:
+                balancer.release(other)
+
+        error = None
+        while attempts:
+            done, _ = await asyncio.wait(attempts, return_when = asyncio.FIRST_COMPLETED)
+            for task in done:
+                task_instance = attempts.pop(task)
+                if task.exception() is None:
+                    if task is not first:
+                        retry_policy.stats["hedges_won"] += 1
+                    return task.result(), task_instance
+                balancer.release(task_instance)
+                error = task.exception()
+        raise error
+    finally:
+        for task, task_instance in attempts.items():
+            discard_attempt(task, balancer, task_instance)
+
+async def send_upstream(service_name: str, balancer: LoadBalancer, build_request, retry_policy: RetryPolicy,
+                        retryable: bool) -> tuple[httpx.Response, UpstreamInstance]:
+    '''
+    Description:
+    Sends the request to an instance picked by the balancer. Retryable requests are hedged if
+    the service enables it, and retried after connection errors and 502/503/504 answers, with
+    jittered exponential backoff and on another instance when there is one, as long as the
+    retry budget of the service allows. Returns the response and its instance, which stays
+    acquired and must be released.
+    '''
+    retry_policy.budget.record_request()
+    max_retries = retry_policy.max_retries if retryable else 0
+    previous = None
+    retry = 0
+    while True:
+        try:
+            instance = balancer.acquire(exclude = previous)
+        except NoHealthyInstance:
+            if previous is None:
+                raise
+            instance = balancer.acquire()
+
+        try:
+            response, instance = await send_hedged(service_name, balancer, instance, build_request, retry_policy, hedge = retryable)
+        except httpx.TransportError:
+            if retry >= max_retries or not retry_policy.allow_extra_attempt():
+                raise
+        else:
+            if response.status_code not in FAILURE_STATUS_CODES or retry >= max_retries or not retry_policy.allow_extra_attempt():
+                return response, instance
+            await response.aclose()
+            balancer.release(instance)
+
+        previous = instance
+        retry += 1
+        retry_policy.stats["retries"] += 1
+        await asyncio.sleep(retry_policy.backoff(retry))
+
+
 #test_endpoint
 @router.get("/testgateway")
 async def test_endpoint():
     return {"message": "Hello World"}
 
 
-@router.get("/{service_name}/{service_request:path}")
-async def proxy_request(service_name: Annotated[str, Path()], service_request: Annotated[HttpUrl, Path()]):
-    service_info = discover_service(service_name)
-    if service_info.url:
-        response = await httpx.get(f"{service_info.url}/{service_request}")
-        return response.json()
-    return {"message": f"{service_name} not found"}
+@router.api_route("/{service_name}/{service_request:path}", methods=PROXY_METHODS)
+async def proxy_request(
+        request: Request,
+        service_name: Annotated[str, Path()],
+        service_request: Annotated[str, Path()],
+        current_user: Annotated[User, Depends(get_current_active_user)]
+        ):
+    '''
+    Description:
+    Forwards the request to an instance of the registered service picked by its load balancer.
+    The request body is piped upstream and the upstream body is streamed back in chunks, so
+    memory per request stays constant whatever the payload size. Status code and headers
+    are passed through unchanged. The role of the user needs a "service_name:service_request" permission,
+    and the request a token of the rate limits of the user, its role and the service.
+    '''
+    # The same checked path is authorized, cached, coalesced and sent upstream
+    service_request = checked_path(service_request)
+    if not authorization_index.allows(current_user.role_id, service_name, service_request):
+        raise HTTPException(status_code = status.HTTP_403_FORBIDDEN, detail = "Not enough permissions")
+    await rate_limiter.check(current_user, service_name)
+
+    service_info = service_registry.lookup(service_name)
+    if service_info is None:
+        return {"message": f"{service_name} not found"}
+
+    # Opt-in response cache, checked after authorization so entries are only served to allowed users
+    cache_policy = response_cache.policy(service_name, service_request) if request.method == "GET" else None
+    cache_args = cached = None
+    if cache_policy is not None:
+        cache_args = (service_name, service_request, str(request.query_params), str(current_user.id), cache_policy)
+        cached = response_cache.lookup(*cache_args, request.headers)
+        if cached is not None and cached.fresh:
+            response_cache.stats["hits"] += 1
+            return cached_response(cached, request, "HIT")
+        if "if-none-match" in request.headers or "if-modified-since" in request.headers:
+            # The client revalidates its own copy, pass it through untouched
+            cache_args = cached = None
+        elif cached is not None and not cached.revalidatable:
+            cached = None
+
+    # Identical concurrent GETs share one upstream call, see internal/single_flight.py
+    flight = None
+    coalescing = single_flight.policy(service_name, service_request) if request.method == "GET" else None
+    if coalescing is not None and "if-none-match" not in request.headers and "if-modified-since" not in request.headers:
+        vary_key = coalescing.vary_key(request.headers, str(current_user.id))
+        flight, leader = single_flight.join(single_flight.key(request.method, service_name, service_request, str(request.query_params), vary_key))
+        if not leader:
+            try:
+                shared = await single_flight.wait(flight, request.headers, str(current_user.id))
+            except HTTPException as exception:
+                raise HTTPException(exception.status_code, exception.detail, exception.headers)
+            if shared is not None:
+                return shared_response(shared)
+            flight = None
+
+    try:
+        return await forward_request(request, service_name, service_request, service_info, str(current_user.id), cache_args, cached, flight)
+    except HTTPException as exception:
+        if flight is not None:
+            flight.fail(exception)
+        raise
+    except BaseException:
+        if flight is not None:
+            flight.finish(None)
+        raise
+
+
+async def forward_request(
+        request: Request,
+        service_name: str,
+        service_request: str,
+        service_info,
+        user_key: str,
+        cache_args: tuple | None,
+        cached: CachedResponse | None,
+        flight: Flight | None,
+        ) -> Response:
+    '''
+    Description:
+    Sends the request upstream and relays the response, storing it in the response cache and
+    sharing it with the coalesced requests waiting on `flight` on the way.
+    '''
+    breaker = circuit_breakers.get(service_name)
+    if not breaker.allow():
+        raise HTTPException(
+            status_code = status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail = f"{service_name} is unavailable (circuit open)",
+            headers = {"Retry-After": str(math.ceil(breaker.retry_after()))},
+        )
+
+    # Slot of the service bulkhead, held until the response finished streaming
+    bulkhead = bulkheads.get(service_name)
+    try:
+        await bulkhead.acquire()
+    except BaseException:
+        breaker.cancel()
+        raise
+
+    balancer = service_info.balancer
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+    forwarded_headers = filter_headers(request.headers.items(), exclude = {"host"})
+    if cached is not None:
+        forwarded_headers += list(cached.conditional_headers().items())
+
+    def build_request(client: httpx.AsyncClient) -> httpx.Request:
+        return client.build_request(
+            request.method,
+            f"/{service_request}",
+            params = request.query_params.multi_items(),
+            headers = forwarded_headers,
+            content = request.stream() if has_body else None,
+        )
+
+    started = time.monotonic()
+    try:
+        upstream_response, instance = await send_upstream(
+            service_name, balancer, build_request, retry_policies.get(service_name),
+            # A streamed request body cannot be sent twice
+            retryable = request.method in IDEMPOTENT_METHODS and not has_body,
+        )
+    except NoHealthyInstance:
+        breaker.cancel()
+        bulkhead.release()
+        raise HTTPException(status_code = status.HTTP_503_SERVICE_UNAVAILABLE, detail = f"{service_name} has no healthy instance")
+    except httpx.TransportError:
+        bulkhead.release()
+        breaker.record(False, time.monotonic() - started)
+        raise HTTPException(status_code = status.HTTP_502_BAD_GATEWAY, detail = f"{service_name} is unreachable")
+    except BaseException:
+        bulkhead.release()
+        breaker.cancel()
+        raise
+    breaker.record(upstream_response.status_code < 500, time.monotonic() - started)
+
+    def release():
+        balancer.release(instance)
+        bulkhead.release()
+
+    if cached is not None and upstream_response.status_code == status.HTTP_304_NOT_MODIFIED:
+        await upstream_response.aclose()
+        release()
+        response_cache.revalidated(cached, upstream_response.headers, cache_args[-1])
+        if flight is not None:
+            # An entry stored per user is only handed to that user
+            principal = None if cached.key == response_cache.key(*cache_args[:3], None) else user_key
+            flight.finish(SharedResponse(cached.status_code, cached.headers, cached.body, cached.vary, principal) if cached.body is not None else None)
+        return cached_response(cached, request, "REVALIDATED")
+
+    body = None
+    on_close = release
+    if cache_args is not None:
+        response_cache.stats["misses"] += 1
+        directives = response_cache.storable(upstream_response.status_code, upstream_response.headers, request.headers)
+        if directives is not None:
+            store = partial(
+                response_cache.store, *cache_args,
+                upstream_response.status_code, upstream_response.headers, request.headers, directives,
+            )
+            body = tee_body(upstream_response.aiter_raw(), store, response_cache.max_entry_bytes)
+
+    if flight is not None:
+        if shareable(upstream_response.headers):
+            async def share(content: bytes):
+                flight.finish(SharedResponse(
+                    upstream_response.status_code,
+                    upstream_response.headers.multi_items(),
+                    content,
+                    vary_values(upstream_response.headers, request.headers),
+                    owner(upstream_response.headers, request.headers, user_key),
+                ))
+            body = tee_body(body or upstream_response.aiter_raw(), share, single_flight.max_bytes)
+        else:
+            flight.finish(None)
+
+        def on_close():
+            # Bigger or interrupted bodies are not shared, the followers call upstream themselves
+            release()
+            flight.finish(None)
+    return UpstreamResponse(upstream_response, on_close, body)
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from internal.metrics import registry
+
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def read_metrics():
+    '''
+    Description:
+    Exports the gateway metrics in the Prometheus text format, to be scraped by Prometheus.
+    '''
+    return Response(content = registry.render(), media_type = "text/plain; version=0.0.4; charset=utf-8")
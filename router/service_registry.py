@@ -1,15 +1,15 @@
 from typing import Annotated
 from fastapi import APIRouter, Body, Path, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from internal.schemas import Service
-from dependencies import get_current_active_user
+from internal.schemas import ServiceBase
+from internal.registry import service_registry
+from dependencies import require_permission, get_async_db
+from database import crud
 
 
 
-router = APIRouter(dependencies=[Depends(get_current_active_user)])
-
-#in memory database
-services = {}#TODO: Use a database ?
+router = APIRouter(dependencies=[Depends(require_permission("registry"))])
 
 
 #test_endpoint
@@ -19,16 +19,18 @@ async def test_endpoint():
 
 
 @router.get("/unregister/{service_name}")
-async def unregister_service(service_name: Annotated[str, Path()]):
-    if service_name not in services:
+async def unregister_service(service_name: Annotated[str, Path()], db: AsyncSession = Depends(get_async_db)):
+    service_info = service_registry.lookup(service_name)
+    if service_info is None:
         return {"message": "Service not registered"}
-    del services[service_name]
+    await db.run_sync(crud.deactivate_service, service_info.id)
+    await service_registry.refresh()
     return {"message": "Service unregistered"}
 
 
 @router.get("/discover/{service_name}")
 async def discover_service(service_name: Annotated[str, Path()]):
-    service_info = services.get(service_name)
+    service_info = service_registry.lookup(service_name)
     if service_info:
         return {'service_name': service_name, 'service_url': service_info.url}
     return {"message": f"{service_name} not found in registry"}
@@ -36,9 +38,10 @@ async def discover_service(service_name: Annotated[str, Path()]):
 
 @router.post("/register/{service_name}")
 async def register_service(service_name: Annotated[str, Path()],
-                            information: Annotated[Service, Body()]):
-    if service_name in services:
+                            information: Annotated[ServiceBase, Body()],
+                            db: AsyncSession = Depends(get_async_db)):
+    if service_registry.lookup(service_name) is not None:
         return {"message": "Service already registered"}
-    services[service_name] = Service(url = information.url)
+    await db.run_sync(crud.register_service, information.copy(update = {"name": service_name}))
+    await service_registry.refresh()
     return {"message": "Service registered"}
-
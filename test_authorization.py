@@ -0,0 +1,50 @@
+from fastapi.testclient import TestClient
+
+from main import app
+from dependencies import get_current_active_user
+from internal.authorization import AuthorizationIndex, PermissionTrie
+from internal.schemas import User
+
+
+def test_trie_matches_exact_paths_and_wildcards():
+    trie = PermissionTrie.compile(["documents:files", "documents:scans/*", "users:*/profile", "reports"])
+    assert trie.allows(["documents", "files"])
+    assert not trie.allows(["documents", "files", "1"])
+    assert trie.allows(["documents", "scans"])
+    assert trie.allows(["documents", "scans", "2023", "scan.pdf"])
+    assert trie.allows(["users", "42", "profile"])
+    assert not trie.allows(["users", "42", "settings"])
+    assert trie.allows(["reports", "monthly"])
+    assert not trie.allows(["billing"])
+
+def test_star_allows_everything():
+    assert PermissionTrie.compile(["*"]).allows(["anything", "at", "all"])
+    assert not PermissionTrie.compile(["_"]).allows(["documents", "files"])
+
+def test_index_recompiles_only_changed_roles():
+    index = AuthorizationIndex()
+    index.load(1, [(1, "documents:*"), (2, "*")])
+    admin_trie = index._tries[2]
+    assert index.allows(1, "documents", "/files/1")
+    assert not index.allows(1, "users", "/")
+    assert not index.allows(3, "documents", "/files/1")
+
+    index.load(2, [(1, "users:*"), (2, "*")])
+    assert index._tries[2] is admin_trie
+    assert index.allows(1, "users", "/")
+    assert not index.allows(1, "documents", "/files/1")
+    assert index.permissions(1) == {"users:*"}
+
+def test_registry_and_admin_endpoints_require_their_permission():
+    # Role 1 is the "new user" role created on startup, only granted "_"
+    routes = [("post", "/register/documents"), ("get", "/unregister/documents"), ("get", "/admin/circuit_breakers"), ("get", "/admin/response_cache")]
+    try:
+        with TestClient(app) as client:
+            app.dependency_overrides[get_current_active_user] = lambda: User(id = 1, username = "new", full_name = "new", email = "new@example.com", role_id = 1)
+            for method, path in routes:
+                assert client.request(method, path, json = {}).status_code == 403, path
+
+            app.dependency_overrides[get_current_active_user] = lambda: User(id = 1, username = "admin", full_name = "admin", email = "admin@example.com", role_id = 2)
+            assert client.get("/admin/circuit_breakers").status_code == 200
+    finally:
+        app.dependency_overrides.clear()
@@ -0,0 +1,17 @@
+from benchmarks.run import compare, percentile, summarize
+
+
+def test_percentiles_use_the_nearest_rank():
+    ordered = [index / 100 for index in range(1, 101)]
+    assert percentile(ordered, 0.50) == 0.50
+    assert percentile(ordered, 0.99) == 0.99
+    assert percentile([], 0.95) == 0.0
+
+def test_summary_and_regressions_against_a_baseline():
+    baseline = [summarize("proxy", 10, [0.010] * 95 + [0.020] * 5, 0, 1.0)]
+    assert baseline[0]["rps"] == 100 and baseline[0]["p95_ms"] == 10 and baseline[0]["p99_ms"] == 20
+
+    assert compare([summarize("proxy", 10, [0.010] * 100, 0, 1.05)], baseline, 0.10) == []
+    regressions = compare([summarize("proxy", 10, [0.015] * 80, 1, 1.0)], baseline, 0.10)
+    assert len(regressions) == 3
+    assert compare([summarize("token", 10, [1.0], 0, 1.0)], baseline, 0.10) == []
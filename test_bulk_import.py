@@ -0,0 +1,95 @@
+import json
+import uuid
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from main import app
+from database import crud, models
+from internal.config import get_settings
+from internal.hashing_pool import import_hashing_pool
+
+
+def login(client: TestClient) -> dict:
+    response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+def test_bulk_create_falls_back_to_single_rows_on_conflicts():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        assert crud.bulk_create(db, models.Permission, [{"name": "a"}, {"name": "b"}]) == [1, 2]
+        results = crud.bulk_create(db, models.Permission, [{"name": "c"}, {"name": "a"}, {"name": "d"}])
+        assert results[0] == 3 and results[2] == 4
+        assert isinstance(results[1], IntegrityError)
+        assert db.scalar(select(func.count()).select_from(models.Permission)) == 4
+
+def test_bulk_create_inserts_role_grants():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        crud.bulk_create(db, models.Permission, [{"name": "a"}, {"name": "b"}])
+        ids = crud.bulk_create(db, models.Role, [{"name": "reader"}, {"name": "writer"}], grants = [[1], [1, 2]], version_id = models.AUTHORIZATION_VERSION)
+        grants = db.execute(select(models.RolePermission.role_id, models.RolePermission.permission_id).order_by(models.RolePermission.role_id, models.RolePermission.permission_id)).all()
+        assert grants == [(ids[0], 1), (ids[1], 1), (ids[1], 2)]
+        assert crud.get_registry_version(db, models.AUTHORIZATION_VERSION) == 1
+        assert crud.get_permission_ids(db, [1, "b", "missing", 99]) == {1: 1, "b": 2}
+
+def test_import_permissions_roles_and_users(temp_database):
+    suffix = uuid.uuid4().hex
+    with TestClient(app) as client:
+        headers = login(client)
+
+        response = client.post("/import/permissions", json = [
+            {"name": f"import:{suffix}:a"}, {"name": f"import:{suffix}:b"}, {"name": f"import:{suffix}:a"}, {"nom": "x"},
+        ], headers = headers)
+        assert response.status_code == 200
+        body = response.json()
+        assert (body["created"], body["failed"]) == (2, 2)
+        assert [result["index"] for result in body["results"]] == [0, 1, 2, 3]
+        assert body["results"][2]["error"] == "Permission already exists"
+        assert body["results"][3]["error"][0]["loc"] == ["name"]
+
+        roles = "\n".join([
+            json.dumps({"name": f"importer-{suffix}", "permissions": [f"import:{suffix}:a", f"import:{suffix}:b"]}),
+            "{not json",
+            json.dumps({"name": f"broken-{suffix}", "permissions": ["does-not-exist"]}),
+        ])
+        response = client.post("/import/roles", content = roles, headers = {**headers, "Content-Type": "application/x-ndjson"})
+        body = response.json()
+        assert (body["created"], body["failed"]) == (1, 2)
+        assert body["results"][1]["error"].startswith("Invalid JSON")
+        with temp_database.SessionLocal() as db:
+            permissions = crud.get_role_permissions(db, body["results"][0]["id"])
+        assert sorted(name for name, in permissions) == [f"import:{suffix}:a", f"import:{suffix}:b"]
+
+        small_batches = get_settings().copy(update = {"IMPORT_BATCH_SIZE": 2})
+        app.dependency_overrides[get_settings] = lambda: small_batches
+        try:
+            users = [{"username": f"user{index}", "full_name": "Imported", "email": f"{suffix}-{index}@example.com", "password": "secret"} for index in range(3)]
+            response = client.post("/import/users", json = users + [users[0], {**users[1], "email": "fakemail@fmail.com"}], headers = headers)
+        finally:
+            app.dependency_overrides.pop(get_settings)
+        body = response.json()
+        assert (body["created"], body["failed"]) == (3, 2)
+        assert {result["error"] for result in body["results"][3:]} == {"Email already registered"}
+
+        response = client.post("/token", data = {"username": f"{suffix}-2@example.com", "password": "secret"})
+        assert response.status_code == 200
+
+        assert client.post("/import/users", json = {"not": "a list"}, headers = headers).status_code == 400
+
+def test_items_rejected_by_a_full_hashing_pool_fail_alone(temp_database, monkeypatch):
+    with TestClient(app) as client:
+        headers = login(client)
+        # Room for a single hash at a time
+        monkeypatch.setattr(import_hashing_pool, "workers", 1)
+        monkeypatch.setattr(import_hashing_pool, "max_queue", 0)
+        users = [{"username": f"user{index}", "full_name": "Imported", "email": f"busy-{index}@example.com", "password": "secret"} for index in range(3)]
+        response = client.post("/import/users", json = users, headers = headers)
+        assert response.status_code == 200
+        body = response.json()
+        assert (body["created"], body["failed"]) == (1, 2)
+        assert {result.get("error") for result in body["results"][1:]} == {import_hashing_pool.busy_detail}
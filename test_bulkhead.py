@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from internal.bulkhead import Bulkhead
+
+
+def test_queued_requests_get_released_slots_in_order():
+    async def scenario():
+        bulkhead = Bulkhead("documents", max_concurrent = 1, max_queue = 2, queue_timeout = 1.0)
+        await bulkhead.acquire()
+        admitted = []
+
+        async def request(name):
+            await bulkhead.acquire()
+            admitted.append(name)
+
+        waiters = [asyncio.create_task(request("first")), asyncio.create_task(request("second"))]
+        await asyncio.sleep(0)
+        assert bulkhead.queue_depth == 2
+        with pytest.raises(HTTPException) as overflow:
+            await bulkhead.acquire()
+        assert overflow.value.status_code == 503
+
+        bulkhead.release()
+        await waiters[0]
+        bulkhead.release()
+        await waiters[1]
+        assert admitted == ["first", "second"] and bulkhead.active == 1
+        return bulkhead
+
+    bulkhead = asyncio.run(scenario())
+    assert bulkhead.stats["queued"] == 2 and bulkhead.stats["rejected"] == 1
+
+def test_waiters_time_out_and_leave_the_queue():
+    async def scenario():
+        bulkhead = Bulkhead("documents", max_concurrent = 1, max_queue = 1, queue_timeout = 0.01)
+        await bulkhead.acquire()
+        with pytest.raises(HTTPException):
+            await bulkhead.acquire()
+        bulkhead.release()
+        return bulkhead
+
+    bulkhead = asyncio.run(scenario())
+    assert bulkhead.queue_depth == 0 and bulkhead.active == 0
+    assert bulkhead.stats["timeouts"] == 1 and bulkhead.stats["wait_seconds_max"] >= 0.01
@@ -0,0 +1,48 @@
+from conftest import FakeClock
+from internal.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+def make_breaker(clock):
+    return CircuitBreaker("documents", window = 10, min_calls = 4, error_rate = 0.5, slow_call_seconds = 1.0,
+                          slow_call_rate = 0.5, open_seconds = 30, half_open_calls = 2, clock = clock)
+
+def test_breaker_opens_on_error_rate_and_closes_after_trial_calls():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for success in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(success, 0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+    clock.now = 31
+    assert breaker.allow() and breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(True, 0.1)
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+
+def test_breaker_opens_on_slow_calls_and_reopens_on_failed_trial():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for latency in (2.0, 0.1, 2.0, 0.1):
+        breaker.allow()
+        breaker.record(True, latency)
+    assert breaker.state == OPEN
+
+    clock.now = 31
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+def test_cancelled_trial_call_gives_its_slot_back():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    breaker.state, breaker.opened_at = OPEN, 0.0
+    clock.now = 31
+    assert breaker.allow() and breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+import pytest
+
+from internal.config import SettingsStore
+
+
+def write_config(path, secret_key, mtime):
+    path.write_text(f"SQLALCHEMY_DATABASE_URL: sqlite://\nSECRET_KEY: {secret_key}\n")
+    os.utime(path, (mtime, mtime))
+
+def test_settings_are_loaded_once_and_reloaded_on_change(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, "first", 1_000)
+    store = SettingsStore(str(path))
+
+    settings = store.get()
+    assert settings.SECRET_KEY == "first"
+    assert settings.ALGORITHM == "HS256"
+    assert store.reload_if_changed() is False
+    assert store.get() is settings
+
+    write_config(path, "second", 2_000)
+    assert store.reload_if_changed() is True
+    assert store.get().SECRET_KEY == "second"
+    assert settings.SECRET_KEY == "first"
+
+def test_invalid_config_keeps_previous_settings(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, "first", 1_000)
+    store = SettingsStore(str(path))
+    settings = store.get()
+
+    path.write_text("SQLALCHEMY_DATABASE_URL: [unclosed\n")
+    os.utime(path, (2_000, 2_000))
+    assert store.reload() is False
+    assert store.get() is settings
+
+def test_missing_config_fails_on_first_load(tmp_path):
+    store = SettingsStore(str(tmp_path / "missing.yaml"))
+    with pytest.raises(OSError):
+        store.get()
+
+def test_reload_callbacks_run_when_their_settings_change(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, "first", 1_000)
+    store = SettingsStore(str(path))
+    calls = []
+    store.on_reload(("SECRET_",), lambda settings: calls.append(("secret", settings.SECRET_KEY)))
+    store.on_reload(("TOKEN_CACHE_", "ALGORITHM"), lambda settings: calls.append(("token cache", None)))
+    store.on_reload(("SECRET_",), lambda settings: 1 / 0)
+    store.get()
+    assert calls == []
+
+    write_config(path, "second", 2_000)
+    assert store.reload_if_changed() is True
+    assert calls == [("secret", "second")]
+
+    os.utime(path, (3_000, 3_000))
+    assert store.reload_if_changed() is True
+    assert calls == [("secret", "second")]
+
+def test_async_reload_callbacks_run_on_the_event_loop(tmp_path):
+    path = tmp_path / "config.yaml"
+    write_config(path, "first", 1_000)
+    store = SettingsStore(str(path))
+    calls = []
+
+    async def callback(settings):
+        calls.append(settings.SECRET_KEY)
+
+    store.on_reload(("SECRET_",), callback)
+    store.get()
+
+    async def scenario():
+        write_config(path, "second", 2_000)
+        store.reload_if_changed()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert calls == ["second"]
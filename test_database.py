@@ -0,0 +1,47 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from main import app
+from database import crud, models
+from database.database import to_async_url
+
+
+def test_async_url_uses_async_driver():
+    assert str(to_async_url("sqlite:///./sql_app.db")) == "sqlite+aiosqlite:///./sql_app.db"
+    assert str(to_async_url("postgresql://user:pass@db/gateway")) == "postgresql+asyncpg://user:***@db/gateway"
+
+def test_login_and_reads_use_async_session():
+    with TestClient(app) as client:
+        response = client.post("/token", data={"username": "fakemail@fmail.com", "password": "admin"})
+        assert response.status_code == 200
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.get("/users", headers=headers)
+        assert response.status_code == 200
+        assert "fakemail@fmail.com" in [user["email"] for user in response.json()]
+
+        response = client.get("/user", params={"user_email": "fakemail@fmail.com"}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["username"] == "admin"
+
+def test_registry_versions_are_seeded_and_bumped():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        crud.seed_registry_versions(db)
+        crud.seed_registry_versions(db)
+        assert crud.get_registry_version(db, models.SERVICES_VERSION) == 0
+        db.add(models.Permission(name = "tracked"))
+        crud.bump_registry_version(db, models.AUTHORIZATION_VERSION)
+        db.commit()
+        assert crud.get_registry_version(db, models.AUTHORIZATION_VERSION) == 1
+        assert crud.get_permission_by_name(db, "tracked") is not None
+
+        # Unseeded database, the counter is created by its first bump
+        db.query(models.RegistryVersion).delete()
+        crud.bump_registry_version(db, models.SERVICES_VERSION)
+        crud.bump_registry_version(db, models.SERVICES_VERSION)
+        db.commit()
+        assert crud.get_registry_version(db, models.SERVICES_VERSION) == 2
+    engine.dispose()
@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert
+
+from main import app
+from database import models
+from internal.export import stream_rows, export_chunks, users_export_query, services_export_query
+
+
+def memory_engine(users: int):
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if users:
+            connection.execute(insert(models.User), [
+                {"username": f"user{index}", "email": f"user{index}@example.com", "hashed_password": "x", "is_active": index % 2 == 0}
+                for index in range(users)
+            ])
+        connection.execute(insert(models.Service), [{"name": "documents", "description": "", "url": "http://documents", "endpoints": '{"files": "/files"}'}])
+    return engine
+
+def test_rows_are_streamed_in_batches():
+    engine = memory_engine(5)
+    batches = list(stream_rows(engine, users_export_query(active_only = False), batch_size = 2))
+    assert [len(rows) for rows in batches] == [2, 2, 1]
+    assert [row.id for rows in batches for row in rows] == [1, 2, 3, 4, 5]
+
+def test_ndjson_and_csv_formats():
+    engine = memory_engine(3)
+    lines = b"".join(export_chunks(engine, users_export_query(), "ndjson", 2)).decode().splitlines()
+    users = [json.loads(line) for line in lines]
+    assert [user["username"] for user in users] == ["user0", "user2"]
+    assert "hashed_password" not in users[0]
+
+    rows = list(csv.reader(io.StringIO(b"".join(export_chunks(engine, users_export_query(False), "csv", 2)).decode())))
+    assert rows[0] == ["id", "username", "full_name", "email", "is_active", "role_id"]
+    assert len(rows) == 4
+
+    service = json.loads(b"".join(export_chunks(engine, services_export_query(), "ndjson", 10)))
+    assert service["endpoints"] == {"files": "/files"}
+
+def test_csv_of_an_empty_table_has_its_header():
+    engine = memory_engine(0)
+    assert b"".join(export_chunks(engine, users_export_query(), "csv", 10)) == b"id,username,full_name,email,is_active,role_id\r\n"
+
+def test_export_endpoints_stream():
+    with TestClient(app) as client:
+        response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.get("/export/users", headers = headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert "fakemail@fmail.com" in [json.loads(line)["email"] for line in response.text.splitlines()]
+
+        response = client.get("/export/services", params = {"format": "csv"}, headers = headers)
+        assert response.status_code == 200
+        assert response.text.startswith("id,name,description,url,load_balancing,is_active,endpoints")
+
+        assert client.get("/export/users", params = {"format": "xml"}, headers = headers).status_code == 422
@@ -0,0 +1,165 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from main import app
+from dependencies import get_current_active_user
+from internal.authorization import authorization_index
+from internal.registry import service_registry
+from router.gateway import checked_path
+from internal.http_client import UpstreamClients, upstream_clients
+from internal.config import Settings
+from internal.schemas import User
+from internal.response_cache import CachePolicy, response_cache
+from internal.single_flight import CoalescingPolicy, single_flight
+
+
+def test_upstream_client_is_reused_per_service():
+    clients = UpstreamClients()
+    clients.start(Settings(SQLALCHEMY_DATABASE_URL = "sqlite://", SECRET_KEY = "secret"))
+    first = clients.get("documents", "http://documents:8000/")
+    assert clients.get("documents", "http://documents:8000") is first
+    assert clients.get("users", "http://users:8000") is not first
+    assert str(first.base_url) == "http://documents:8000"
+    asyncio.run(clients.close())
+    assert first.is_closed
+
+def test_upstream_client_service_limits_override_defaults():
+    clients = UpstreamClients()
+    clients.start(Settings(
+        SQLALCHEMY_DATABASE_URL = "sqlite://",
+        SECRET_KEY = "secret",
+        UPSTREAM_MAX_CONNECTIONS = 50,
+        UPSTREAM_SERVICE_LIMITS = {"documents": {"max_connections": 200}},
+    ))
+    assert clients.limits_for("users")["max_connections"] == 50
+    assert clients.limits_for("documents")["max_connections"] == 200
+    assert clients.limits_for("documents")["max_keepalive_connections"] == 20
+
+def test_upstream_client_requires_startup():
+    clients = UpstreamClients()
+    with pytest.raises(RuntimeError):
+        clients.get("documents", "http://documents:8000")
+
+
+async def stub_upstream(request: httpx.Request):
+    async def echo():
+        yield request.method.encode() + b" " + request.url.path.encode() + b" "
+        async for chunk in request.stream:
+            yield chunk
+
+    return httpx.Response(
+        201 if request.method == "POST" else 200,
+        headers = [("content-type", "application/octet-stream"), ("set-cookie", "a=1"), ("set-cookie", "b=2")],
+        content = echo(),
+    )
+
+def test_dot_segments_are_refused_before_authorization():
+    assert checked_path("public/files/1") == "public/files/1"
+    for path in ("public/../secret", "public/./files", "..", "public/%2e%2e/secret", "public/%252E%252e/secret", "public\\..\\secret"):
+        with pytest.raises(HTTPException) as error:
+            checked_path(path)
+        assert error.value.status_code == 400
+
+    # A role only granted the public files of the service
+    app.dependency_overrides[get_current_active_user] = lambda: User(id = 1, username = "reader", full_name = "reader", email = "reader@example.com", role_id = 99)
+    try:
+        with TestClient(app) as client:
+            authorization_index.load(authorization_index.version, [(99, "stub:public/*")])
+            # %2e%2e reaches the gateway as "..", which httpx would resolve to /secret upstream
+            assert client.get("/stub/public/%2e%2e/secret").status_code == 400
+            assert client.get("/stub/secret").status_code == 403
+            assert client.get("/stub/public/files").status_code != 403
+    finally:
+        app.dependency_overrides.clear()
+
+def test_proxy_streams_all_methods_and_passes_headers():
+    # Role 2 is the admin role created on startup, granted "*"
+    app.dependency_overrides[get_current_active_user] = lambda: User(id = 1, username = "admin", full_name = "admin", email = "admin@example.com", role_id = 2)
+    try:
+        with TestClient(app) as client:
+            client.post("/register/stub", json = {"name": "stub", "description": "stub", "url": "http://stub.local", "endpoints": {}})
+            assert service_registry.lookup("stub").url == "http://stub.local"
+            upstream_clients._clients[("stub", "http://stub.local")] = httpx.AsyncClient(
+                base_url = "http://stub.local", transport = httpx.MockTransport(stub_upstream)
+            )
+            response = client.get("/stub/files/1")
+            assert response.status_code == 200
+            assert response.content == b"GET /files/1 "
+            assert response.headers.get_list("set-cookie") == ["a=1", "b=2"]
+
+            payload = b"\x00scan" * 100_000
+            response = client.post("/stub/files", content = payload)
+            assert response.status_code == 201
+            assert response.content == b"POST /files " + payload
+            assert service_registry.lookup("stub").balancer.instances[0].in_flight == 0
+    finally:
+        app.dependency_overrides.clear()
+
+def test_proxy_caches_and_revalidates_get_responses():
+    upstream_calls = []
+
+    async def body(content: bytes):
+        yield content
+
+    async def versioned_upstream(request: httpx.Request):
+        upstream_calls.append(request.headers.get("if-none-match"))
+        if request.url.path == "/static":
+            return httpx.Response(200, headers = {"cache-control": "max-age=60"}, content = body(b"static"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304, headers = {"etag": '"v1"', "cache-control": "no-cache"})
+        return httpx.Response(200, headers = {"etag": '"v1"', "cache-control": "no-cache"}, content = body(b"version 1"))
+
+    app.dependency_overrides[get_current_active_user] = lambda: User(id = 1, username = "admin", full_name = "admin", email = "admin@example.com", role_id = 2)
+    try:
+        with TestClient(app) as client:
+            client.post("/register/cached", json = {"name": "cached", "description": "cached", "url": "http://cached.local", "endpoints": {}})
+            upstream_clients._clients[("cached", "http://cached.local")] = httpx.AsyncClient(
+                base_url = "http://cached.local", transport = httpx.MockTransport(versioned_upstream)
+            )
+            response_cache.policies = {"cached": CachePolicy("cached")}
+
+            assert client.get("/cached/static").headers.get("x-cache") is None
+            response = client.get("/cached/static")
+            assert (response.headers["x-cache"], response.content) == ("HIT", b"static")
+
+            client.get("/cached/document")
+            response = client.get("/cached/document")
+            assert (response.headers["x-cache"], response.content) == ("REVALIDATED", b"version 1")
+            assert upstream_calls == [None, None, '"v1"']
+            assert response_cache.status()["hits"] == 1
+    finally:
+        response_cache.policies = {}
+        app.dependency_overrides.clear()
+
+def test_proxy_coalesces_identical_concurrent_gets():
+    upstream_calls = []
+
+    async def slow_upstream(request: httpx.Request):
+        upstream_calls.append(request.url.path)
+        await asyncio.sleep(0.2)
+
+        async def body():
+            yield b"popular"
+        return httpx.Response(200, content = body())
+
+    app.dependency_overrides[get_current_active_user] = lambda: User(id = 1, username = "admin", full_name = "admin", email = "admin@example.com", role_id = 2)
+    try:
+        with TestClient(app) as client:
+            client.post("/register/popular", json = {"name": "popular", "description": "popular", "url": "http://popular.local", "endpoints": {}})
+            upstream_clients._clients[("popular", "http://popular.local")] = httpx.AsyncClient(
+                base_url = "http://popular.local", transport = httpx.MockTransport(slow_upstream)
+            )
+            single_flight.policies = {"popular": CoalescingPolicy("popular")}
+
+            with ThreadPoolExecutor(max_workers = 5) as executor:
+                responses = list(executor.map(lambda _: client.get("/popular/files/1"), range(5)))
+            assert [response.content for response in responses] == [b"popular"] * 5
+            assert upstream_calls == ["/files/1"]
+    finally:
+        single_flight.policies = {}
+        app.dependency_overrides.clear()
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from internal.hashing_pool import HashingPool
+from internal.security import get_password_hash, verify_password_async
+
+
+def test_full_pool_rejects_with_503():
+    pool = HashingPool(workers = 1, max_queue = 1)
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert pool.pending == 2
+        with pytest.raises(HTTPException) as error:
+            await pool.run(release.wait)
+        assert error.value.status_code == 503
+        release.set()
+        assert await asyncio.gather(*running) == [True, True]
+        assert pool.pending == 0
+
+    asyncio.run(scenario())
+    pool.shutdown()
+
+def test_password_is_verified_off_the_event_loop():
+    hashed = get_password_hash("secret")
+    assert asyncio.run(verify_password_async("secret", hashed)) is True
+    assert asyncio.run(verify_password_async("wrong", hashed)) is False
@@ -0,0 +1,69 @@
+import asyncio
+from types import MappingProxyType, SimpleNamespace
+
+import httpx
+import pytest
+
+from internal.config import Settings
+from internal.health import HealthChecker
+from internal.http_client import upstream_clients
+from internal.load_balancer import NoHealthyInstance
+from internal.registry import make_route
+
+
+def make_checker(routes, interval = 10.0):
+    registry = SimpleNamespace(snapshot = SimpleNamespace(services = MappingProxyType({route.name: route for route in routes})))
+    return HealthChecker(registry, interval = interval, unhealthy_threshold = 2, healthy_threshold = 2, passive_failure_threshold = 3)
+
+def test_active_checks_eject_and_readmit_instances():
+    route = make_route(1, "documents", "http://documents.local", [("http://up.local", 1), ("http://down.local", 1)])
+    checker = make_checker([route])
+    status_codes = {"up.local": 200, "down.local": 503}
+
+    async def scenario():
+        upstream_clients.start(Settings(SQLALCHEMY_DATABASE_URL = "sqlite://", SECRET_KEY = "secret"))
+        for host in status_codes:
+            upstream_clients._clients[("documents", f"http://{host}")] = httpx.AsyncClient(
+                base_url = f"http://{host}",
+                transport = httpx.MockTransport(lambda request: httpx.Response(status_codes[request.url.host])),
+            )
+        try:
+            await checker.check_once()
+            assert len(route.balancer.available) == 2
+            await checker.check_once()
+            assert [instance.url for instance in route.balancer.available] == ["http://up.local"]
+            assert all(route.balancer.pick().url == "http://up.local" for _ in range(5))
+
+            status_codes["down.local"] = 200
+            await checker.check_once()
+            assert len(route.balancer.available) == 1
+            await checker.check_once()
+            assert len(route.balancer.available) == 2
+        finally:
+            await upstream_clients.close()
+
+    asyncio.run(scenario())
+
+def test_consecutive_proxy_failures_eject_an_instance():
+    route = make_route(1, "documents", "http://documents.local")
+    instance = route.balancer.instances[0]
+    checker = make_checker([route])
+
+    checker.record_proxy_result("documents", route.balancer, instance, ok = False)
+    checker.record_proxy_result("documents", route.balancer, instance, ok = False)
+    checker.record_proxy_result("documents", route.balancer, instance, ok = True)
+    checker.record_proxy_result("documents", route.balancer, instance, ok = False)
+    checker.record_proxy_result("documents", route.balancer, instance, ok = False)
+    assert instance.healthy
+    checker.record_proxy_result("documents", route.balancer, instance, ok = False)
+    assert not instance.healthy
+    with pytest.raises(NoHealthyInstance):
+        route.balancer.pick()
+
+def test_passive_ejection_needs_active_checks():
+    route = make_route(1, "documents", "http://documents.local")
+    instance = route.balancer.instances[0]
+    checker = make_checker([route], interval = 0)
+    for _ in range(10):
+        checker.record_proxy_result("documents", route.balancer, instance, ok = False)
+    assert instance.healthy
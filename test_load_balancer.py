@@ -0,0 +1,28 @@
+import random
+from collections import Counter
+
+from internal.load_balancer import LoadBalancer, UpstreamInstance
+
+
+def make_balancer(strategy: str, weights: list[int]) -> LoadBalancer:
+    instances = [UpstreamInstance(f"http://replica{index}.local", weight) for index, weight in enumerate(weights)]
+    return LoadBalancer(instances, strategy, rng = random.Random(7))
+
+def test_round_robin_follows_the_weights_smoothly():
+    balancer = make_balancer("round_robin", [3, 1])
+    picks = [balancer.pick().url for _ in range(8)]
+    assert Counter(picks) == {"http://replica0.local": 6, "http://replica1.local": 2}
+    assert picks[:4].count("http://replica1.local") == 1
+
+def test_least_outstanding_avoids_busy_instances():
+    balancer = make_balancer("least_outstanding", [1, 1, 1])
+    busy = balancer.acquire()
+    assert balancer.acquire() is not busy
+    balancer.release(busy)
+    assert busy.in_flight == 0
+
+def test_power_of_two_prefers_the_less_loaded_sample():
+    balancer = make_balancer("power_of_two", [1, 1])
+    balancer.instances[0].in_flight = 10
+    picks = Counter(balancer.pick().url for _ in range(200))
+    assert picks["http://replica1.local"] > picks["http://replica0.local"]
@@ -0,0 +1,36 @@
+from fastapi.testclient import TestClient
+
+from internal.metrics import Counter, Histogram, MetricsRegistry
+from main import app
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.register(Histogram("latency_seconds", "Latency", ("service",), buckets = (0.1, 1.0)))
+    child = latency.labels("documents")
+    assert latency.labels("documents") is child
+    for value in (0.05, 0.1, 0.5, 3.0):
+        child.observe(value)
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{service="documents",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{service="documents",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{service="documents",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{service="documents"} 4' in lines
+    assert 'latency_seconds_sum{service="documents"} 3.65' in lines
+
+def test_collected_metrics_are_read_on_scrape():
+    registry = MetricsRegistry()
+    sizes = {"documents": 3}
+    registry.register(Counter("size_total", "Size", ("service",), collect = lambda: [((name,), size) for name, size in sizes.items()]))
+    sizes["documents"] = 5
+    assert 'size_total{service="documents"} 5' in registry.render()
+
+def test_metrics_endpoint_reports_requests_per_route():
+    with TestClient(app) as client:
+        client.get("/")
+        client.get("/documents/files/1")
+        text = client.get("/metrics").text
+    assert 'gateway_http_requests_total{method="GET",route="/"}' in text
+    assert 'gateway_http_requests_total{method="GET",route="/{service_name}/{service_request:path}"}' in text
+    assert 'gateway_db_query_duration_seconds_count{engine="async"}' in text
+    assert "# TYPE gateway_event_loop_lag_seconds histogram" in text
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import Session
+
+from database import crud, models
+from internal import temp
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Lookups that must be served by an index, as run by the application
+INDEXED_LOOKUPS = {
+    "active user by email (login)": lambda db: temp.get_active_user_by_email(db, "someone@example.com"),
+    "user by email": lambda db: crud.get_user_by_email(db, "someone@example.com"),
+    "page of active users": lambda db: crud.get_active_users(db, limit = 10, after_id = 100),
+    "services by name": lambda db: crud.get_services_by_name(db, "documents"),
+    "active services by name": lambda db: crud.get_active_services_by_name(db, "documents"),
+    "active services by url": lambda db: crud.get_active_services_by_url(db, "http://documents"),
+    "active services (routing snapshot)": lambda db: crud.get_active_services(db, limit = None),
+    "role by name": lambda db: crud.get_role_by_name(db, "admin"),
+    "permission by name": lambda db: crud.get_permission_by_name(db, "*"),
+    "roles granted a permission": lambda db: db.query(models.RolePermission.role_id).filter(models.RolePermission.permission_id == 1).all(),
+}
+
+
+@pytest.fixture
+def migrated_engine(tmp_path):
+    '''
+    Empty database upgraded to the latest revision. SQLite unless MIGRATIONS_TEST_DATABASE_URL
+    names another (empty) database, e.g. a PostgreSQL one.
+    '''
+    url = os.environ.get("MIGRATIONS_TEST_DATABASE_URL", f"sqlite:///{tmp_path / 'migrations.db'}")
+    config = Config()
+    config.set_main_option("script_location", os.path.join(ROOT, "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+    engine = create_engine(url)
+    yield engine
+    engine.dispose()
+    command.downgrade(config, "base")
+
+def captured_statements(engine, lookup) -> list[tuple[str, object]]:
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        with Session(engine) as db:
+            lookup(db)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+def query_plan(connection, statement: str, parameters) -> list[str]:
+    if connection.dialect.name == "sqlite":
+        return [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+    # Tables of a test database are tiny, make the planner show whether an index could be used
+    connection.exec_driver_sql("SET enable_seqscan = off")
+    return [row[0] for row in connection.exec_driver_sql("EXPLAIN " + statement, parameters)]
+
+def full_scans(dialect: str, plan: list[str]) -> list[str]:
+    if dialect == "sqlite":
+        # Indexed steps read "SEARCH <table> USING ..." or "SCAN <table> USING COVERING INDEX ..."
+        return [step for step in plan if step.startswith("SCAN") and "USING" not in step]
+    return [step for step in plan if "Seq Scan" in step]
+
+
+def test_migrations_match_the_models(migrated_engine):
+    with migrated_engine.connect() as connection:
+        assert compare_metadata(MigrationContext.configure(connection), models.Base.metadata) == []
+    indexes = {index["name"] for table in ("users", "services", "role_permissions") for index in inspect(migrated_engine).get_indexes(table)}
+    with Session(migrated_engine) as db:
+        assert db.query(models.RegistryVersion.id, models.RegistryVersion.version).order_by(models.RegistryVersion.id).all() == [
+            (models.SERVICES_VERSION, 0), (models.AUTHORIZATION_VERSION, 0),
+        ]
+    assert {"ix_users_email_is_active", "ix_users_is_active_id", "ix_services_name_is_active",
+            "ix_services_is_active_id", "ix_role_permissions_permission_id"} <= indexes
+
+@pytest.mark.parametrize("lookup", INDEXED_LOOKUPS)
+def test_lookups_use_indexes(migrated_engine, lookup):
+    statements = captured_statements(migrated_engine, INDEXED_LOOKUPS[lookup])
+    assert statements
+    with migrated_engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = query_plan(connection, statement, parameters)
+            assert not full_scans(migrated_engine.dialect.name, plan), f"{lookup}: {statement}\n" + "\n".join(plan)
@@ -0,0 +1,67 @@
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from main import app
+from database import crud
+from internal.config import get_settings
+from internal.pagination import encode_cursor, decode_cursor
+from internal.schemas import PermissionBase
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    assert decode_cursor(encode_cursor(42)) == 42
+    for cursor in ("not a cursor", encode_cursor(1)[:-2] + "!!", "eyJhZnRlciI6ICJ4In0"):
+        with pytest.raises(HTTPException) as error:
+            decode_cursor(cursor)
+        assert error.value.status_code == 400
+
+def test_permissions_are_walked_with_cursors(temp_database):
+    with temp_database.SessionLocal() as db:
+        for _ in range(5):
+            crud.create_permission(db, PermissionBase(name = f"pagination:{uuid.uuid4().hex}"))
+
+    with TestClient(app) as client:
+        response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        everything = client.get("/permissions", params = {"limit": 500}, headers = headers).json()
+        # "_" and "*" created on startup
+        assert len(everything) == 7
+
+        walked = []
+        params = {"limit": 2}
+        while True:
+            response = client.get("/permissions", params = params, headers = headers)
+            assert response.status_code == 200
+            assert len(response.json()) <= 2
+            walked += response.json()
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                assert "Link" not in response.headers
+                break
+            assert f"cursor={cursor}" in response.headers["Link"]
+            params = {"limit": 2, "cursor": cursor}
+
+        assert walked == everything
+        assert [permission["id"] for permission in walked] == sorted(permission["id"] for permission in walked)
+
+        response = client.get("/permissions", params = {"cursor": "garbage"}, headers = headers)
+        assert response.status_code == 400
+
+def test_page_size_is_capped():
+    with TestClient(app) as client:
+        response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = client.get("/permissions", params = {"limit": 1}, headers = headers)
+        assert len(response.json()) == 1
+
+        capped = get_settings().copy(update = {"PAGINATION_MAX_PAGE_SIZE": 1})
+        app.dependency_overrides[get_settings] = lambda: capped
+        try:
+            response = client.get("/permissions", params = {"limit": 100}, headers = headers)
+        finally:
+            app.dependency_overrides.pop(get_settings)
+        assert len(response.json()) == 1
+        assert "X-Next-Cursor" in response.headers
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from conftest import FakeClock
+from internal.config import Settings
+from internal.rate_limit import Limit, LocalBackend, RateLimiter
+from internal.schemas import User
+
+
+def test_bucket_allows_bursts_then_refills():
+    clock = FakeClock()
+    backend = LocalBackend(clock)
+    bucket = [("user:1", Limit(rate = 2, burst = 3))]
+    assert [asyncio.run(backend.acquire(bucket)) for _ in range(3)] == [0, 0, 0]
+    assert asyncio.run(backend.acquire(bucket)) == pytest.approx(0.5)
+    clock.now = 0.5
+    assert asyncio.run(backend.acquire(bucket)) == 0
+
+def test_rejected_requests_take_no_tokens_from_other_buckets():
+    backend = LocalBackend(FakeClock())
+    user, service = ("user:1", Limit(rate = 1, burst = 5)), ("service:documents", Limit(rate = 1, burst = 1))
+    assert asyncio.run(backend.acquire([user, service])) == 0
+    assert asyncio.run(backend.acquire([user, service])) > 0
+    assert backend._tokens(*user, 0.0) == 4
+
+def test_refilled_buckets_are_dropped():
+    clock = FakeClock()
+    backend = LocalBackend(clock)
+    for user_id in range(100):
+        asyncio.run(backend.acquire([(f"user:{user_id}", Limit(rate = 10, burst = 10))]))
+    assert len(backend) == 100
+    clock.now = 1.0
+    asyncio.run(backend.acquire([("user:0", Limit(rate = 10, burst = 10))]))
+    assert len(backend) == 1
+
+def test_limiter_answers_429_with_retry_after():
+    limiter = RateLimiter()
+    limiter.configure(Settings(
+        SQLALCHEMY_DATABASE_URL = "sqlite://",
+        SECRET_KEY = "secret",
+        RATE_LIMIT_USER = {"rate": 1, "burst": 100},
+        RATE_LIMIT_USER_BY_ROLE = {"1": {"rate": 0.1, "burst": 1}},
+    ))
+    guest = User(id = 3, username = "guest", full_name = "guest", email = "guest@example.com", role_id = 1)
+    admin = User(id = 1, username = "admin", full_name = "admin", email = "admin@example.com", role_id = 2)
+    asyncio.run(limiter.check(guest, "documents"))
+    with pytest.raises(HTTPException) as rejected:
+        asyncio.run(limiter.check(guest, "documents"))
+    assert rejected.value.status_code == 429 and rejected.value.headers["Retry-After"] == "10"
+    asyncio.run(limiter.check(admin, "documents"))
+    asyncio.run(limiter.check(admin, "documents"))
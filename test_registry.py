@@ -0,0 +1,47 @@
+import asyncio
+import uuid
+
+from database import crud
+from internal.registry import ServiceRegistry
+from internal.schemas import ServiceBase
+
+
+def test_workers_converge_on_the_database_registry(temp_database):
+    name = f"documents-{uuid.uuid4().hex[:8]}"
+    service = ServiceBase(
+        name=name,
+        description="documents",
+        url=f"http://{name}.local",
+        endpoints={"scan": "/scan"},
+        instances=[{"url": f"http://{name}-1.local", "weight": 2}, {"url": f"http://{name}-2.local"}],
+        load_balancing="least_outstanding",
+    )
+    worker_a, worker_b = ServiceRegistry(), ServiceRegistry()
+
+    async def scenario():
+        await worker_a.refresh(force=True)
+        await worker_b.refresh(force=True)
+        assert worker_a.lookup(name) is None
+
+        db = temp_database.SessionLocal()
+        try:
+            db_service = crud.register_service(db, service)
+            assert await worker_a.refresh() is True
+            assert await worker_b.refresh() is True
+            assert await worker_b.refresh() is False
+            assert worker_a.lookup(name) == worker_b.lookup(name)
+            assert worker_b.lookup(name).url == f"http://{name}.local"
+            assert worker_b.lookup(name).instances == ((f"http://{name}-1.local", 2), (f"http://{name}-2.local", 1))
+            assert worker_b.lookup(name).balancer.strategy == "least_outstanding"
+
+            crud.deactivate_service(db, db_service.id)
+            await worker_a.refresh()
+            assert worker_a.lookup(name) is None
+
+            crud.register_service(db, service)
+            await worker_a.refresh()
+            assert worker_a.lookup(name).id == db_service.id
+        finally:
+            db.close()
+
+    asyncio.run(scenario())
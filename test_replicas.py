@@ -0,0 +1,103 @@
+import asyncio
+import uuid
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.requests import Request
+
+import dependencies
+from conftest import FakeClock
+from main import app
+from database import models
+from database.database import routing_sessionmaker
+from internal.read_your_writes import ReadYourWrites, read_your_writes
+
+
+def request_with(headers: dict) -> Request:
+    return Request({"type": "http", "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]})
+
+def sqlite_file(path, emails: list[str]):
+    sync_engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(sync_engine)
+    if emails:
+        with sync_engine.begin() as connection:
+            connection.execute(insert(models.User), [{"email": email, "username": email, "hashed_password": "x"} for email in emails])
+    sync_engine.dispose()
+    return create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+
+def test_writes_are_remembered_for_the_window():
+    clock = FakeClock()
+    tracker = ReadYourWrites(window = 5.0, max_size = 2, clock = clock)
+    key = tracker.key(request_with({"Authorization": "Bearer token-a"}))
+    assert key is not None and tracker.key(request_with({})) is None
+
+    tracker.wrote(key)
+    assert tracker.recent(key)
+    clock.now = 5.0
+    assert not tracker.recent(key)
+
+    tracker.wrote("b")
+    tracker.wrote("c")
+    tracker.wrote("d")
+    assert not tracker.recent("b") and tracker.recent("c") and tracker.recent("d")
+    tracker.wrote(None)
+
+def test_sessions_read_from_replicas_until_they_write(tmp_path):
+    primary = sqlite_file(tmp_path / "primary.db", ["primary@example.com"])
+    replica = sqlite_file(tmp_path / "replica.db", ["replica@example.com"])
+    ReadSession = routing_sessionmaker(primary, [replica])
+    emails = select(models.User.email)
+
+    async def scenario():
+        async with ReadSession() as db:
+            assert (await db.scalars(emails)).all() == ["replica@example.com"]
+
+        async with ReadSession() as db:
+            db.info["use_primary"] = True
+            assert (await db.scalars(emails)).all() == ["primary@example.com"]
+
+        async with ReadSession() as db:
+            assert (await db.scalars(emails)).all() == ["replica@example.com"]
+            db.add(models.Permission(name = "written"))
+            await db.commit()
+            # Reads its own write
+            assert (await db.scalars(select(models.Permission.name))).all() == ["written"]
+            assert (await db.scalars(emails)).all() == ["primary@example.com"]
+
+        async with routing_sessionmaker(primary, [])() as db:
+            assert (await db.scalars(emails)).all() == ["primary@example.com"]
+
+        await primary.dispose()
+        await replica.dispose()
+
+    asyncio.run(scenario())
+
+def test_token_reads_its_writes_across_requests(temp_database, tmp_path, monkeypatch):
+    email = f"replica-{uuid.uuid4().hex}@example.com"
+    with TestClient(app) as client:
+        # A replica with only the admin created on startup, lagging behind every write of the primary
+        with temp_database.engine.connect() as connection:
+            admin = connection.execute(select(models.User.__table__).where(models.User.email == "fakemail@fmail.com")).mappings().one()
+        replica = sqlite_file(tmp_path / "replica.db", [])
+        sync_replica = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+        with sync_replica.begin() as connection:
+            connection.execute(insert(models.User), [dict(admin)])
+        sync_replica.dispose()
+        monkeypatch.setattr(dependencies, "ReadSessionLocal", routing_sessionmaker(temp_database.async_engine, [replica]))
+
+        response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.get("/users", params = {"limit": 500}, headers = headers)
+        assert [user["email"] for user in response.json()] == ["fakemail@fmail.com"]
+
+        response = client.post("/create/users", json = {"username": "r", "full_name": "R", "email": email, "password": "secret"}, headers = headers)
+        assert response.status_code == 200
+        assert read_your_writes.recent(read_your_writes.key(request_with(headers)))
+
+        response = client.get("/user", params = {"user_email": email}, headers = headers)
+        assert response.status_code == 200
+
+    asyncio.run(replica.dispose())
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import httpx
+from starlette.datastructures import Headers
+
+from internal.response_cache import CachePolicy, ResponseCache
+
+
+def store(cache, path, body, cache_control = "max-age=60", user_key = "1", request_headers = None):
+    policy = CachePolicy("documents")
+    headers = httpx.Headers({"cache-control": cache_control})
+    request_headers = Headers(request_headers or {})
+    directives = cache.storable(200, headers, request_headers)
+    asyncio.run(cache.store("documents", path, "", user_key, policy, 200, headers, request_headers, directives, body))
+    return policy
+
+def test_memory_tier_evicts_least_recently_used_entries():
+    cache = ResponseCache(max_bytes = 10, disk_threshold = 10)
+    policy = store(cache, "a", b"aaaa")
+    store(cache, "b", b"bbbb")
+    assert cache.lookup("documents", "a", "", "1", policy, Headers()) is not None
+    store(cache, "c", b"cccc")
+    assert cache.lookup("documents", "b", "", "1", policy, Headers()) is None
+    assert cache.lookup("documents", "a", "", "1", policy, Headers()).body == b"aaaa"
+    assert cache.status()["memory_bytes"] == 8
+
+def test_large_bodies_go_to_disk(tmp_path):
+    cache = ResponseCache(disk_path = str(tmp_path), disk_threshold = 4)
+    policy = store(cache, "scan", b"x" * 100)
+    entry = cache.lookup("documents", "scan", "", "1", policy, Headers())
+    assert entry.body is None and os.path.getsize(entry.body_path) == 100
+    cache.clear()
+    assert not os.path.exists(entry.body_path)
+
+def test_private_responses_are_stored_per_user():
+    cache = ResponseCache()
+    policy = store(cache, "me", b"alice", cache_control = "private, max-age=60", user_key = "1")
+    assert cache.lookup("documents", "me", "", "1", policy, Headers()).body == b"alice"
+    assert cache.lookup("documents", "me", "", "2", policy, Headers()) is None
+
+def test_authenticated_responses_are_only_shared_when_public():
+    cache = ResponseCache()
+    policy = store(cache, "me", b"alice", user_key = "1", request_headers = {"Authorization": "Bearer alice"})
+    assert cache.lookup("documents", "me", "", "1", policy, Headers()).body == b"alice"
+    assert cache.lookup("documents", "me", "", "2", policy, Headers()) is None
+
+    store(cache, "logo", b"logo", cache_control = "public, max-age=60", user_key = "1", request_headers = {"Authorization": "Bearer alice"})
+    store(cache, "terms", b"terms", cache_control = "s-maxage=60", user_key = "1", request_headers = {"Cookie": "session=alice"})
+    assert cache.lookup("documents", "logo", "", "2", policy, Headers()).body == b"logo"
+    assert cache.lookup("documents", "terms", "", "2", policy, Headers()).body == b"terms"
+
+def test_no_store_responses_are_not_cached():
+    cache = ResponseCache()
+    assert cache.storable(200, httpx.Headers({"cache-control": "no-store"}), Headers()) is None
+    assert cache.storable(500, httpx.Headers({"cache-control": "max-age=60"}), Headers()) is None
+
+def test_storing_a_key_again_replaces_its_file(tmp_path):
+    cache = ResponseCache(disk_path = str(tmp_path), disk_threshold = 4)
+    policy = store(cache, "scan", b"x" * 100)
+    first = cache.lookup("documents", "scan", "", "1", policy, Headers())
+    store(cache, "scan", b"y" * 50)
+    entry = cache.lookup("documents", "scan", "", "1", policy, Headers())
+    assert not os.path.exists(first.body_path)
+    with open(entry.body_path, "rb") as file:
+        assert file.read() == b"y" * 50
+    assert cache.status()["disk_bytes"] == 50 and os.listdir(tmp_path) == [os.path.basename(entry.body_path)]
@@ -0,0 +1,104 @@
+import asyncio
+import random
+
+import httpx
+import pytest
+
+from conftest import FakeClock
+from internal.http_client import UpstreamClients
+from internal.load_balancer import LoadBalancer, UpstreamInstance
+from internal.retry import LatencyTracker, RetryBudget, RetryPolicy
+from router import gateway
+
+
+def test_retry_budget_limits_retries_to_a_share_of_the_traffic():
+    clock = FakeClock()
+    budget = RetryBudget(ratio = 0.1, min_per_second = 0.0, clock = clock)
+    budget.balance = 0.0
+    for _ in range(20):
+        budget.record_request()
+    assert [budget.try_withdraw() for _ in range(3)] == [True, True, False]
+
+def test_latency_tracker_percentile():
+    tracker = LatencyTracker(percentile = 0.95, min_samples = 20, refresh_every = 1)
+    for latency in range(1, 101):
+        tracker.record(latency / 100)
+    assert tracker.value == 0.95
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy("documents", backoff_base = 0.1, backoff_max = 0.3, rng = random.Random(1))
+    assert all(0 <= policy.backoff(retry) <= 0.3 for retry in range(1, 10))
+    assert 0 <= policy.backoff(1) <= 0.1
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    '''
+    Two instances of "documents" answered by the given handlers.
+    '''
+    clients = UpstreamClients()
+    clients._started = True
+    monkeypatch.setattr(gateway, "upstream_clients", clients)
+
+    def setup(first_handler, second_handler):
+        for url, handler in (("http://first.local", first_handler), ("http://second.local", second_handler)):
+            clients._clients[("documents", url)] = httpx.AsyncClient(base_url = url, transport = httpx.MockTransport(handler))
+        instances = [UpstreamInstance("http://first.local"), UpstreamInstance("http://second.local")]
+        return LoadBalancer(instances, "round_robin"), instances
+    return setup
+
+def build_request(client: httpx.AsyncClient) -> httpx.Request:
+    return client.build_request("GET", "/files/1")
+
+async def body(content: bytes):
+    yield content
+
+
+def test_failed_attempts_are_retried_on_another_instance(upstreams):
+    balancer, instances = upstreams(
+        lambda request: httpx.Response(503, content = body(b"down")),
+        lambda request: httpx.Response(200, content = body(b"ok")),
+    )
+    policy = RetryPolicy("documents", max_retries = 2, backoff_base = 0.001)
+
+    async def scenario():
+        response, instance = await gateway.send_upstream("documents", balancer, build_request, policy, retryable = True)
+        await response.aclose()
+        return response, instance
+
+    response, instance = asyncio.run(scenario())
+    assert response.status_code == 200 and instance is instances[1]
+    assert [instance.in_flight for instance in instances] == [0, 1]
+    assert policy.stats["retries"] == 1
+
+def test_non_retryable_requests_are_sent_once(upstreams):
+    calls = []
+
+    def failing(request):
+        calls.append(request.url.host)
+        return httpx.Response(503, content = body(b"down"))
+
+    balancer, _ = upstreams(failing, failing)
+    policy = RetryPolicy("documents", max_retries = 2)
+    response, _ = asyncio.run(gateway.send_upstream("documents", balancer, build_request, policy, retryable = False))
+    assert response.status_code == 503 and len(calls) == 1
+
+def test_slow_attempts_are_hedged_on_another_instance(upstreams):
+    async def slow(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200, content = body(b"slow"))
+
+    balancer, instances = upstreams(slow, lambda request: httpx.Response(200, content = body(b"fast")))
+    policy = RetryPolicy("documents", hedge = True, hedge_min_delay = 0.01)
+    policy.latency.value = 0.01
+
+    async def scenario():
+        response, instance = await gateway.send_upstream("documents", balancer, build_request, policy, retryable = True)
+        await response.aclose()
+        # Lets the cancelled attempt clean up
+        await asyncio.sleep(0.01)
+        return instance
+
+    assert asyncio.run(scenario()) is instances[1]
+    assert [instance.in_flight for instance in instances] == [0, 1]
+    assert policy.stats["hedged"] == 1 and policy.stats["hedges_won"] == 1
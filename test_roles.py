@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+from main import app
+from database import crud, models
+from internal.schemas import PermissionBase, RoleCreate, RolePermission
+
+
+@contextmanager
+def count_queries(engine):
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+@contextmanager
+def memory_session():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for index in range(10):
+            crud.create_permission(db, PermissionBase(name = f"service{index}:*"))
+        yield engine, db
+    engine.dispose()
+
+def test_create_role_resolves_permissions_in_one_query():
+    with memory_session() as (engine, db):
+        with count_queries(engine) as few:
+            crud.create_role(db, RoleCreate(name = "few", permissions = [1, "service1:*"]))
+        with count_queries(engine) as many:
+            crud.create_role(db, RoleCreate(name = "many", permissions = [1, 2, 3, 4, 5, "service5:*", "service6:*", "service7:*", 9, 10]))
+        assert len(few) == len(many)
+        selects = [statement for statement in many if statement.startswith("SELECT") and "permissions" in statement]
+        assert len(selects) == 1
+
+        role = crud.get_role_by_name(db, "many", with_permissions = True)
+        assert [permission.id for permission in role.permissions] == list(range(1, 11))
+
+        with pytest.raises(crud.PermissionNotFound, match = "missing"):
+            crud.create_role(db, RoleCreate(name = "broken", permissions = ["missing"]))
+
+def test_roles_with_permissions_load_in_constant_queries():
+    with memory_session() as (engine, db):
+        for index in range(20):
+            crud.create_role(db, RoleCreate(name = f"role{index}", permissions = [index % 10 + 1, (index + 1) % 10 + 1]))
+        db.expunge_all()
+
+        with count_queries(engine) as statements:
+            roles = crud.get_roles(db, limit = 100, with_permissions = True)
+            listed = [RolePermission.from_orm(role) for role in roles]
+        assert len(statements) == 2
+        assert len(listed) == 20
+        assert listed[0].permissions == ["service0:*", "service1:*"]
+
+def test_role_endpoints_include_permissions():
+    with TestClient(app) as client:
+        response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.get("/role", params = {"role_id": 2}, headers = headers)
+        assert response.status_code == 200
+        assert response.json()["permissions"] == ["*"]
+
+        response = client.get("/roles", headers = headers)
+        assert "permissions" not in response.json()[0]
+
+        response = client.get("/roles", params = {"with_permissions": True}, headers = headers)
+        assert {role["id"]: role["permissions"] for role in response.json()}[2] == ["*"]
+
+def test_create_role_with_unknown_permission_is_rejected(temp_database):
+    with TestClient(app) as client:
+        response = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.post("/create/roles", json = {"name": "broken", "permissions": ["*", "missing"]}, headers = headers)
+        assert (response.status_code, response.json()["detail"]) == (400, "Permission missing not found")
+
+        response = client.post("/create/roles", json = {"name": "reader", "permissions": ["*"]}, headers = headers)
+        assert response.status_code == 200
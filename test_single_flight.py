@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from internal.single_flight import CoalescingPolicy, SharedResponse, SingleFlight, owner, shareable
+
+
+def test_followers_share_the_response_of_the_leader():
+    async def scenario():
+        single_flight = SingleFlight(timeout = 1.0)
+        flight, leader = single_flight.join(("GET", "documents", "files/1", "", ()))
+        assert leader
+        waiters = [
+            asyncio.create_task(single_flight.wait(single_flight.join(flight.key)[0], {}, "1"))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0)
+        flight.finish(SharedResponse(200, [("content-type", "text/plain")], b"shared"))
+        responses = await asyncio.gather(*waiters)
+        # The next request for the key leads a new flight
+        assert single_flight.join(flight.key)[1]
+        return single_flight, responses
+
+    single_flight, responses = asyncio.run(scenario())
+    assert [response.body for response in responses] == [b"shared"] * 3
+    assert single_flight.stats["coalesced"] == 3 and single_flight.stats["shared"] == 3
+
+def test_followers_stop_waiting_for_a_slow_leader():
+    async def scenario():
+        single_flight = SingleFlight(timeout = 0.01)
+        flight, _ = single_flight.join(("GET", "documents", "slow", "", ()))
+        follower, leader = single_flight.join(flight.key)
+        assert not leader
+        return single_flight, await single_flight.wait(follower, {}, "1")
+
+    single_flight, response = asyncio.run(scenario())
+    assert response is None and single_flight.stats["timeouts"] == 1
+
+def test_followers_get_the_error_of_the_leader():
+    async def scenario():
+        single_flight = SingleFlight()
+        flight, _ = single_flight.join(("GET", "documents", "down", "", ()))
+        waiter = asyncio.create_task(single_flight.wait(single_flight.join(flight.key)[0], {}, "1"))
+        await asyncio.sleep(0)
+        flight.fail(HTTPException(status_code = 502, detail = "documents is unreachable"))
+        await waiter
+
+    with pytest.raises(HTTPException):
+        asyncio.run(scenario())
+
+def test_vary_key_and_shareable_responses():
+    policy = CoalescingPolicy("documents", routes = ["files/*"], vary_by_user = True)
+    assert policy.covers("files/1") and not policy.covers("users")
+    assert policy.vary_key({"accept": "application/json"}, "7") == ("application/json", "", "", "7")
+    assert not shareable({"cache-control": "private, max-age=60"})
+    assert not shareable({"vary": "*"})
+    assert SharedResponse(200, [], b"", vary = (("accept", "text/csv"),)).matches({"accept": "text/csv"})
+
+def test_authenticated_responses_are_only_shared_with_their_user():
+    credentials = {"authorization": "Bearer alice"}
+    assert owner({"cache-control": "max-age=60"}, credentials, "1") == "1"
+    assert owner({"cache-control": "public, max-age=60"}, credentials, "1") is None
+    assert owner({}, {}, "1") is None
+
+    async def scenario(headers):
+        single_flight = SingleFlight(timeout = 1.0)
+        flight, _ = single_flight.join(("GET", "documents", "me", "", ()))
+        alice, bob = (
+            asyncio.create_task(single_flight.wait(single_flight.join(flight.key)[0], {}, user_key))
+            for user_key in ("1", "2")
+        )
+        await asyncio.sleep(0)
+        flight.finish(SharedResponse(200, [], b"alice", principal = owner(headers, credentials, "1")))
+        return await alice, await bob
+
+    alice, bob = asyncio.run(scenario({}))
+    assert alice.body == b"alice" and bob is None
+    alice, bob = asyncio.run(scenario({"cache-control": "public"}))
+    assert alice.body == bob.body == b"alice"
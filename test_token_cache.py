@@ -0,0 +1,55 @@
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import models
+from internal.schemas import User
+from internal.token_cache import TokenCache, token_cache
+
+
+def make_user(user_id: int) -> User:
+    return User(id = user_id, username = "user", full_name = "user", email = f"user{user_id}@example.com")
+
+def test_entry_expires_with_the_token():
+    cache = TokenCache(ttl = 60)
+    cache.put("live", make_user(1), time.time() + 30)
+    cache.put("expired", make_user(1), time.time() - 1)
+    assert cache.get("live").id == 1
+    assert cache.get("expired") is None
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TokenCache(max_size = 2)
+    cache.put("a", make_user(1))
+    cache.put("b", make_user(2))
+    cache.get("a")
+    cache.put("c", make_user(3))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert len(cache) == 2
+
+def test_key_depends_on_the_signing_key():
+    assert TokenCache.key("token", "old") != TokenCache.key("token", "new")
+
+def test_role_change_and_deactivation_invalidate_cached_tokens():
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(bind = engine)
+    session = sessionmaker(bind = engine)()
+    db_user = models.User(username = "user", full_name = "user", email = "user@example.com", role_id = 1)
+    session.add(db_user)
+    session.commit()
+
+    token_cache.put("token", User.from_orm(db_user))
+    db_user.username = "renamed"
+    session.commit()
+    assert token_cache.get("token") is not None
+
+    db_user.role_id = 2
+    session.commit()
+    assert token_cache.get("token") is None
+
+    token_cache.put("token", User.from_orm(db_user))
+    db_user.is_active = False
+    session.commit()
+    assert token_cache.get("token") is None
+    session.close()
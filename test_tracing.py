@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+from internal.http_client import UpstreamClients
+from internal.load_balancer import UpstreamInstance
+from internal.retry import RetryPolicy
+from internal.tracing import JsonLinesExporter, NOOP_SPAN, Tracer, parse_traceparent, tracer, unsampled_parent
+from main import app
+from router import gateway
+
+
+CLIENT_TRACEPARENT = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+def test_parse_traceparent():
+    assert parse_traceparent(CLIENT_TRACEPARENT) == ("0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331", True)
+    assert parse_traceparent("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00")[2] is False
+    assert parse_traceparent("00-" + "0" * 32 + "-b7ad6b7169203331-01") is None
+    assert parse_traceparent("garbage") is None
+
+def test_sampling_follows_the_client_then_the_rate(tmp_path):
+    sampler = Tracer(sample_rate = 0.0, exporter = JsonLinesExporter(str(tmp_path / "traces.jsonl")))
+    assert sampler.start_trace("GET") is NOOP_SPAN
+    assert sampler.start_trace("GET", CLIENT_TRACEPARENT).trace_id == "0af7651916cd43dd8448eb211c80319c"
+    sampler.sample_rate = 1.0
+    assert sampler.start_trace("GET", "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00") is NOOP_SPAN
+    assert sampler.start_trace("GET") is not NOOP_SPAN
+
+def test_spans_cover_auth_and_queries(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    with TestClient(app) as client:
+        token = client.post("/token", data = {"username": "fakemail@fmail.com", "password": "admin"}).json()["access_token"]
+        tracer.exporter, tracer.sample_rate = JsonLinesExporter(str(path)), 0.0
+        try:
+            client.get("/users", headers = {"Authorization": f"Bearer {token}", "traceparent": CLIENT_TRACEPARENT})
+            spans = list(tracer._queue)
+        finally:
+            tracer._queue.clear()
+            tracer.exporter = None
+
+    assert {span["trace_id"] for span in spans} == {"0af7651916cd43dd8448eb211c80319c"}
+    by_name = {span["name"]: span for span in spans}
+    root = by_name["GET /users"]
+    assert root["parent_id"] == "b7ad6b7169203331" and root["attributes"]["http.status_code"] == 200
+    auth = by_name["auth.get_current_user"]
+    assert auth["parent_id"] == root["span_id"]
+    assert any(span["name"] == "db.query" and span["parent_id"] == auth["span_id"] for span in spans)
+
+def test_upstream_calls_continue_the_trace(monkeypatch):
+    received = []
+
+    async def upstream(request: httpx.Request):
+        received.append(request.headers.get("traceparent"))
+
+        async def body():
+            yield b"ok"
+        return httpx.Response(200, content = body())
+
+    clients = UpstreamClients()
+    clients._started = True
+    clients._clients[("documents", "http://documents.local")] = httpx.AsyncClient(
+        base_url = "http://documents.local", transport = httpx.MockTransport(upstream)
+    )
+    monkeypatch.setattr(gateway, "upstream_clients", clients)
+    monkeypatch.setattr(tracer, "exporter", JsonLinesExporter())
+
+    async def scenario():
+        with tracer.start_trace("GET", CLIENT_TRACEPARENT) as root:
+            response = await gateway.send_attempt(
+                "documents", None, UpstreamInstance("http://documents.local"),
+                lambda client: client.build_request("GET", "/files/1"), RetryPolicy("documents"),
+            )
+            await response.aclose()
+        return root
+
+    root = asyncio.run(scenario())
+    upstream_span = tracer._queue[0]
+    tracer._queue.clear()
+    assert upstream_span["name"] == "upstream" and upstream_span["parent_id"] == root.span_id
+    assert received == [f"00-{root.trace_id}-{upstream_span['span_id']}-01"]
+
+def test_unsampled_calls_forward_the_trace_unsampled(monkeypatch):
+    received = []
+
+    async def upstream(request: httpx.Request):
+        received.append(request.headers.get("traceparent"))
+
+        async def body():
+            yield b"ok"
+        return httpx.Response(200, content = body())
+
+    clients = UpstreamClients()
+    clients._started = True
+    clients._clients[("documents", "http://documents.local")] = httpx.AsyncClient(
+        base_url = "http://documents.local", transport = httpx.MockTransport(upstream)
+    )
+    monkeypatch.setattr(gateway, "upstream_clients", clients)
+
+    async def scenario(traceparent):
+        token = unsampled_parent.set(traceparent)
+        try:
+            response = await gateway.send_attempt(
+                "documents", None, UpstreamInstance("http://documents.local"),
+                lambda client: client.build_request("GET", "/files/1"), RetryPolicy("documents"),
+            )
+            await response.aclose()
+        finally:
+            unsampled_parent.reset(token)
+
+    asyncio.run(scenario("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00"))
+    asyncio.run(scenario(""))
+    assert received[0] == "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-00"
+    assert parse_traceparent(received[1])[2] is False